@@ -5,6 +5,7 @@ from sys import argv
 from os import path
 
 from scg_tools.ma4 import CHKFMAP, Chunk
+from scg_tools import trace
 
 def get(chkfmap: CHKFMAP, tid1: bytes, tid2: bytes | None = None) -> Chunk | None:
     try:
@@ -34,16 +35,17 @@ def compare_chunk(chkfmap_a: CHKFMAP, chkfmap_b: CHKFMAP, tid1: bytes, tid2: byt
 #
 
 def help(progname: str) -> None:
-    print(f"Usage: {progname} <MA4 filepath A> <MA4 filepath B>")
+    print(f"Usage: {progname} [--quiet] [--trace FILE] <MA4 filepath A> <MA4 filepath B>")
 #
 
 def main() -> int:
-    if len(argv) < 3:
+    args = trace.configure_from_argv(argv[1:])
+    if len(args) < 2:
         help(path.basename(argv[0]))
         return 1
     
-    chkfmap_a = CHKFMAP(); chkfmap_a.parse(open(argv[1], "rb"))
-    chkfmap_b = CHKFMAP(); chkfmap_b.parse(open(argv[2], "rb"))
+    chkfmap_a = CHKFMAP(); chkfmap_a.parse(args[0])
+    chkfmap_b = CHKFMAP(); chkfmap_b.parse(args[1])
 
     print("//////////////////////////////////////////////////////")
     print("COMPARISON:")
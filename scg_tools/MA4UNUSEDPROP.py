@@ -7,18 +7,19 @@ from os import path
 
 from scg_tools.ma4 import CHKFMAP, DATA, GCGM, CANM, data_id_translation, codepage
 from scg_tools.misc import decode_c_string
+from scg_tools import trace
 
 def help(progname: str) -> None:
-    print(f"Usage: {progname} <MA4 filepath>")
+    print(f"Usage: {progname} [--quiet] [--trace FILE] <MA4 filepath>")
 #
 
 def main() -> int:
-    if len(argv) < 2:
+    args = trace.configure_from_argv(argv[1:])
+    if len(args) < 1:
         help(path.basename(argv[0]))
         return 1
     
-    with open(argv[1], "rb") as f:
-        chkfmap = CHKFMAP(); chkfmap.parse(f)
+    chkfmap = CHKFMAP(); chkfmap.parse(args[0])
     
     data_chunk: DATA = chkfmap.at(b'MAP_').at(b'DATA')
     gcgm_chunk: GCGM = chkfmap.at(b'CELS').at(b'GCGM')
@@ -1,45 +1,285 @@
 # Copyright 2023 Bradley G (Minty Meeo)
 # SPDX-License-Identifier: MIT
 
-from os import path
-from sys import argv
+from __future__ import annotations
+from argparse import ArgumentParser
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import blake2b
+from os import cpu_count, getpid, makedirs, replace
+from pathlib import Path
+from struct import pack
+from time import perf_counter
+import json
 
-from scg_tools.misc import open_helper
-from scg_tools.santacruz_tex import parse_psxtexfile, decode_psxtexfile_solo
-from scg_tools.santacruz_txg import GCMaterial, write_gcmaterials
+import numpy as np
+from scg_tools.misc import find_psxtexfiles, open_helper, map_file
+from scg_tools.tex import PSXTexFileReader, decode_psxtexfile_rgba
+from scg_tools.txg import GCMaterial, GCMaterialsReader, cmpr_qualities, cmpr_error, encode_cmpr, write_gcmaterials
+from scg_tools import trace
 
-def help(progname: str) -> None:
-    print(f"Converts a PSXtexfile (*.tex) into a GCMaterials file (*.txg) with RGBA32 format textures.\n"
-          f"Usage: {progname} [PSXtexfile path] [GCMaterials path]")
+manifest_version = 1
+
+def gcmaterial_size(mode: int, width: int, height: int) -> int:
+    return width * height * 4 if mode else width * height // 2  # RGBA32 vs CMPR bpp
+#
+
+# CMPR only has punch-through alpha and sizes in whole 8x8 tiles, so anything else has to stay RGBA32.  For the
+# rest, a fast trial encode decides whether CMPR looks close enough.
+def select_gcmaterial_mode(pixels: np.ndarray, cmpr_threshold: float) -> tuple[int, bytes | None]:
+    height, width = pixels.shape[:2]
+    if width % 8 or height % 8:
+        return (1, None)
+    alpha = pixels[..., 3]
+    if ((alpha != 0) & (alpha != 255)).any():
+        return (1, None)
+    trial = encode_cmpr(pixels, "fast")
+    if cmpr_error(pixels, trial) > cmpr_threshold:
+        return (1, None)
+    return (0, trial)
+#
+
+# Without a cmpr_threshold, unk1 is used as the GCMaterial mode like the original TEX2TXG did.
+def convert_texture(mode: int, unk1: int, width: int, height: int, data: bytes, palette: bytes, cmpr_quality: str, cmpr_threshold: float | None = None) -> GCMaterial:
+    pixels = decode_psxtexfile_rgba(mode, data, palette, width, height, color_key = True)
+    if cmpr_threshold is None:
+        return GCMaterial.encode_rgba(pixels, unk1, cmpr_quality)
+    [gc_mode, trial] = select_gcmaterial_mode(pixels, cmpr_threshold)
+    if trial is not None and cmpr_quality == "fast":
+        return GCMaterial(0, 0, 0, 0, width, height, trial)
+    return GCMaterial.encode_rgba(pixels, gc_mode, cmpr_quality)
+#
+
+def print_bytes_saved(name: str, baseline_size: int, gcmaterials: list[GCMaterial]):
+    size = sum(len(gcmaterial.data) for gcmaterial in gcmaterials)
+    cmpr_count = sum(gcmaterial.mode == 0 for gcmaterial in gcmaterials)
+    print("{:s}: {:d} of {:d} textures CMPR, {:d} bytes saved ({:d} -> {:d})".format(
+        name, cmpr_count, len(gcmaterials), baseline_size - size, baseline_size, size))
+#
+
+def hash_file(path: Path) -> str:
+    with open(path, "rb") as f:
+        return blake2b(map_file(f), digest_size = 20).hexdigest()
+#
+
+# Covers everything convert_texture looks at, so equal keys always convert to equal GCMaterials.
+def texture_key(mode: int, unk1: int, width: int, height: int, data: bytes, palette: bytes) -> str:
+    hasher = blake2b(digest_size = 20)
+    hasher.update(pack("<iiII", mode, unk1, width, height))
+    hasher.update(data)
+    if mode == 0:
+        hasher.update(palette[:32])
+    elif mode == 1:
+        hasher.update(palette)
+    return hasher.hexdigest()
+#
+
+def load_manifest(manifest_path: Path) -> dict:
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return {}
+    if manifest.get("version") != manifest_version:
+        return {}
+    return manifest["files"]
 #
 
-def blue_to_alpha(pixel: tuple[int]):
-    if pixel == (0, 0, 255, 255):
-        return (0, 0, 255, 0)
-    return pixel
+def store_manifest(manifest_path: Path, files: dict):
+    makedirs(manifest_path.parent, exist_ok=True)
+    temp_path = manifest_path.with_suffix(".{:d}.tmp".format(getpid()))
+    with open(temp_path, "w") as f:
+        json.dump({"version": manifest_version, "files": files}, f, indent="  ", sort_keys=True)
+    replace(temp_path, manifest_path)
+#
+
+# One PSXtexfile that needs (re)converting.  Textures are either GCMaterials reused from the previous output
+# or futures for ones still being encoded by the workers.
+class TreeErrand(object):
+    def __init__(self, relpath: str, ofile_path: Path, input_hash: str, keys: list[str], textures: list[GCMaterial | Future], baseline_size: int):
+        self.relpath       = relpath
+        self.ofile_path    = ofile_path
+        self.input_hash    = input_hash
+        self.keys          = keys
+        self.textures      = textures
+        self.baseline_size = baseline_size  # What the GCMaterials file would hold with unk1 as the mode
+    #
+
+    def finish(self, options: dict) -> dict:
+        gcmaterials = [texture.result() if isinstance(texture, Future) else texture for texture in self.textures]
+        makedirs(self.ofile_path.parent, exist_ok=True)
+        # Written under a temporary name first so that an interrupted run never leaves a partial file behind.
+        temp_path = self.ofile_path.with_suffix(".{:d}.tmp".format(getpid()))
+        with open(temp_path, "wb") as f:
+            write_gcmaterials(f, gcmaterials)
+        replace(temp_path, self.ofile_path)
+        if options["cmpr_threshold"] is not None:
+            print_bytes_saved(self.relpath, self.baseline_size, gcmaterials)
+        return {"input": self.input_hash, "options": options, "output": hash_file(self.ofile_path), "textures": self.keys}
+    #
+#
+
+def convert_tree(src: str, dst: str, manifest_path: Path, cmpr_quality: str, cmpr_threshold: float | None, jobs: int | None) -> int:
+    time_begin = perf_counter()
+    options = {"cmpr_quality": cmpr_quality, "cmpr_threshold": cmpr_threshold}
+    old_files = load_manifest(manifest_path)
+    new_files = dict[str, dict]()
+    inputs = find_psxtexfiles(src)
+    converted_count = encoded_count = reused_count = 0
+    workers = jobs if jobs else cpu_count()
+
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque[TreeErrand]()
+        in_flight = 0
+        for [ifile_path, relpath] in inputs:
+            relpath = relpath.as_posix()
+            ofile_path = Path(dst, relpath).with_suffix(".txg")
+            entry = old_files.get(relpath)
+            with open(ifile_path, "rb") as f:
+                buffer = map_file(f)
+            input_hash = blake2b(buffer, digest_size = 20).hexdigest()
+
+            # The previous output is only trusted if it is exactly what the manifest says was written.
+            old_textures = dict[str, GCMaterial]()
+            if entry is not None and entry["options"] == options and ofile_path.is_file() and hash_file(ofile_path) == entry["output"]:
+                if entry["input"] == input_hash:
+                    new_files[relpath] = entry
+                    continue
+                with open(ofile_path, "rb") as f:
+                    old_reader = GCMaterialsReader.open(f)
+                if len(old_reader) == len(entry["textures"]):
+                    for [key, gcmaterial] in zip(entry["textures"], old_reader):
+                        old_textures[key] = GCMaterial(gcmaterial.mode, gcmaterial.xfad, gcmaterial.blend, gcmaterial.pad, gcmaterial.width, gcmaterial.height, bytes(gcmaterial.data))
+
+            print(ifile_path)
+            keys = list[str]()
+            textures = list[GCMaterial | Future]()
+            baseline_size = 0
+            for [mode, unk1, unk2, width, height, data, palette] in PSXTexFileReader(buffer):
+                key = texture_key(mode, unk1, width, height, data, palette)
+                keys.append(key)
+                baseline_size += gcmaterial_size(unk1, width, height)
+                if key in old_textures:
+                    textures.append(old_textures[key])
+                    reused_count += 1
+                else:
+                    textures.append(executor.submit(convert_texture, mode, unk1, width, height, bytes(data), bytes(palette), cmpr_quality, cmpr_threshold))
+                    encoded_count += 1
+                    in_flight += 1
+            pending.append(TreeErrand(relpath, ofile_path, input_hash, keys, textures, baseline_size))
+            converted_count += 1
+            # Bounds how many encoded textures are waiting on earlier files to be written.
+            while in_flight >= workers * 4:
+                errand = pending.popleft()
+                new_files[errand.relpath] = errand.finish(options)
+                in_flight -= sum(isinstance(texture, Future) for texture in errand.textures)
+        while len(pending) != 0:
+            errand = pending.popleft()
+            new_files[errand.relpath] = errand.finish(options)
+
+    # Outputs of inputs that have gone away are removed, but only if they are still exactly what was written and
+    # no remaining input now converts to the same path.  Anything else is reported and left alone.
+    removed_count = 0
+    ofile_paths = {Path(dst, relpath).with_suffix(".txg") for relpath in new_files}
+    for [relpath, entry] in old_files.items():
+        ofile_path = Path(dst, relpath).with_suffix(".txg")
+        if relpath in new_files or ofile_path in ofile_paths or not ofile_path.is_file():
+            continue
+        if hash_file(ofile_path) == entry["output"]:
+            print("Removed {:s}".format(str(ofile_path)))
+            ofile_path.unlink()
+            removed_count += 1
+        else:
+            trace.warning("stale_output", "Warning: {:s} was modified after its input was removed, so it was left in place".format(str(ofile_path)), path=str(ofile_path))
+
+    store_manifest(manifest_path, new_files)
+    elapsed = perf_counter() - time_begin
+    print("{:d} files ({:d} converted, {:d} up to date, {:d} removed), {:d} textures encoded, {:d} reused in {:.2f}s".format(
+        len(inputs), converted_count, len(inputs) - converted_count, removed_count, encoded_count, reused_count, elapsed))
+    return 0
 #
 
 def main() -> int:
-    progname = path.basename(argv[0])
-    if len(argv) < 3:
-        help(progname)
+    parser = ArgumentParser(description = "Converts a PSXtexfile (*.tex) into a GCMaterials file (*.txg) with CMPR or RGBA32 format textures.",
+                            epilog = "With --tree, every PSXtexfile under SRC is converted to a GCMaterials file at the same relative path under DST. "
+                                     "A manifest of input, option, and output hashes lets later runs skip files that have not changed and reuse unchanged textures within files that have.")
+    parser.add_argument("input",
+        action="store",
+        nargs="?",
+        help="Input filepath of the PSXtexfile (*.tex).",
+        metavar="PSXTEXFILE_PATH")
+    parser.add_argument("output",
+        action="store",
+        nargs="?",
+        help="Output filepath of the GCMaterials file (*.txg).",
+        metavar="GCMATERIALS_PATH")
+    parser.add_argument("-q", "--cmpr-quality",
+        action="store",
+        type=str,
+        dest="cmpr_quality",
+        help="Encoder tier for textures that end up as CMPR. The default is \"quality\".",
+        choices=cmpr_qualities,
+        default="quality")
+    parser.add_argument("-a", "--auto-format",
+        action="store_true",
+        dest="auto_format",
+        help="Choose CMPR or RGBA32 for each texture instead of using unk1. CMPR is chosen when the texture has no partial transparency and a trial encode is within --cmpr-threshold.")
+    parser.add_argument("--cmpr-threshold",
+        action="store",
+        type=float,
+        dest="cmpr_threshold",
+        help="Largest root-mean-square error (0-255 scale) of a trial CMPR encode that --auto-format accepts. The default is 6.",
+        metavar="RMSE",
+        default=6.0)
+    parser.add_argument("--tree",
+        action="store",
+        nargs=2,
+        type=str,
+        dest="tree",
+        help="Convert every PSXtexfile (*.tex) found under SRC into DST, skipping work that the manifest shows is already done.",
+        metavar=("SRC", "DST"))
+    parser.add_argument("--manifest",
+        action="store",
+        type=str,
+        dest="manifest",
+        help="Manifest filepath for --tree. The default is \"TEX2TXG_manifest.json\" in DST.",
+        metavar="MANIFEST_PATH")
+    parser.add_argument("-j", "--jobs",
+        action="store",
+        type=int,
+        dest="jobs",
+        help="Number of worker processes for --tree. The default is the number of processors.",
+        metavar="N")
+    trace.add_arguments(parser)
+    options = parser.parse_args()
+    trace.configure(options.quiet, options.trace_path)
+    cmpr_threshold = options.cmpr_threshold if options.auto_format else None
+
+    if options.tree:
+        [src, dst] = options.tree
+        manifest_path = Path(options.manifest) if options.manifest else Path(dst, "TEX2TXG_manifest.json")
+        return convert_tree(src, dst, manifest_path, options.cmpr_quality, cmpr_threshold, options.jobs)
+
+    if options.input is None or options.output is None:
+        parser.print_help()
         return 1
-    tex_path = argv[1]
-    txg_path = argv[2]
+    tex_path: str = options.input
+    txg_path: str = options.output
 
     with open(tex_path, "rb") as f:
-        psx_textures = parse_psxtexfile(f)
-    
+        psx_textures = PSXTexFileReader.open(f)
+
     gcmaterials = list[GCMaterial]()
+    baseline_size = 0
     for [mode, unk1, unk2, width, height, data, palette] in psx_textures:
-        image = decode_psxtexfile_solo(mode, data, palette, width, height)
-        if image.mode != "RGBA":
-            image = image.convert("RGBA")  # There has got to be a faster way to do this...
-            image.putdata([blue_to_alpha(pixel) for pixel in image.getdata()])
-        gcmaterials.append(GCMaterial.encode(image, unk1))
+        gcmaterials.append(convert_texture(mode, unk1, width, height, data, palette, options.cmpr_quality, cmpr_threshold))
+        baseline_size += gcmaterial_size(unk1, width, height)
+    if cmpr_threshold is not None:
+        print_bytes_saved(tex_path, baseline_size, gcmaterials)
 
     with open_helper(txg_path, "wb", make_dirs = True, overwrite = True) as f:
         write_gcmaterials(f, gcmaterials)
+    return 0
 #
 
 if __name__ == "__main__":
@@ -16,4 +16,4 @@ __entry_points__ = {
     ],
 }
 
-__requires__ = ["PIL", "gclib", "more_itertools"]
+__requires__ = ["PIL", "more_itertools", "numpy"]
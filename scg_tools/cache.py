@@ -0,0 +1,133 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from collections import OrderedDict
+from hashlib import blake2b
+from os import environ, getpid, makedirs, replace
+from pathlib import Path
+from struct import unpack, pack
+from typing import Callable
+
+from PIL import Image
+
+# Bytes per pixel of the image modes that decoders produce.
+pixel_sizes = {"L": 1, "P": 1, "RGB": 3, "RGBA": 4}
+
+# Decoded textures keyed by a hash of everything that affects decoding.  Lookups go to an in-process LRU
+# first, then to an optional directory on disk that can be shared between runs and processes.
+class DecodeCache(object):
+    def __init__(self, memory_budget: int = 64 << 20, directory: str | None = None):
+        self.memory_budget = memory_budget
+        self.memory_used = 0
+        self.directory = directory
+        self.entries = OrderedDict[bytes, tuple[str, int, int, bytes, bytes]]()
+    #
+
+    @staticmethod
+    def make_key(format: str, mode: int, width: int, height: int, data: bytes, palette: bytes | None) -> bytes:
+        hasher = blake2b(digest_size = 20)
+        hasher.update(pack("<16siIIQ", format.encode(), mode, width, height, len(data)))
+        hasher.update(data)
+        if palette is not None:
+            hasher.update(palette)
+        return hasher.digest()
+    #
+
+    def get(self, key: bytes) -> Image.Image | None:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self.directory is not None:
+            entry = self.load(key)
+            if entry is not None:
+                self.remember(key, entry)
+        if entry is None:
+            return None
+        [mode, width, height, pixels, palette] = entry
+        image = Image.frombytes(mode, (width, height), pixels)
+        if len(palette) != 0:
+            image.putpalette(palette, "RGB")
+        return image
+    #
+
+    def put(self, key: bytes, image: Image.Image):
+        palette = bytes(image.getpalette("RGB")) if image.mode == "P" else b''
+        entry = (image.mode, image.width, image.height, image.tobytes(), palette)
+        self.remember(key, entry)
+        if self.directory is not None:
+            self.store(key, entry)
+    #
+
+    def remember(self, key: bytes, entry: tuple[str, int, int, bytes, bytes]):
+        size = len(entry[3]) + len(entry[4])
+        if size > self.memory_budget:
+            return
+        if key in self.entries:
+            return
+        self.entries[key] = entry
+        self.memory_used += size
+        while self.memory_used > self.memory_budget:
+            [_, evicted] = self.entries.popitem(last = False)
+            self.memory_used -= len(evicted[3]) + len(evicted[4])
+    #
+
+    def load(self, key: bytes) -> tuple[str, int, int, bytes, bytes] | None:
+        try:
+            with open(Path(self.directory, key.hex()), "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return None
+        entry = DecodeCache.unpack_entry(raw)
+        if entry is None:
+            # Truncated or corrupt, e.g. by a full disk, so it is dropped and decoded afresh.
+            Path(self.directory, key.hex()).unlink(missing_ok = True)
+        return entry
+    #
+
+    @staticmethod
+    def unpack_entry(raw: bytes) -> tuple[str, int, int, bytes, bytes] | None:
+        if len(raw) < 16:
+            return None
+        [mode, width, height, palette_size] = unpack("<4sIII", raw[:16])
+        try:
+            mode = mode.rstrip(b'\0').decode()
+        except UnicodeDecodeError:
+            return None
+        if mode not in pixel_sizes or 16 + palette_size > len(raw):
+            return None
+        if palette_size % 3 != 0 or palette_size > 768 or (palette_size != 0) != (mode == "P"):
+            return None
+        if len(raw) - 16 - palette_size != width * height * pixel_sizes[mode]:
+            return None
+        return (mode, width, height, raw[16 + palette_size:], raw[16:16 + palette_size])
+    #
+
+    def store(self, key: bytes, entry: tuple[str, int, int, bytes, bytes]):
+        [mode, width, height, pixels, palette] = entry
+        makedirs(self.directory, exist_ok=True)
+        # Written under a temporary name first so that other processes never see a partial file.
+        path = Path(self.directory, key.hex())
+        temp_path = path.with_suffix(".{:d}.tmp".format(getpid()))
+        with open(temp_path, "wb") as f:
+            f.write(pack("<4sIII", mode.encode(), width, height, len(palette)))
+            f.write(palette)
+            f.write(pixels)
+        replace(temp_path, path)
+    #
+#
+
+decode_cache = DecodeCache(directory = environ.get("SCG_TOOLS_CACHE_DIR"))
+
+def set_cache_directory(directory: str | None):
+    decode_cache.directory = directory
+#
+
+def cached_decode(format: str, mode: int, width: int, height: int, data: bytes, palette: bytes | None, decode: Callable[[], Image.Image]) -> Image.Image:
+    key = DecodeCache.make_key(format, mode, width, height, data, palette)
+    image = decode_cache.get(key)
+    if image is None:
+        image = decode()
+        decode_cache.put(key, image)
+    return image
+#
@@ -0,0 +1,54 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from struct import unpack, pack
+from typing import BinaryIO
+
+from scg_tools.misc import read_exact, align_up
+
+# Only what is needed to move BC1 (DXT1) payloads in and out of DirectDraw Surface files.
+DDSD_CAPS        = 0x1
+DDSD_HEIGHT      = 0x2
+DDSD_WIDTH       = 0x4
+DDSD_PIXELFORMAT = 0x1000
+DDSD_LINEARSIZE  = 0x80000
+DDPF_FOURCC      = 0x4
+DDSCAPS_TEXTURE  = 0x1000
+
+DXGI_FORMAT_BC1_UNORM      = 71
+DXGI_FORMAT_BC1_UNORM_SRGB = 72
+
+class DDSError(Exception):
+    pass
+#
+
+def bc1_data_size(width: int, height: int) -> int:
+    return align_up(width, 4) // 4 * align_up(height, 4) // 4 * 8
+#
+
+def parse_dds_bc1(io: BinaryIO) -> tuple[int, int, bytes]:
+    [magic, size, flags, height, width, pitch, depth, mipmap_count] = unpack("<4sIIIIIII", read_exact(io, 32))
+    if magic != b'DDS ' or size != 124:
+        raise DDSError("Not a DirectDraw Surface file.")
+    read_exact(io, 44)  # Reserved
+    [pf_size, pf_flags, fourcc, bit_count, r_mask, g_mask, b_mask, a_mask] = unpack("<II4sIIIII", read_exact(io, 32))
+    read_exact(io, 20)  # Caps and reserved
+    if not pf_flags & DDPF_FOURCC:
+        raise DDSError("DirectDraw Surface is not block compressed.")
+    if fourcc == b'DX10':
+        [dxgi_format, dimension, misc_flag, array_size, misc_flags2] = unpack("<IIIII", read_exact(io, 20))
+        if dxgi_format not in (DXGI_FORMAT_BC1_UNORM, DXGI_FORMAT_BC1_UNORM_SRGB):
+            raise DDSError("Unsupported DXGI format: {:d}.".format(dxgi_format))
+    elif fourcc != b'DXT1':
+        raise DDSError("Unsupported FourCC: {}.".format(fourcc))
+    # Only the top mipmap level is kept.
+    return (width, height, read_exact(io, bc1_data_size(width, height)))
+#
+
+def write_dds_bc1(io: BinaryIO, width: int, height: int, data: bytes):
+    io.write(pack("<4sIIIIIII44x", b'DDS ', 124, DDSD_CAPS | DDSD_HEIGHT | DDSD_WIDTH | DDSD_PIXELFORMAT | DDSD_LINEARSIZE, height, width, bc1_data_size(width, height), 0, 0))
+    io.write(pack("<II4sIIIII", 32, DDPF_FOURCC, b'DXT1', 0, 0, 0, 0, 0))
+    io.write(pack("<IIIII", DDSCAPS_TEXTURE, 0, 0, 0, 0))
+    io.write(data)
+#
@@ -6,6 +6,7 @@ from struct import unpack
 from typing import BinaryIO, TextIO
 
 from scg_tools.misc import read_exact, tristrip_walk_new
+from scg_tools import trace
 
 class GCMesh(object):
     class Mesh(object):
@@ -74,9 +75,9 @@ class GCMesh(object):
         vtx_pos_nrm_count = (vtx_uv_coord_offs - vtx_pos_nrm_offs) // 24
         assert vtx_pos_nrm_count == vtx_count
         vtx_uv_coord_count = (vtx_color0_offs - vtx_uv_coord_offs) // 8
-        if vtx_uv_coord_count != vtx_count: print("vtx_count != texture coordinate count")
+        if vtx_uv_coord_count != vtx_count: trace.warning("vtx_count_mismatch", "vtx_count != texture coordinate count", vtx_count=vtx_count, count=vtx_uv_coord_count)
         vtx_color0_count = (primitive_meta_offs - vtx_color0_offs) // 4
-        if vtx_uv_coord_count != vtx_count: print("vtx_count != vertex color count")
+        if vtx_color0_count != vtx_count: trace.warning("vtx_count_mismatch", "vtx_count != vertex color count", vtx_count=vtx_count, count=vtx_color0_count)
 
         io.seek(joint_offs)
         joints = [unpack(f"{endian}iiii", read_exact(io, 16)) for _ in range(joint_count)]
@@ -3,15 +3,59 @@
 
 from __future__ import annotations
 from binascii import hexlify, unhexlify
+from concurrent.futures import Future, ProcessPoolExecutor
 from io import BytesIO
-from struct import unpack, pack
-from typing import BinaryIO, TextIO
+from mmap import mmap
+from os import PathLike
+from struct import unpack, unpack_from, pack, iter_unpack, error as struct_error
+from time import perf_counter
+from typing import BinaryIO, TextIO, Callable
 
-from scg_tools.misc import read_exact, read_c_string, decode_c_string, align_up, tristrip_walk
-from scg_tools.tex import parse_psxtexfile, write_psxtexfile
+import numpy as np
+from scg_tools.misc import ViewReader, read_exact, read_view, map_file, write_file_range, read_c_string, decode_c_string, align_up, tristrip_walk
+from scg_tools.tex import PSXTexFileReader, write_psxtexfile
+from scg_tools import trace
 
 codepage = "windows-1250"
 
+# Which vertex attribute format props are read and written in.  The old format (floats instead of fixed-point) is
+# used by Pickles World 2 Levels 1-4.  Each parse carries its own context, so maps of both formats can be worked on
+# side by side, in threads or worker processes.
+class FormatContext(object):
+    # old_format_parse=None detects the format of each prop from its header offsets.
+    # old_format_write=None writes each prop in the format it was read in.
+    # trusted skips sanity checks while parsing, for files that CHKFMAP.validate() has already passed.
+    def __init__(self, old_format_parse: bool | None = False, old_format_write: bool | None = False, trusted: bool = False):
+        self.old_format_parse = old_format_parse
+        self.old_format_write = old_format_write
+        self.trusted = trusted
+    #
+
+    # Whether props read with this context would be written back out unchanged.
+    def raw_is_current(self) -> bool:
+        return self.old_format_write is None or self.old_format_parse == self.old_format_write
+    #
+
+    def write_old_format(self, prop: Prop) -> bool:
+        return prop.old_format if self.old_format_write is None else self.old_format_write
+    #
+
+    def __repr__(self) -> str:
+        return "FormatContext(old_format_parse={}, old_format_write={}, trusted={})".format(self.old_format_parse, self.old_format_write, self.trusted)
+    #
+#
+
+# Prop vertex data is followed by padding of up to this many bytes less one.
+vertex_alignment = 32
+
+vertex_fields = ("u", "v", "x", "y", "z", "xn", "yn", "zn", "r", "g", "b", "a")
+
+# UV coords, XYZ pos, XYZ normal(?), RGBA.  The old format has 32-bit floats where the new one has 16-bit integers.
+def vertex_dtype(endian, old_format: bool) -> np.dtype:
+    component = f"{endian}f4" if old_format else f"{endian}i2"
+    return np.dtype([(field, component) for field in vertex_fields[:8]] + [(field, np.uint8) for field in vertex_fields[8:]])
+#
+
 class Prop(object):
     class Mesh(object):
         def __init__(self, material_idx: int, primitive_data: list):
@@ -24,42 +68,79 @@ class Prop(object):
         #
     #
 
-    old_format_parse = False
-    old_format_write = False
-
-    def __init__(self, vertexes: list, meshes: list[Prop.Mesh], name: bytes):
+    # vertexes is a structured array (see vertex_dtype) rather than the list of 12-tuples it used to be.  Its elements
+    # are np.void records: they unpack into NumPy scalars, do not compare equal to tuples, and the array cannot be
+    # appended to.  vertexes.tolist() gives the old list of tuples, and a sequence of 12-tuples is accepted here.
+    # Parsed props hold read-only views of the file until their chunk is marked dirty, which makes copies of them.
+    def __init__(self, vertexes: np.ndarray | list, meshes: list[Prop.Mesh], name: bytes, old_format: bool = False):
+        if not isinstance(vertexes, np.ndarray):
+            vertexes = np.array([tuple(vtx) for vtx in vertexes], dtype=vertex_dtype("<", old_format))
         self.vertexes = vertexes
         self.meshes = meshes
         self.name = name
+        self.old_format = old_format  # The vertex attribute format of vertexes
+    #
+
+    # Copies vertexes if they are a read-only view of the file, so that they can be edited in place.
+    def make_writeable(self):
+        if not self.vertexes.flags.writeable:
+            self.vertexes = self.vertexes.copy()
+    #
+
+    # The vertex attribute format can be told apart by the space between the vertexes and the primitive meta, which
+    # may include up to vertex_alignment - 1 bytes of padding.  None means the space fits both formats, as it does
+    # for a prop without vertexes, so the format has to be taken from elsewhere (see PropList.parse).
+    @staticmethod
+    def detect_old_format(vtx_count: int, vtx_base: int, primitive_meta_base: int) -> bool | None:
+        stride = primitive_meta_base - vtx_base
+        if vtx_count != 0:
+            if stride == vtx_count * 36:
+                return True
+            if stride == vtx_count * 20:
+                return False
+        fits_old = 0 <= stride - vtx_count * 36 < vertex_alignment
+        fits_new = 0 <= stride - vtx_count * 20 < vertex_alignment
+        if fits_old != fits_new:
+            return fits_old
+        if fits_old:
+            return None
+        raise CHKFMAPError("Prop vertex stride does not match either vertex attribute format ({:d} bytes for {:d} vertexes)".format(stride, vtx_count))
+    #
+
+    # The vertex attribute format a prop's header points to, or None if it can't be told (see detect_old_format).
+    @staticmethod
+    def peek_old_format(endian, io: BinaryIO, prop_data_base: int) -> bool | None:
+        io.seek(prop_data_base)
+        [vtx_count, _, _, vtx_base, _, primitive_meta_base] = unpack(f"{endian}IIIIII", read_exact(io, 24))
+        return Prop.detect_old_format(vtx_count, vtx_base, primitive_meta_base)
     #
 
+    # When the format is detected but can't be told for this prop, it is read in old_format_fallback.
     @staticmethod
-    def parse(endian, io: BinaryIO, prop_data_base: int, prop_name_base: int) -> Prop:
+    def parse(endian, io: BinaryIO, prop_data_base: int, prop_name_base: int, context: FormatContext, old_format_fallback: bool = False) -> Prop:
         io.seek(prop_data_base)
         [vtx_count, primitive_meta_count, mesh_count, vtx_base, unused, primitive_meta_base, primitive_data_base, material_idx_base, mesh_primitives_start_base, mesh_primitives_size_base] = unpack(f"{endian}IIIIIIIIII", read_exact(io, 40))
-        assert unused == 0, "Prop metadata thought to be unused was found with a value other than zero!  What does that mean?"
+        if not context.trusted:
+            assert unused == 0, "Prop metadata thought to be unused was found with a value other than zero!  What does that mean?"
         io.seek(prop_name_base)
         name = read_c_string(io)
 
-        # UV coords, XYZ pos, XYZ normal(?), RGBA
-        vertexes = list()
+        old_format = context.old_format_parse
+        if old_format is None:
+            old_format = Prop.detect_old_format(vtx_count, vtx_base, primitive_meta_base)
+            if old_format is None:
+                old_format = old_format_fallback
         io.seek(prop_data_base + vtx_base)
-        if Prop.old_format_parse:
-            for _ in range(vtx_count):
-                vertexes.append(unpack(f"{endian}ffffffffBBBB", read_exact(io, 36)))
-        else:
-            for _ in range(vtx_count):
-                vertexes.append(unpack(f"{endian}hhhhhhhhBBBB", read_exact(io, 20)))
+        dtype = vertex_dtype(endian, old_format)
+        vertexes = np.frombuffer(read_view(io, vtx_count * dtype.itemsize), dtype=dtype)  # A view of the file, not a copy
         
-        primitive_meta = list()
         io.seek(prop_data_base + primitive_meta_base)
-        for _ in range(primitive_meta_count):
-            primitive_meta.append(unpack(f"{endian}HH", read_exact(io, 4)))
+        primitive_meta = list(iter_unpack(f"{endian}HH", read_view(io, primitive_meta_count * 4)))
         
         primitive_data = list()
         for [idx, size] in primitive_meta:
             io.seek(prop_data_base + primitive_data_base + idx * 2)
-            primitive_data.append(unpack(f"{endian}{size}H", read_exact(io, size * 2)))
+            primitive_data.append(unpack(f"{endian}{size}H", read_view(io, size * 2)))
         
         io.seek(prop_data_base + material_idx_base)
         material_idxs = unpack(f"{endian}{mesh_count}H", read_exact(io, mesh_count * 2))
@@ -73,102 +154,100 @@ class Prop(object):
             begin = mesh_primitive_starts[i]; end = begin + mesh_primitive_sizes[i]
             meshes.append(Prop.Mesh(material_idxs[i], primitive_data[begin:end]))
 
-        return Prop(vertexes, meshes, name)
+        return Prop(vertexes, meshes, name, old_format)
     #
 
-    def write_data(self, endian, io: BinaryIO) -> int:
-        filepos_base = io.tell()
-        io.seek(filepos_base + 40)
+    def data_size(self, context: FormatContext) -> int:
+        primitive_count = sum(len(mesh.primitive_data) for mesh in self.meshes)
+        primitive_size = sum(len(primitive) for mesh in self.meshes for primitive in mesh.primitive_data)
+        return 40 + len(self.vertexes) * (36 if context.write_old_format(self) else 20) + primitive_count * 4 + primitive_size * 2 + len(self.meshes) * 2 * 3
+    #
+
+    def write_data(self, endian, io: BinaryIO, context: FormatContext):
+        old_format_write = context.write_old_format(self)
+        # Everything is laid out up front so that it can be written strictly in order.
+        vtx_count = len(self.vertexes)
+        mesh_count = len(self.meshes)
+        primitive_meta_count = sum(len(mesh.primitive_data) for mesh in self.meshes)
+        vtx_base = 40
+        primitive_meta_base = vtx_base + vtx_count * (36 if old_format_write else 20)
+        primitive_data_base = primitive_meta_base + primitive_meta_count * 4
+        material_idx_base = primitive_data_base + sum(len(primitive) for mesh in self.meshes for primitive in mesh.primitive_data) * 2
+        mesh_primitives_start_base = material_idx_base + mesh_count * 2
+        mesh_primitives_size_base = mesh_primitives_start_base + mesh_count * 2
+        io.write(pack(f"{endian}IIIIIIIIII", vtx_count, primitive_meta_count, mesh_count, vtx_base, 0, primitive_meta_base, primitive_data_base, material_idx_base, mesh_primitives_start_base, mesh_primitives_size_base))
 
-        vtx_base = io.tell() - filepos_base
         # 8003dc58 GXSetVtxAttrFmt(GX_VTXFMT6, GX_VA_POS , GX_POS_XYZ , GX_S16  ,  0)
         # 8003dc70 GXSetVtxAttrFmt(GX_VTXFMT6, GX_VA_CLR0, GX_CLR_RGBA, GX_RGBA8,  0)
         # 8003dc88 GXSetVtxAttrFmt(GX_VTXFMT6, GX_VA_TEX0, GX_TEX_ST  , GX_S16  , 12) <= Fixed-point decimal, divide by 2^12
         # 8003dca0 GXSetVtxAttrFmt(GX_VTXFMT6, GX_VA_NRM,  GX_NRM_XYZ , GX_S16  ,  0) <= Is this an oversight?
-        if Prop.old_format_write:
-            if Prop.old_format_parse:
-                for vtx in self.vertexes:
-                    io.write(pack(f"{endian}ffffffffBBBB", *vtx))
-            else:
-                for vtx in self.vertexes:
-                    [u, v, x, y, z, xn, yn, zn, r, g, b, a] = vtx
-                    u = u / 4096; v = v / 4096; x = float(x); y = float(y); z = float(z); xn = float(xn); yn = float(yn); zn = float(zn)
-                    io.write(pack(f"{endian}ffffffffBBBB", u, v, x, y, z, xn, yn, zn, r, g, b, a))
+        dtype = vertex_dtype(endian, old_format_write)
+        if old_format_write == self.old_format:
+            io.write(self.vertexes.astype(dtype, copy=False).tobytes())  # Only byteswaps if the endianness differs
         else:
-            if Prop.old_format_parse:
-                for vtx in self.vertexes:
-                    [u, v, x, y, z, xn, yn, zn, r, g, b, a] = vtx
-                    u = round(u * 4096); v = round(v * 4096); x = round(x); y = round(y); z = round(z); xn = round(xn); yn = round(yn); zn = round(zn)
-                    io.write(pack(f"{endian}hhhhhhhhBBBB", u, v, x, y, z, xn, yn, zn, r, g, b, a))
-            else:
-                for vtx in self.vertexes:
-                    io.write(pack(f"{endian}hhhhhhhhBBBB", *vtx))
+            vertexes = np.empty(vtx_count, dtype=dtype)
+            for field in vertex_fields[8:]:
+                vertexes[field] = self.vertexes[field]
+            for field in vertex_fields[:8]:
+                component = self.vertexes[field].astype(np.float64)
+                if field in ("u", "v"):
+                    component = component / 4096 if old_format_write else component * 4096
+                if not old_format_write:
+                    component = np.rint(component)  # Rounds half to even, like round()
+                    if not ((component >= -0x8000) & (component <= 0x7FFF)).all():
+                        raise CHKFMAPError("Prop {} has a vertex {} component that does not fit the new vertex attribute format".format(self.name, field))
+                vertexes[field] = component
+            io.write(vertexes.tobytes())
 
         # Write Primitive Meta (idx and size)
-        primitive_meta_base = io.tell() - filepos_base
-        primitive_meta_count = 0
         primitive_meta_last = 0
         for mesh in self.meshes:
             for primitive in mesh.primitive_data:
                 io.write(pack(f"{endian}HH", primitive_meta_last, len(primitive)))
                 primitive_meta_last += len(primitive)
-                primitive_meta_count += 1
         
         # Write Primitive Data
-        primitive_data_base = io.tell() - filepos_base
         for mesh in self.meshes:
             for primitive in mesh.primitive_data:
                 size = len(primitive)
                 io.write(pack(f"{endian}{size}H", *primitive))
         
         # Write Mesh Material Index
-        material_idx_base = io.tell() - filepos_base
         for mesh in self.meshes:
             io.write(pack(f"{endian}H", mesh.material_idx))
 
         # Write Mesh Primitive Starts
-        mesh_primitives_start_base = io.tell() - filepos_base
         mesh_primitive_start_last = 0
         for mesh in self.meshes:
             io.write(pack(f"{endian}H", mesh_primitive_start_last))
             mesh_primitive_start_last += len(mesh.primitive_data)
 
         # Write Mesh Primitive Sizes
-        mesh_primitives_size_base = io.tell() - filepos_base
         for mesh in self.meshes:
             io.write(pack(f"{endian}H", len(mesh.primitive_data)))
-                
-        vtx_count = len(self.vertexes)
-        mesh_count = len(self.meshes)
-
-        filepos_back = io.tell()
-        io.seek(filepos_base)
-        io.write(pack(f"{endian}IIIIIIIIII", vtx_count, primitive_meta_count, mesh_count, vtx_base, 0, primitive_meta_base, primitive_data_base, material_idx_base, mesh_primitives_start_base, mesh_primitives_size_base))
-        io.seek(filepos_back)
-
-        return filepos_base
     #
 
-    def write_name(self, io: BinaryIO) -> int:
-        filepos_base = io.tell()
+    def write_name(self, io: BinaryIO):
         io.write(self.name + b'\0')
-        return filepos_base
     #
 
+    # np.array_equal() alone would find float and integer vertexes of equal value to be the same, so the vertex
+    # attribute formats are compared first.  Byte order doesn't matter, so props from GLGM and GCGM can compare equal.
     def __eq__(self, other: Prop):
-        return self.vertexes == other.vertexes and self.meshes == other.meshes and self.name == other.name
+        return self.old_format == other.old_format and self.vertexes.dtype.newbyteorder("<") == other.vertexes.dtype.newbyteorder("<") and \
+               np.array_equal(self.vertexes, other.vertexes) and self.meshes == other.meshes and self.name == other.name
     #
 
     def dump_wavefront_obj(self, io: TextIO) -> None:
         io.write("mtllib materials.mtl\n")
-        if Prop.old_format_parse:
-            for [u, v, x, y, z, xn, yn, zn, r, g, b, a] in self.vertexes:
+        if self.old_format:
+            for [u, v, x, y, z, xn, yn, zn, r, g, b, a] in self.vertexes.tolist():
                 x = -x; y = -y; r = r / 255; g = g / 255; b = b / 255
                 io.write(f"v {x} {y} {z} {r} {g} {b}\n"  # Sorry, no alpha
                          f"vn {xn} {yn} {zn}\n"
                          f"vt {u} {v}\n")
         else:
-            for [u, v, x, y, z, xn, yn, zn, r, g, b, a] in self.vertexes:
+            for [u, v, x, y, z, xn, yn, zn, r, g, b, a] in self.vertexes.tolist():
                 u = u / 4096; v = -v / 4096; x = -x; y = -y; r = r / 255; g = g / 255; b = b / 255
                 io.write(f"v {x} {y} {z} {r} {g} {b}\n"  # Sorry, no alpha
                          f"vn {xn} {yn} {zn}\n"
@@ -184,14 +263,25 @@ class Prop(object):
 
 class PropList(list[Prop]):
     @staticmethod
-    def parse(endian, io: BinaryIO) -> PropList:
+    def parse(endian, io: BinaryIO, context: FormatContext) -> PropList:
         prop_list = PropList()
+        filepos = io.tell()
+        time_begin = perf_counter() if trace.enabled else 0
         prop_list.unkflt, count = unpack(f"{endian}fI", read_exact(io, 8))
-        print("unkflt: {}   prop count: {:d}".format(prop_list.unkflt, count))
+        if trace.enabled:
+            trace.event("prop_list", "unkflt: {}   prop count: {:d}".format(prop_list.unkflt, count), unkflt=prop_list.unkflt, count=count, offset=filepos)
         prop_data_bases = unpack(f"{endian}{count}I", read_exact(io, count * 4))
         prop_name_bases = unpack(f"{endian}{count}I", read_exact(io, count * 4))
+        # Props whose format can't be told on their own, such as those without vertexes, take the format of the rest.
+        old_format_fallback = False
+        if context.old_format_parse is None:
+            detected = [old_format for old_format in (Prop.peek_old_format(endian, io, base) for base in prop_data_bases) if old_format is not None]
+            if len(detected) != 0:
+                old_format_fallback = detected.count(True) > detected.count(False)
         for n in range(count):
-            prop_list.append(Prop.parse(endian, io, prop_data_bases[n], prop_name_bases[n]))
+            prop_list.append(Prop.parse(endian, io, prop_data_bases[n], prop_name_bases[n], context, old_format_fallback))
+        if trace.enabled:
+            trace.event("prop_list_parsed", count=count, offset=filepos, elapsed=perf_counter() - time_begin)
         return prop_list
     #
 
@@ -199,24 +289,88 @@ class PropList(list[Prop]):
         return self.unkflt == other.unkflt and super().__eq__(other)
     #
 
-    def write(self, endian, io: BinaryIO):
-        filepos_base = io.tell(); count = len(self)
-        io.seek(filepos_base + 8 + count * 4 * 2)
+    def make_writeable(self):
+        for prop in self:
+            prop.make_writeable()
+    #
+
+    def size(self, context: FormatContext) -> int:
+        return 8 + len(self) * 4 * 2 + sum(prop.data_size(context) + len(prop.name) + 1 for prop in self)
+    #
+
+    def write(self, endian, io: BinaryIO, context: FormatContext):
+        count = len(self); offs = 8 + count * 4 * 2
         prop_data_bases = list[int](); prop_name_bases = list[int]()
         # Technically not necessary to do this in two passes, but that's how the original files are laid out.
         for prop in self:
-            prop_data_bases.append(prop.write_data(endian, io) - filepos_base)
+            prop_data_bases.append(offs); offs += prop.data_size(context)
         for prop in self:
-            prop_name_bases.append(prop.write_name(io) - filepos_base)
-        filepos_back = io.tell()
-        io.seek(filepos_base)
+            prop_name_bases.append(offs); offs += len(prop.name) + 1
         io.write(pack(f"{endian}fI", self.unkflt, count))
         io.write(pack(f"{endian}{count}I", *prop_data_bases))
         io.write(pack(f"{endian}{count}I", *prop_name_bases))
-        io.seek(filepos_back)
+        for prop in self:
+            prop.write_data(endian, io, context)
+        for prop in self:
+            prop.write_name(io)
     #
 #
 
+# Parses a prop list here, or hands its offset and size to submit (see CHKFMAP.parse_all) so that a worker
+# process parses it instead.  In that case, a Future of the PropList is returned.
+def parse_prop_list(endian, io: BinaryIO, context: FormatContext, size: int = -1, submit: Callable | None = None) -> PropList | Future:
+    offs = io.tell()
+    view = read_view(io, size)
+    if submit is None:
+        return PropList.parse(endian, ViewReader(view), context)
+    return submit(endian, offs, len(view))
+#
+
+def parse_prop_list_file(path: str, filepos: int, size: int, endian, context: FormatContext) -> PropList:
+    with open(path, "rb") as f:
+        buffer = map_file(f)
+    return PropList.parse(endian, ViewReader(memoryview(buffer)[filepos:filepos + size]), context)
+#
+
+# Checks the headers of every prop in a prop list at once, straight from its bytes.
+def prop_list_anomalies(endian, view: memoryview, context: FormatContext, where: str) -> list[str]:
+    if len(view) < 8:
+        return ["{:s}: prop list is truncated".format(where)]
+    count = unpack_from(f"{endian}I", view, 4)[0]
+    if 8 + count * 8 > len(view):
+        return ["{:s}: prop list of {:d} props is truncated".format(where, count)]
+    bases = np.frombuffer(view, dtype=f"{endian}u4", count=count * 2, offset=8).astype(np.int64)
+    prop_data_bases = bases[:count]; prop_name_bases = bases[count:]
+    anomalies = list[str]()
+    for n in np.flatnonzero(prop_name_bases >= len(view)):
+        anomalies.append("{:s}: prop {:d} name at {:08x} is past the end of the prop list".format(where, n, prop_name_bases[n]))
+    in_bounds = prop_data_bases + 40 <= len(view)
+    for n in np.flatnonzero(~in_bounds):
+        anomalies.append("{:s}: prop {:d} data at {:08x} is past the end of the prop list".format(where, n, prop_data_bases[n]))
+    props = np.flatnonzero(in_bounds)
+    raw = np.frombuffer(view, dtype=np.uint8)
+    headers = raw[prop_data_bases[props, None] + np.arange(40)].view(f"{endian}u4").astype(np.int64)
+    [vtx_count, vtx_base, unused, primitive_meta_base] = headers[:, 0], headers[:, 3], headers[:, 4], headers[:, 5]
+    for n in np.flatnonzero(unused != 0):
+        anomalies.append("{:s}: prop {:d} metadata thought to be unused is {:08x}".format(where, props[n], unused[n]))
+    ends = prop_data_bases[props] + headers[:, [3, 5, 6, 7, 8, 9]].max(axis=1)
+    for n in np.flatnonzero(ends > len(view)):
+        anomalies.append("{:s}: prop {:d} has offsets past the end of the prop list".format(where, props[n]))
+    stride = primitive_meta_base - vtx_base
+    old_format = (stride - vtx_count * 36 >= 0) & (stride - vtx_count * 36 < vertex_alignment)
+    new_format = (stride - vtx_count * 20 >= 0) & (stride - vtx_count * 20 < vertex_alignment)
+    match context.old_format_parse:
+        case None:
+            mismatched = ~(old_format | new_format)
+        case True:
+            mismatched = ~old_format
+        case _:
+            mismatched = ~new_format
+    for n in np.flatnonzero(mismatched):
+        anomalies.append("{:s}: prop {:d} has {:d} bytes for {:d} vertexes, which doesn't match the expected vertex attribute format".format(where, props[n], stride[n], vtx_count[n]))
+    return anomalies
+#
+
 class Packet(object):
     def __init__(self, type: int, unk: int, data: int, stupid: bool):
         self.type = type
@@ -261,6 +415,10 @@ class PacketList(list[Packet]):
         return packet_list
     #
 
+    def size(self) -> int:
+        return sum(4 + len(packet.data) for packet in self) + 4
+    #
+
     def write(self, io: BinaryIO):
         for packet in self:
             if packet.stupid:
@@ -293,22 +451,64 @@ class CHKFMAPError(Exception):
     pass
 #
 
+# Byte ranges [begin, end) where old and new differ.  Ranges closer together than gap are merged into one write.
+def diff_ranges(old: bytes, new: bytes, gap: int = 64) -> list[tuple[int, int]]:
+    changed = np.flatnonzero(np.frombuffer(old, dtype=np.uint8) != np.frombuffer(new, dtype=np.uint8))
+    if len(changed) == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(changed) > gap)
+    begins = np.concatenate(([changed[0]], changed[breaks + 1]))
+    ends = np.concatenate((changed[breaks], [changed[-1]])) + 1
+    return list(zip(begins.tolist(), ends.tolist()))
+#
+
 class Chunk(object):
+    parallel_parse = False  # Whether parse() takes a submit callable, see CHKFMAP.parse_all
+
     def __init__(self, chkfmap: CHKFMAP):
         self.chkfmap = chkfmap
     #
 
+    # A chunk that is not dirty has its original bytes copied when written instead of being re-encoded.  Look up a
+    # chunk with Header.at(tid, True) to edit it in place (e.g. chkfmap.at(b'MAP_').at(b'ACTI', True).actors[0][0]
+    # .data = ...), which marks it dirty.  Call mark_dirty() after editing a chunk that was looked up otherwise, or
+    # that was held onto across CHKFMAP.patch() or CHKFMAP.parse_all(), both of which mark every chunk clean again.
+    # Prop vertexes are read-only views of the file until then, so props have to be edited after marking.
+    dirty = True
+
+    def mark_dirty(self):
+        self.dirty = True
+    #
+
+    # Whether the original bytes of this kind of chunk can be written back out as-is when it was never parsed.
+    @staticmethod
+    def raw_is_current(context: FormatContext) -> bool:
+        return True
+    #
+
+    # Anything wrong with the original bytes of this kind of chunk, for CHKFMAP.validate().
+    @staticmethod
+    def raw_anomalies(raw: memoryview, context: FormatContext, where: str) -> list[str]:
+        return []
+    #
+
     def parse(self, io: BinaryIO):
         self.raw = io.read()
     #
 
+    # The number of bytes write() will produce, so that offsets can be known before anything is written.
+    def size(self) -> int:
+        return len(self.raw)
+    #
+
     def write(self, io: BinaryIO):
         io.write(self.raw)
     #
 #
 
+# A bounded stream over the next size bytes.  Nothing is copied if io is already backed by memory.
 def make_subreader(io: BinaryIO, size: int):
-    return BytesIO(read_exact(io, size))
+    return ViewReader(read_view(io, size))
 #
 
 class Header(Chunk):
@@ -319,7 +519,9 @@ class Header(Chunk):
             self.ver = ver
             self.offs = offs
             self.size = size
-            self.chunk: Chunk
+            self.filepos = 0
+            self.raw: memoryview | None = None  # Original bytes of the chunk, kept for writing it back out while clean
+            self.chunk: Chunk | None = None
         #
     #
 
@@ -328,101 +530,316 @@ class Header(Chunk):
         self.subheaders = list[Header.SubHeader]()
     #
 
-    def parse(self, io: BinaryIO):
+    # With a list of anomalies to append to (see CHKFMAP.validate), a truncated subheader table, an unknown TID,
+    # or a chunk running past the end of the file is recorded there and skipped instead of raising.
+    def parse(self, io: BinaryIO, anomalies: list[str] | None = None, where: str = "CHKFMAP"):
         filepos_base = io.tell()
-        nchunks = unpack("<I", read_exact(io, 4))[0]
-        print("//////////////////////////////////////////////////////")
-        print("LoadSubHeader()")
-        print("loading sub header at offset {:08x}".format(filepos_base))
-        print("header nchunks {:d}".format(nchunks))
-        for n in range(nchunks):
-            [tid, cid, ver, offs, size] = unpack("<4s4s4sII", read_exact(io, 20))
-            self.subheaders.append(Header.SubHeader(tid, cid, ver, offs, size))
-            print("chunk {:04x} offs {:08x} size {:08x} TID < {} > CID < {} > VER < {} > filepos {:08x}".format(n, offs, size, tid.decode(), cid.decode(), ver.decode(), filepos_base + offs))
-        print("//////////////////////////////////////////////////////")
-        for [n, subheader] in enumerate(self.subheaders):
-            io.seek(filepos_base + subheader.offs)
-            match subheader.tid:
-                case b'MAP_':  # Subheader (HEAD, DATA, NAME, PATH, VARS, ACTI)
-                    subheader.chunk = MAP_(self.chkfmap); subheader.chunk.parse(io)
-                case b'CELS':  # Subheader (GEOM, GLGM, GCGM, CTEX, CATR, CANM)
-                    subheader.chunk = CELS(self.chkfmap); subheader.chunk.parse(io)
-                case b'GRUV':  # Length of DATA chunk's array
-                    subheader.chunk = GRUV(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'GEOM':  # Tool Geometry (little-endian)
-                    subheader.chunk = GEOM(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'GLGM':  # PC Geometry (little-endian)
-                    subheader.chunk = GLGM(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'GCGM':  # GameCube Geometry (big-endian)
-                    subheader.chunk = GCGM(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'CTEX':  # PC Textures(?) (PSXtexfile)
-                    subheader.chunk = CTEX(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'CATR':
-                    subheader.chunk = CATR(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'CANM':  # Prop Animations
-                    subheader.chunk = CANM(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'HEAD':  # "Header" (cell dimensions)
-                    subheader.chunk = HEAD(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'DATA':  # Cell population data
-                    subheader.chunk = DATA(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'NAME':  # Prop names
-                    subheader.chunk = NAME(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'PATH':  
-                    subheader.chunk = PATH(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'ACTI':  # Actor layout data
-                    subheader.chunk = ACTI(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case b'VARS':
-                    subheader.chunk = VARS(self.chkfmap); subheader.chunk.parse(Header.make_subreader(io, n, subheader.offs, subheader.size, subheader.tid))
-                case _:
-                    raise CHKFMAPError("Unknown TID < {} >".format(tid.decode()))
+        try:
+            nchunks = unpack("<I", read_exact(io, 4))[0]
+            for n in range(nchunks):
+                [tid, cid, ver, offs, size] = unpack("<4s4s4sII", read_exact(io, 20))
+                self.subheaders.append(Header.SubHeader(tid, cid, ver, offs, size))
+        except EOFError:
+            if anomalies is None:
+                raise
+            anomalies.append("{:s}: subheader table at {:08x} is truncated".format(where, filepos_base))
+            nchunks = len(self.subheaders)
+        if trace.enabled:
+            lines = ["//////////////////////////////////////////////////////",
+                     "LoadSubHeader()",
+                     "loading sub header at offset {:08x}".format(filepos_base),
+                     "header nchunks {:d}".format(nchunks)]
+            for [n, subheader] in enumerate(self.subheaders):
+                lines.append("chunk {:04x} offs {:08x} size {:08x} TID < {} > CID < {} > VER < {} > filepos {:08x}".format(n, subheader.offs, subheader.size, subheader.tid.decode(), subheader.cid.decode(), subheader.ver.decode(), filepos_base + subheader.offs))
+            lines.append("//////////////////////////////////////////////////////")
+            chunks = [{"tid": subheader.tid.decode(), "cid": subheader.cid.decode(), "ver": subheader.ver.decode(), "offset": subheader.offs, "size": subheader.size} for subheader in self.subheaders]
+            trace.event("subheader", "\n".join(lines), filepos=filepos_base, count=nchunks, chunks=chunks)
+        # Only the subheader tables are parsed up front.  Other chunks are parsed from their raw bytes when at() first asks for them.
+        for subheader in self.subheaders:
+            subheader.filepos = filepos_base + subheader.offs
+            io.seek(subheader.filepos)
+            name = "{:s}/{:s}".format(where, subheader.tid.decode(errors="replace"))
+            if subheader.tid not in chunk_types:
+                if anomalies is None:
+                    raise CHKFMAPError("Unknown TID < {} >".format(subheader.tid.decode()))
+                anomalies.append("{:s}: unknown TID".format(name))
+            elif issubclass(chunk_types[subheader.tid], Header):
+                subheader.chunk = chunk_types[subheader.tid](self.chkfmap); subheader.chunk.parse(io, anomalies, name)
+            else:
+                try:
+                    subheader.raw = read_view(io, subheader.size)
+                except EOFError:
+                    if anomalies is None:
+                        raise
+                    anomalies.append("{:s}: chunk at {:08x} of size {:08x} runs past the end of the file".format(name, subheader.filepos, subheader.size))
+    #
+
+    def load(self, n: int, submit: Callable | None = None):
+        subheader = self.subheaders[n]
+        if subheader.raw is None:
+            raise CHKFMAPError("Chunk < {} > could not be read".format(subheader.tid.decode(errors="replace")))
+        time_begin = perf_counter() if trace.enabled else 0
+        chunk: Chunk = chunk_types[subheader.tid](self.chkfmap)
+        io = Header.make_subreader(ViewReader(subheader.raw), n, subheader.offs, subheader.size, subheader.tid, subheader.filepos)
+        if submit is not None:
+            chunk.parse(io, lambda endian, offs, size: submit(endian, subheader.filepos + offs, size))
+        else:
+            chunk.parse(io)
+        if trace.enabled:
+            trace.event("chunk_parsed", idx=n, tid=subheader.tid.decode(), filepos=subheader.filepos, size=subheader.size, elapsed=perf_counter() - time_begin)
+        chunk.dirty = False
+        subheader.chunk = chunk
+        return chunk
     #
     
-    def write(self, io: BinaryIO):
-        filepos_base = io.tell()
-        io.seek(filepos_base + 4 + 20 * len(self.subheaders))
-        for subheader in self.subheaders:
-            subheader.offs = io.tell() - filepos_base
-            subheader.chunk.write(io)
-            io.seek(align_up(io.tell(), 4))  # Chunks have padding to next multiple of four
-            subheader.size = io.tell() - filepos_base - subheader.offs
-        filepos_back = io.tell()
-        io.seek(filepos_base)
+    def copies_raw(self, n: int) -> bool:
+        subheader = self.subheaders[n]
+        return subheader.raw is not None and (subheader.chunk is None or not subheader.chunk.dirty) and chunk_types[subheader.tid].raw_is_current(self.chkfmap.context)
+    #
+
+    # Unpadded size of each chunk as it will be written.
+    def layout(self) -> list[int]:
+        sizes = list[int]()
+        for [n, subheader] in enumerate(self.subheaders):
+            if not isinstance(subheader.chunk, Header) and self.copies_raw(n):
+                sizes.append(len(subheader.raw))
+            else:
+                sizes.append((subheader.chunk if subheader.chunk is not None else self.load(n)).size())
+        return sizes
+    #
+
+    def size(self) -> int:
+        return 4 + 20 * len(self.subheaders) + sum(align_up(size, 4) for size in self.layout())
+    #
+
+    # Everything is laid out before anything is written, so io never needs to seek and can be a pipe.
+    def write(self, io: BinaryIO, src: BinaryIO | None = None):
+        sizes = self.layout()
+        offs = 4 + 20 * len(self.subheaders)
+        for [subheader, size] in zip(self.subheaders, sizes):
+            subheader.offs = offs
+            subheader.size = align_up(size, 4)  # Chunks have padding to next multiple of four
+            offs += subheader.size
         io.write(pack("<I", len(self.subheaders)))
         for subheader in self.subheaders:
             io.write(pack("<4s4s4sII", subheader.tid, subheader.cid, subheader.ver, subheader.offs, subheader.size))
-        io.seek(filepos_back)
-        
+        for [n, [subheader, size]] in enumerate(zip(self.subheaders, sizes)):
+            if isinstance(subheader.chunk, Header):
+                subheader.chunk.write(io, src)
+            elif self.copies_raw(n):
+                write_file_range(io, src, subheader.filepos, subheader.raw)
+            else:
+                subheader.chunk.write(io)
+            io.write(bytes(subheader.size - size))
     #
 
     @staticmethod
-    def make_subreader(io: BinaryIO, idx: int, offs: int, size: int, tid: bytes):
-        print("//////////////////////////////////////////////////////")
-        print("LoadChunk chunkIDX {:08x} offset {:08x} len {:08x} TID < {:s} > filepos:{:08x}".format(idx, offs, size, tid.decode(), io.tell()))
-        print("//////////////////////////////////////////////////////")
+    def make_subreader(io: BinaryIO, idx: int, offs: int, size: int, tid: bytes, filepos: int):
+        if trace.enabled:
+            trace.event("chunk", "//////////////////////////////////////////////////////\n"
+                                 "LoadChunk chunkIDX {:08x} offset {:08x} len {:08x} TID < {:s} > filepos:{:08x}\n"
+                                 "//////////////////////////////////////////////////////".format(idx, offs, size, tid.decode(), filepos),
+                        idx=idx, offset=offs, size=size, tid=tid.decode(), filepos=filepos)
         return make_subreader(io, size)
     #
 
-    def at(self, tid: bytes):
-        for subheader in self.subheaders:
-            if subheader.tid == tid: return subheader.chunk
+    # Pass mutable=True when the chunk is going to be edited, so that it is re-encoded when written.  Lookups that
+    # only read the chunk leave it clean, so that it can still be copied verbatim.
+    def at(self, tid: bytes, mutable: bool = False):
+        for [n, subheader] in enumerate(self.subheaders):
+            if subheader.tid == tid:
+                chunk = subheader.chunk if subheader.chunk is not None else self.load(n)
+                if mutable: chunk.mark_dirty()
+                return chunk
         raise IndexError("Chunk with TID {} not found".format(tid))
     #
+
+    # The re-encoded bytes of every chunk that would not be copied verbatim by write(), or None if any of them
+    # changed size (or never had a size, being new) such that the layout of the file would change.
+    def patches(self) -> list[tuple[Header.SubHeader, bytes]] | None:
+        patches = list[tuple[Header.SubHeader, bytes]]()
+        for [n, subheader] in enumerate(self.subheaders):
+            if isinstance(subheader.chunk, Header):
+                sub_patches = subheader.chunk.patches()
+                if sub_patches is None:
+                    return None
+                patches.extend(sub_patches)
+                continue
+            if self.copies_raw(n):
+                continue
+            if subheader.raw is None:
+                return None
+            io = BytesIO()
+            (subheader.chunk if subheader.chunk is not None else self.load(n)).write(io)
+            data = io.getvalue()
+            data += bytes(align_up(len(data), 4) - len(data))  # Chunks have padding to next multiple of four
+            if len(data) != subheader.size:
+                return None
+            patches.append((subheader, data))
+        return patches
+    #
+
+    def anomalies(self, where: str) -> list[str]:
+        anomalies = list[str]()
+        end = 4 + 20 * len(self.subheaders)
+        for [n, subheader] in enumerate(self.subheaders):
+            name = "{:s}/{:s}".format(where, subheader.tid.decode(errors="replace"))
+            if subheader.size % 4 != 0:
+                anomalies.append("{:s}: chunk size {:08x} is not padded to a multiple of four".format(name, subheader.size))
+            if subheader.offs < end:
+                anomalies.append("{:s}: chunk at {:08x} overlaps the subheader table or the chunk before it".format(name, subheader.offs))
+            end = max(end, subheader.offs + subheader.size)
+            if isinstance(subheader.chunk, Header):
+                anomalies.extend(subheader.chunk.anomalies(name))
+            elif subheader.raw is not None:
+                anomalies.extend(chunk_types[subheader.tid].raw_anomalies(subheader.raw, self.chkfmap.context, name))
+        return anomalies
+    #
+
+    def unparsed(self):
+        for [n, subheader] in enumerate(self.subheaders):
+            if isinstance(subheader.chunk, Header):
+                yield from subheader.chunk.unparsed()
+            elif subheader.chunk is None:
+                yield (self, n)
+    #
 #
 
 class CHKFMAP(Header):
     def __init__(self):
         super().__init__(self)
+        self.source: BinaryIO | None = None  # The file this map was parsed from, which is kept open while in use
+        self.mapping: mmap | None = None  # The mapping of that file made by parse(), released by close()
+        self.owns_source = False
+        self.context = FormatContext()
     #
 
-    def parse(self, io: BinaryIO):
-        filemagic = read_exact(io, 8)
-        assert filemagic == b'CHKFMAP_'
-        super().parse(io)
+    def __enter__(self) -> CHKFMAP:
+        return self
     #
 
-    def write(self, io: BinaryIO):
+    def __exit__(self, *exc_info):
+        self.close()
+    #
+
+    # Unmaps the file and closes it if parse() opened it.  Every chunk is dropped along with its views into the
+    # mapping, so chunks and buffers taken from the map beforehand must be let go of, or BufferError is raised.
+    # This has to happen before replacing the file that was parsed, which Windows refuses while it is mapped.
+    def close(self):
+        self.subheaders = list[Header.SubHeader]()
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+        if self.owns_source:
+            self.source.close()
+        self.source = None
+        self.owns_source = False
+    #
+
+    # Accepts a filepath, a buffer (e.g. an mmap), or a binary stream, which is parsed from its current position.
+    # Files are memory-mapped and chunks are handed views into the mapping, so the raw bytes of a chunk are never
+    # copied.  Chunk file positions stay relative to the start of the file.  The context is kept for
+    # parsing chunks later on and for writing.  Given a list of anomalies, problems with the file's structure are
+    # appended to it rather than raised (see Header.parse), so that validate() can still report on the rest.
+    def parse(self, source: BinaryIO | str | PathLike | mmap, context: FormatContext | None = None, anomalies: list[str] | None = None):
+        if context is not None:
+            self.context = context
+        start = 0
+        if isinstance(source, (str, PathLike)):
+            self.source = open(source, "rb"); self.owns_source = True
+            buffer = map_file(self.source)
+        elif isinstance(source, (mmap, bytes, bytearray, memoryview)):
+            buffer = source
+        else:
+            self.source = source
+            start = source.tell()
+            buffer = map_file(source)
+        if self.source is not None and isinstance(buffer, mmap):
+            self.mapping = buffer
+        # A mapping covers the whole file, so a map embedded in a larger file is found at the stream's position.
+        # Read instead of mapped, the buffer already begins there.
+        io = ViewReader(buffer, start if isinstance(buffer, mmap) else 0)
+        filemagic = io.read(8)
+        if anomalies is not None and filemagic != b'CHKFMAP_':
+            anomalies.append("CHKFMAP: file magic is {} rather than b'CHKFMAP_'".format(filemagic))
+            return
+        assert filemagic == b'CHKFMAP_'
+        super().parse(io, anomalies)
+    #
+
+    # Parses every chunk not parsed yet.  With a file to work from, the prop lists of GEOM, GLGM, and GCGM are
+    # parsed by a pool of worker processes while everything else is parsed here.
+    def parse_all(self, jobs: int | None = None):
+        # Worker processes map the file for themselves, so they need to know where it is.
+        path = getattr(self.source, "name", None)
+        if not isinstance(path, str) or jobs == 1:
+            for [header, n] in list(self.unparsed()):
+                header.load(n)
+            return
+        deferred = list[Chunk]()
+        with ProcessPoolExecutor(jobs, initializer = trace.configure_worker, initargs = trace.settings) as executor:
+            submit = lambda endian, filepos, size: executor.submit(parse_prop_list_file, path, filepos, size, endian, self.context)
+            for [header, n] in list(self.unparsed()):
+                if chunk_types[header.subheaders[n].tid].parallel_parse:
+                    deferred.append(header.load(n, submit))
+            for [header, n] in list(self.unparsed()):
+                header.load(n)
+            for chunk in deferred:
+                for [name, value] in vars(chunk).items():
+                    if isinstance(value, Future):
+                        setattr(chunk, name, value.result())
+                chunk.dirty = False
+    #
+
+    # Writes dirty chunks back into the source file, touching only the bytes that changed.  This only works when
+    # no chunk changed size, otherwise None is returned and the map has to be written out in full.
+    def patch(self) -> int | None:
+        path = getattr(self.source, "name", None)
+        if not isinstance(path, str):
+            return None
+        patches = self.patches()
+        if patches is None:
+            return None
+        written = 0
+        with open(path, "r+b") as f:
+            for [subheader, data] in patches:
+                for [begin, end] in diff_ranges(subheader.raw, data):
+                    f.seek(subheader.filepos + begin)
+                    f.write(data[begin:end])
+                    written += end - begin
+        # The mapping now shows the new bytes, so the patched chunks are clean again.
+        for [subheader, data] in patches:
+            subheader.chunk.dirty = False
+        return written
+    #
+
+    # Reports everything wrong with the map at once, rather than stopping at the first problem like parsing does.
+    # Prop lists are checked straight from their original bytes, so GEOM, GLGM, and GCGM are never parsed.  Pass
+    # a list of anomalies to parse() beforehand so that a map too broken to parse can be validated as well.
+    def validate(self) -> list[str]:
+        anomalies = self.anomalies("CHKFMAP")
+        try:
+            data_count = self.at(b'GRUV').data_count
+            map_ = self.at(b'MAP_')
+            head = map_.at(b'HEAD')
+        except (IndexError, EOFError, CHKFMAPError, struct_error) as e:
+            anomalies.append("Could not check the map size: {}".format(e if str(e) else type(e).__name__))
+            return anomalies
+        if data_count != head.x * head.y * head.z:
+            anomalies.append("GRUV data count {:d} is not the HEAD map size {:d} * {:d} * {:d}".format(data_count, head.x, head.y, head.z))
+        for subheader in map_.subheaders:
+            if subheader.tid == b'DATA' and subheader.raw is not None and len(subheader.raw) < data_count * 4:
+                anomalies.append("DATA is {:d} bytes, which is too small for {:d} cells".format(len(subheader.raw), data_count))
+        return anomalies
+    #
+
+    # Clean chunks are copied from the source file, by the kernel if io is a file too.  A context given here
+    # replaces the one given to parse().
+    def write(self, io: BinaryIO, context: FormatContext | None = None):
+        if context is not None:
+            self.context = context
         io.write(b'CHKFMAP_')
-        super().write(io)
+        super().write(io, self.source)
     #
 #
 
@@ -437,7 +854,12 @@ class CELS(Header):
 class GRUV(Chunk):  # Size of DATA chunk's array (HEAD chunk x * y * z)
     def parse(self, io: BinaryIO):
         self.data_count = unpack("<I", read_exact(io, 4))[0]
-        print("gruv: {:d}".format(self.data_count))
+        if trace.enabled:
+            trace.event("gruv", "gruv: {:d}".format(self.data_count), count=self.data_count)
+    #
+
+    def size(self) -> int:
+        return 4
     #
 
     def write(self, io: BinaryIO):
@@ -450,48 +872,74 @@ class GRUV(Chunk):  # Size of DATA chunk's array (HEAD chunk x * y * z)
 #
 
 class GEOM(Chunk):  # This chunk is idiotic.  Four copies of the prop list also found in the GLGM chunk??
-    def parse(self, io: BinaryIO):
+    parallel_parse = True
+
+    @staticmethod
+    def raw_is_current(context: FormatContext) -> bool:
+        return context.raw_is_current()  # Otherwise the vertex format has to be converted
+    #
+
+    @staticmethod
+    def raw_anomalies(raw: memoryview, context: FormatContext, where: str) -> list[str]:
+        if len(raw) < 36:
+            return ["{:s}: chunk is truncated".format(where)]
+        [_, *sizes] = unpack_from("<fIIIIIIII", raw, 0)
+        anomalies = list[str]()
+        for n in (0, 1, 3):  # Prop list 2 is not understood
+            [size, base] = sizes[n], sizes[4 + n]
+            if base + size > len(raw):
+                anomalies.append("{:s}: prop list {:d} is past the end of the chunk".format(where, n))
+            else:
+                anomalies.extend(prop_list_anomalies('<', raw[base:base + size], context, "{:s} prop list {:d}".format(where, n)))
+        return anomalies
+    #
+
+    def parse(self, io: BinaryIO, submit: Callable | None = None):
         self.unkflt, prop_list_0_size, prop_list_1_size, prop_list_2_size, prop_list_3_size, prop_list_0_base, prop_list_1_base, prop_list_2_base, prop_list_3_base = unpack("<fIIIIIIII", read_exact(io, 36))
-        print("master unkflt: {}".format(self.unkflt))
+        if trace.enabled:
+            trace.event("geom", "master unkflt: {}".format(self.unkflt), unkflt=self.unkflt, sizes=[prop_list_0_size, prop_list_1_size, prop_list_2_size, prop_list_3_size])
 
         io.seek(prop_list_0_base)
-        self.props_0 = PropList.parse('<', make_subreader(io, prop_list_0_size))
+        self.props_0 = parse_prop_list('<', io, self.chkfmap.context, prop_list_0_size, submit)
         
         io.seek(prop_list_1_base)
-        self.props_1 = PropList.parse('<', make_subreader(io, prop_list_1_size))
+        self.props_1 = parse_prop_list('<', io, self.chkfmap.context, prop_list_1_size, submit)
         
         # Prop list 2 uses a different vertex format that is incomprehensible (approx. 131.6017 bytes per vertex??)
         io.seek(prop_list_2_base);
-        self.props_2_raw = read_exact(io, prop_list_2_size)
+        self.props_2_raw = read_view(io, prop_list_2_size)
         
         io.seek(prop_list_3_base)
-        self.props_3 = PropList.parse('<', make_subreader(io, prop_list_3_size))
+        self.props_3 = parse_prop_list('<', io, self.chkfmap.context, prop_list_3_size, submit)
     #
 
-    def write(self, io: BinaryIO):
-        filepos_base = io.tell()
-        io.seek(filepos_base + 36)
-
-        prop_list_0_base = io.tell() - filepos_base
-        self.props_0.write('<', io)
-        prop_list_0_size = io.tell() - filepos_base - prop_list_0_base
-
-        prop_list_1_base = io.tell() - filepos_base
-        self.props_1.write('<', io)
-        prop_list_1_size = io.tell() - filepos_base - prop_list_1_base
-
-        prop_list_2_base = io.tell() - filepos_base
-        io.write(self.props_2_raw)
-        prop_list_2_size = io.tell() - filepos_base - prop_list_2_base
+    # Edits to the props have to land in copies rather than the read-only mapping of the file.
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.props_0.make_writeable(); self.props_1.make_writeable(); self.props_3.make_writeable()
+        self.props_2_raw = bytes(self.props_2_raw)
+    #
 
-        prop_list_3_base = io.tell() - filepos_base
-        self.props_3.write('<', io)
-        prop_list_3_size = io.tell() - filepos_base - prop_list_3_base
+    def size(self) -> int:
+        context = self.chkfmap.context
+        return 36 + self.props_0.size(context) + self.props_1.size(context) + len(self.props_2_raw) + self.props_3.size(context)
+    #
 
-        filepos_back = io.tell()
-        io.seek(filepos_base)
+    def write(self, io: BinaryIO):
+        context = self.chkfmap.context
+        prop_list_0_size = self.props_0.size(context)
+        prop_list_1_size = self.props_1.size(context)
+        prop_list_2_size = len(self.props_2_raw)
+        prop_list_3_size = self.props_3.size(context)
+        prop_list_0_base = 36
+        prop_list_1_base = prop_list_0_base + prop_list_0_size
+        prop_list_2_base = prop_list_1_base + prop_list_1_size
+        prop_list_3_base = prop_list_2_base + prop_list_2_size
         io.write(pack("<fIIIIIIII", self.unkflt, prop_list_0_size, prop_list_1_size, prop_list_2_size, prop_list_3_size, prop_list_0_base, prop_list_1_base, prop_list_2_base, prop_list_3_base))
-        io.seek(filepos_back)
+        self.props_0.write('<', io, context)
+        self.props_1.write('<', io, context)
+        io.write(self.props_2_raw)
+        self.props_3.write('<', io, context)
     #
 
     def __eq__(self, other: GEOM) -> bool:
@@ -500,12 +948,34 @@ class GEOM(Chunk):  # This chunk is idiotic.  Four copies of the prop list also
 #
 
 class GLGM(Chunk):  # Little-Endian
-    def parse(self, io: BinaryIO) -> None:
-        self.props = PropList.parse('<', io)
+    parallel_parse = True
+
+    @staticmethod
+    def raw_is_current(context: FormatContext) -> bool:
+        return context.raw_is_current()  # Otherwise the vertex format has to be converted
+    #
+
+    @staticmethod
+    def raw_anomalies(raw: memoryview, context: FormatContext, where: str) -> list[str]:
+        return prop_list_anomalies('<', raw, context, where)
+    #
+
+    def parse(self, io: BinaryIO, submit: Callable | None = None) -> None:
+        self.props = parse_prop_list('<', io, self.chkfmap.context, -1, submit)
+    #
+
+    # Edits to the props have to land in copies rather than the read-only mapping of the file.
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.props.make_writeable()
+    #
+
+    def size(self) -> int:
+        return self.props.size(self.chkfmap.context)
     #
 
     def write(self, io: BinaryIO) -> None:
-        self.props.write('<', io)
+        self.props.write('<', io, self.chkfmap.context)
     #
 
     def __eq__(self, other: GLGM) -> bool:
@@ -514,12 +984,34 @@ class GLGM(Chunk):  # Little-Endian
 #
 
 class GCGM(Chunk):  # Big-Endian
-    def parse(self, io: BinaryIO) -> None:
-        self.props = PropList.parse('>', io)
+    parallel_parse = True
+
+    @staticmethod
+    def raw_is_current(context: FormatContext) -> bool:
+        return context.raw_is_current()  # Otherwise the vertex format has to be converted
+    #
+
+    @staticmethod
+    def raw_anomalies(raw: memoryview, context: FormatContext, where: str) -> list[str]:
+        return prop_list_anomalies('>', raw, context, where)
+    #
+
+    def parse(self, io: BinaryIO, submit: Callable | None = None) -> None:
+        self.props = parse_prop_list('>', io, self.chkfmap.context, -1, submit)
+    #
+
+    # Edits to the props have to land in copies rather than the read-only mapping of the file.
+    def mark_dirty(self):
+        super().mark_dirty()
+        self.props.make_writeable()
+    #
+
+    def size(self) -> int:
+        return self.props.size(self.chkfmap.context)
     #
 
     def write(self, io: BinaryIO) -> None:
-        self.props.write('>', io)
+        self.props.write('>', io, self.chkfmap.context)
     #
 
     def __eq__(self, other: GCGM) -> bool:
@@ -529,7 +1021,11 @@ class GCGM(Chunk):  # Big-Endian
 
 class CTEX(Chunk):
     def parse(self, io: BinaryIO):
-        self.textures = parse_psxtexfile(io)
+        self.textures = PSXTexFileReader(read_view(io))
+    #
+
+    def size(self) -> int:
+        return sum(8 + len(palette) + len(data) for [mode, unk1, unk2, width, height, data, palette] in self.textures)
     #
 
     def write(self, io: BinaryIO):
@@ -544,13 +1040,18 @@ class CTEX(Chunk):
 class CATR(Chunk):
     def parse(self, io: BinaryIO):
         count = unpack("<I", read_exact(io, 4))[0]
-        print("CATR Count: {:d}".format(count))
+        if trace.enabled:
+            trace.event("catr", "CATR Count: {:d}".format(count), count=count)
         self.packet_lists = list[PacketList]()
         for _ in range(count):
             packet_list = PacketList.parse(io)
             self.packet_lists.append(packet_list)
     #
 
+    def size(self) -> int:
+        return 4 + sum(packet_list.size() for packet_list in self.packet_lists)
+    #
+
     def write(self, io: BinaryIO):
         io.write(pack("<I", len(self.packet_lists)))
         for packet_list in self.packet_lists:
@@ -573,16 +1074,22 @@ class CATR(Chunk):
 class CANM(Chunk):
     def parse(self, io: BinaryIO):
         count = unpack("<I", read_exact(io, 4))[0]
-        print("CANM Count: {:d}".format(count))
+        if trace.enabled:
+            trace.event("canm", "CANM Count: {:d}".format(count), count=count)
         self.packet_lists = list[PacketList]()
         for i in range(count):
             packet_list = PacketList.parse(io)
             # Repeating packet type 3 is clearly animation data (Prop IDs).
-            name = decode_c_string(packet_list.at(1), codepage)  # Message
-            print("{:2d}   name: {:>20s}".format(i, name))
+            if trace.enabled:
+                name = decode_c_string(packet_list.at(1), codepage)  # Message
+                trace.event("canm_entry", "{:2d}   name: {:>20s}".format(i, name), index=i, name=name)
             self.packet_lists.append(packet_list)
     #
 
+    def size(self) -> int:
+        return 4 + sum(packet_list.size() for packet_list in self.packet_lists)
+    #
+
     def write(self, io: BinaryIO):
         io.write(pack("<I", len(self.packet_lists)))
         for packet_list in self.packet_lists:
@@ -605,8 +1112,13 @@ class CANM(Chunk):
 class HEAD(Chunk):
     def parse(self, io: BinaryIO):
         self.x, self.y, self.z = unpack("<III", read_exact(io, 12))
-        print("///////////////////////////////////////////")
-        print("mapsize {:d} {:d} {:d}".format(self.x, self.y, self.z))  # ERRATA: In-game, this is printed before the values are byteswapped.
+        if trace.enabled:  # ERRATA: In-game, this is printed before the values are byteswapped.
+            trace.event("head", "///////////////////////////////////////////\n"
+                                "mapsize {:d} {:d} {:d}".format(self.x, self.y, self.z), x=self.x, y=self.y, z=self.z)
+    #
+
+    def size(self) -> int:
+        return 12
     #
 
     def write(self, io: BinaryIO):
@@ -624,6 +1136,10 @@ class DATA(Chunk):
         self.data = unpack(f"<{count}I", read_exact(io, count * 4))
     #
 
+    def size(self) -> int:
+        return len(self.data) * 4
+    #
+
     def write(self, io: BinaryIO):
         count = len(self.data)
         io.write(pack(f"<{count}I", *self.data))
@@ -645,6 +1161,10 @@ class NAME(Chunk):
             self.names.append(read_c_string(io))
     #
 
+    def size(self) -> int:
+        return 4 + sum(4 + len(name) + 1 for name in self.names)
+    #
+
     def write(self, io: BinaryIO):
         io.write(pack("<I", len(self.names)))
         offs = 0
@@ -663,16 +1183,22 @@ class NAME(Chunk):
 class PATH(Chunk):
     def parse(self, io: BinaryIO):
         count = unpack("<I", read_exact(io, 4))[0]
-        print("PATH Count: {:d}".format(count))
+        if trace.enabled:
+            trace.event("path", "PATH Count: {:d}".format(count), count=count)
         self.packet_lists = list[PacketList]()
         for i in range(count):
             packet_list = PacketList.parse(io)
             # Repeating packet type 3 is clearly animation data (Prop IDs).
-            name = decode_c_string(packet_list.at(1), codepage)  # Message
-            print("{:2d}   name: {:s}".format(i, name))
+            if trace.enabled:
+                name = decode_c_string(packet_list.at(1), codepage)  # Message
+                trace.event("path_entry", "{:2d}   name: {:s}".format(i, name), index=i, name=name)
             self.packet_lists.append(packet_list)
     #
 
+    def size(self) -> int:
+        return 4 + sum(packet_list.size() for packet_list in self.packet_lists)
+    #
+
     def write(self, io: BinaryIO):
         io.write(pack("<I", len(self.packet_lists)))
         for packet_list in self.packet_lists:
@@ -717,22 +1243,30 @@ actor_names = (     None, "heartstun",      "tk",        None,        None,
 class ACTI(Chunk):
     def parse(self, io: BinaryIO, dbgprint: bool = True):
         count = unpack("<I", read_exact(io, 4))[0]
-        print("Actor Count: {:d}".format(count))
+        if trace.enabled:
+            trace.event("acti", "Actor Count: {:d}".format(count), count=count)
         self.actors = list[PacketList]()
         for i in range(count):
             packet_list = PacketList.parse(io)
             self.actors.append(packet_list)
+            if not (dbgprint and trace.enabled):
+                continue
 
             state = unpack("<i", packet_list.at(0))[0]  # Initial state or actor variant
             x, y, z = unpack("<iii", packet_list.at(2))  # Coarse XYZ Pos
             message = decode_c_string(packet_list.at(3), codepage)  # Message
             id = unpack("<i", packet_list.at(4))[0]  # Actor ID
-            if dbgprint: print("{:2d}   state: {:2d}   xyz: {:3d} {:3d} {:3d}   message: {:>20s}   id: {:4d}".format(i, state, x, y, z, message, id), end = "")
+            line = "{:2d}   state: {:2d}   xyz: {:3d} {:3d} {:3d}   message: {:>20s}   id: {:4d}".format(i, state, x, y, z, message, id)
             if id > 0xEFFF:  # See 800054e4
-                if dbgprint: print()
+                translated_id = None
             else:
                 translated_id = actor_id_translation(id)
-                if dbgprint: print("   translated: {:2d} {:s}".format(translated_id, str(actor_names[translated_id])))
+                line += "   translated: {:2d} {:s}".format(translated_id, str(actor_names[translated_id]))
+            trace.event("actor", line, index=i, state=state, x=x, y=y, z=z, message=message, id=id, translated_id=translated_id)
+    #
+
+    def size(self) -> int:
+        return 4 + sum(packet_list.size() for packet_list in self.actors)
     #
 
     def write(self, io: BinaryIO):
@@ -759,6 +1293,10 @@ class VARS(Chunk):
         self.packet_list = PacketList.parse(io)
     #
 
+    def size(self) -> int:
+        return self.packet_list.size()
+    #
+
     def write(self, io: BinaryIO):
         self.packet_list.write(io)
     #
@@ -772,6 +1310,24 @@ class VARS(Chunk):
     #
 
     def json_load(self, vals: list) -> PacketList:
-        self.packet_list = [Packet.json_load(packet_vals) for packet_vals in vals]
+        self.packet_list = PacketList.json_load(vals)
     #
 #
+
+chunk_types: dict[bytes, type[Chunk]] = {
+    b'MAP_': MAP_,  # Subheader (HEAD, DATA, NAME, PATH, VARS, ACTI)
+    b'CELS': CELS,  # Subheader (GEOM, GLGM, GCGM, CTEX, CATR, CANM)
+    b'GRUV': GRUV,  # Length of DATA chunk's array
+    b'GEOM': GEOM,  # Tool Geometry (little-endian)
+    b'GLGM': GLGM,  # PC Geometry (little-endian)
+    b'GCGM': GCGM,  # GameCube Geometry (big-endian)
+    b'CTEX': CTEX,  # PC Textures(?) (PSXtexfile)
+    b'CATR': CATR,
+    b'CANM': CANM,  # Prop Animations
+    b'HEAD': HEAD,  # "Header" (cell dimensions)
+    b'DATA': DATA,  # Cell population data
+    b'NAME': NAME,  # Prop names
+    b'PATH': PATH,
+    b'ACTI': ACTI,  # Actor layout data
+    b'VARS': VARS,
+}
@@ -1,7 +1,12 @@
 # SPDX-License-Identifier: CC0-1.0
 
 from __future__ import annotations
-from os import makedirs
+from io import BytesIO
+from io import UnsupportedOperation
+from mmap import mmap, ACCESS_READ
+from os import fstat, makedirs
+from stat import S_ISREG
+import os
 from pathlib import Path
 from typing import IO, BinaryIO
 
@@ -21,6 +26,103 @@ def peek_exact(io: IO, size: int):
     return data
 #
 
+# A read-only, seekable stream over a buffer such as a memory-mapped file.  read() returns copies like a file
+# would, but read_view() hands out slices of the buffer itself.  Reading starts at pos.
+class ViewReader(object):
+    def __init__(self, buffer, pos: int = 0):
+        self.view = memoryview(buffer)
+        self.pos = pos
+    #
+
+    def read(self, size: int = -1) -> bytes:
+        return bytes(self.read_view(size))
+    #
+
+    def read_view(self, size: int = -1) -> memoryview:
+        end = len(self.view) if size < 0 else min(self.pos + size, len(self.view))
+        view = self.view[self.pos:end]
+        self.pos = max(self.pos, end)
+        return view
+    #
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        match whence:
+            case 0:
+                self.pos = offset
+            case 1:
+                self.pos += offset
+            case 2:
+                self.pos = len(self.view) + offset
+        if self.pos < 0:
+            raise ValueError("Negative seek position {:d}".format(self.pos))
+        return self.pos
+    #
+
+    def tell(self) -> int:
+        return self.pos
+    #
+
+    def readable(self) -> bool:
+        return True
+    #
+
+    def seekable(self) -> bool:
+        return True
+    #
+#
+
+# Like io.read(), but without copying when the stream is already backed by memory.
+def read_view(io: BinaryIO, size: int = -1) -> memoryview:
+    if isinstance(io, ViewReader):
+        view = io.read_view(size)
+    elif isinstance(io, BytesIO):
+        view = io.getbuffer()[io.tell():] if size < 0 else io.getbuffer()[io.tell():io.tell() + size]
+        io.seek(len(view), 1)
+    else:
+        view = memoryview(io.read(size))
+    if size >= 0 and len(view) != size:
+        raise EOFError()
+    return view
+#
+
+# Maps the whole file into memory read-only, whatever the position of io.  Streams without a file descriptor, or
+# pipes, are read from their position onward instead.
+def map_file(io: BinaryIO):
+    try:
+        fileno = io.fileno()
+    except (AttributeError, OSError):
+        return read_view(io)
+    stat = fstat(fileno)
+    if not S_ISREG(stat.st_mode):
+        return read_view(io)
+    if stat.st_size == 0:
+        return b''  # Empty files can't be mapped, but they are still valid (empty) inputs.
+    return mmap(fileno, 0, access = ACCESS_READ)
+#
+
+# Writes the bytes found at offset in the file src, which view is a mapping of.  When both ends are real files,
+# the kernel copies them directly with copy_file_range.  Otherwise, or if it refuses, view is written instead.
+def write_file_range(io: BinaryIO, src: BinaryIO | None, offset: int, view: memoryview):
+    if src is not None and hasattr(os, "copy_file_range"):
+        try:
+            dst_fileno = io.fileno()
+            io.flush()
+            dst_offset = io.tell()
+            copied = 0
+            while copied < len(view):
+                count = os.copy_file_range(src.fileno(), dst_fileno, len(view) - copied, offset + copied, dst_offset + copied)
+                if count == 0:
+                    break
+                copied += count
+            if copied == len(view):
+                io.seek(dst_offset + copied)
+                return
+            io.seek(dst_offset)
+        except (AttributeError, OSError, UnsupportedOperation, ValueError):
+            pass
+    io.write(view)
+#
+
 # Python is stupid for not having a basic "read until delimiter" method, unless I'm just missing documentation.
 def read_c_string(io: BinaryIO):
     size = 0; tellpos = io.tell()
@@ -80,3 +182,9 @@ def open_helper(file, mode, make_dirs = False, overwrite = True, buffering = -1,
     if make_dirs: makedirs(file.parent, exist_ok=True)
     return open(file, mode, buffering, encoding, errors, newline, closefd, opener)
 #
+
+# Every PSXtexfile (*.tex) below directory, in a stable order, each with its path relative to directory.
+def find_psxtexfiles(directory: str) -> list[tuple[Path, Path]]:
+    root = Path(directory)
+    return [(file, file.relative_to(root)) for file in sorted(root.rglob("*")) if file.is_file() and file.suffix.casefold() == ".tex"]
+#
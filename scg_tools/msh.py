@@ -5,8 +5,10 @@ from __future__ import annotations
 from typing import BinaryIO, TextIO
 from struct import unpack
 
+import numpy as np
 from scg_tools.misc import read_exact
 from scg_tools.misc import tristrip_walk
+from scg_tools import trace
 
 class PCMesh(object):
     class Skinning(object):
@@ -111,26 +113,66 @@ class PCMesh(object):
         self.finaldata5s = finaldata5s
     #
 
+    # Every header field that has not been seen to vary.  An empty list means the header looks like every other.
     @staticmethod
-    def parse(io: BinaryIO) -> PCMesh:
-        [vtx_count, finaldata_total_count, joint_count, skinning_count, _, mystery_count] = unpack("<HHHHHH", read_exact(io, 12))
-        [joint_offs, vtx_pos_offs, _, _, mystery_offs, _, skinning_offs] = unpack("<IIIIIII", read_exact(io, 28))
-        [finaldata0_offs, finaldata1_offs, finaldata2_offs, finaldata3_offs, finaldata4_offs, finaldata5_offs, finaldata6_offs, finaldata7_offs] = unpack("<IIIIIIII", read_exact(io, 32))
-        [finaldata0_count, finaldata1_count, finaldata2_count, finaldata3_count, finaldata4_count, finaldata5_count, finaldata6_count, finaldata7_count] = unpack("<HHHHHHHH", read_exact(io, 16))
-        # Unused field?
-        unused_field = unpack("<I", read_exact(io, 4))[0]
-        assert unused_field == 0xCCCCCCCC or unused_field == 0  # Is zero in gourd.msh
+    def header_anomalies(unused_field: int, finaldata_offs: tuple, finaldata_counts: tuple) -> list[str]:
+        anomalies = list[str]()
+        if unused_field != 0xCCCCCCCC and unused_field != 0:  # Is zero in gourd.msh
+            anomalies.append("Unused field is {:08x}".format(unused_field))
         # Additional padding zeroes(?) may follow, e.g. gourd.msh
         # These seem unused.  Let's confirm that.
-        assert finaldata2_count == 0 and finaldata2_offs == 0xCCCCCCCC
-        assert finaldata3_count == 0 and finaldata3_offs == 0xCCCCCCCC
+        for n in (2, 3):
+            if finaldata_counts[n] != 0 or finaldata_offs[n] != 0xCCCCCCCC:
+                anomalies.append("finaldata{:d} is in use (count {:d}, offset {:08x})".format(n, finaldata_counts[n], finaldata_offs[n]))
         # These haven't been observed with non-zero sizes yet.  Sound the alarm if one is seen.
-        assert finaldata6_count == 0
-        assert finaldata7_count == 0
-        # Why does this field exist?  Expand this check if finaldata 2, 3, 6, or 7 are identified.
-        expected_finaldata_total_count = finaldata0_count + finaldata1_count + finaldata4_count + finaldata5_count
+        for n in (6, 7):
+            if finaldata_counts[n] != 0:
+                anomalies.append("finaldata{:d} is in use (count {:d})".format(n, finaldata_counts[n]))
+        return anomalies
+    #
+
+    # Reports everything unexpected about a PC Mesh file at once, rather than stopping at the first problem like parse() does.
+    @staticmethod
+    def validate(io: BinaryIO) -> list[str]:
+        try:
+            [vtx_count, finaldata_total_count, joint_count, skinning_count, _, mystery_count] = unpack("<HHHHHH", read_exact(io, 12))
+            [joint_offs, vtx_pos_offs, _, _, mystery_offs, _, skinning_offs] = unpack("<IIIIIII", read_exact(io, 28))
+            finaldata_offs = unpack("<IIIIIIII", read_exact(io, 32))
+            finaldata_counts = unpack("<HHHHHHHH", read_exact(io, 16))
+            unused_field = unpack("<I", read_exact(io, 4))[0]
+        except EOFError:
+            return ["Header is truncated"]
+        anomalies = PCMesh.header_anomalies(unused_field, finaldata_offs, finaldata_counts)
+        expected_finaldata_total_count = finaldata_counts[0] + finaldata_counts[1] + finaldata_counts[4] + finaldata_counts[5]
         if finaldata_total_count != expected_finaldata_total_count:
-            print(f"finaldata_total_count doesn't match what's expected, difference of {finaldata_total_count - expected_finaldata_total_count}")
+            anomalies.append("finaldata_total_count doesn't match what's expected, difference of {:d}".format(finaldata_total_count - expected_finaldata_total_count))
+        io.seek(mystery_offs)
+        try:
+            mysteries = np.frombuffer(read_exact(io, mystery_count * 12), dtype=np.uint8).reshape(-1, 12)
+        except EOFError:
+            anomalies.append("Mysteries at {:08x} run past the end of the file".format(mystery_offs))
+            return anomalies
+        for n in np.flatnonzero(mysteries.any(axis=1)):
+            anomalies.append("Mystery {:d} is not zero".format(n))
+        return anomalies
+    #
+
+    # With trusted, the header and mysteries are not checked (see validate).
+    @staticmethod
+    def parse(io: BinaryIO, trusted: bool = False) -> PCMesh:
+        [vtx_count, finaldata_total_count, joint_count, skinning_count, _, mystery_count] = unpack("<HHHHHH", read_exact(io, 12))
+        [joint_offs, vtx_pos_offs, _, _, mystery_offs, _, skinning_offs] = unpack("<IIIIIII", read_exact(io, 28))
+        [finaldata0_offs, finaldata1_offs, finaldata2_offs, finaldata3_offs, finaldata4_offs, finaldata5_offs, finaldata6_offs, finaldata7_offs] = finaldata_offs = unpack("<IIIIIIII", read_exact(io, 32))
+        [finaldata0_count, finaldata1_count, finaldata2_count, finaldata3_count, finaldata4_count, finaldata5_count, finaldata6_count, finaldata7_count] = finaldata_counts = unpack("<HHHHHHHH", read_exact(io, 16))
+        # Unused field?
+        unused_field = unpack("<I", read_exact(io, 4))[0]
+        if not trusted:
+            anomalies = PCMesh.header_anomalies(unused_field, finaldata_offs, finaldata_counts)
+            assert len(anomalies) == 0, "\n".join(anomalies)
+            # Why does this field exist?  Expand this check if finaldata 2, 3, 6, or 7 are identified.
+            expected_finaldata_total_count = finaldata0_count + finaldata1_count + finaldata4_count + finaldata5_count
+            if finaldata_total_count != expected_finaldata_total_count:
+                trace.warning("finaldata_total_count_mismatch", f"finaldata_total_count doesn't match what's expected, difference of {finaldata_total_count - expected_finaldata_total_count}", count=finaldata_total_count, expected=expected_finaldata_total_count)
         
         io.seek(vtx_pos_offs)
         vtx_poses = [unpack("<hhhh", read_exact(io, 8)) for _ in range(vtx_count)]
@@ -144,7 +186,8 @@ class PCMesh(object):
         io.seek(mystery_offs)
         mysteries = [read_exact(io, 12) for _ in range(mystery_count)]
         # idk what this does yet, if anything.
-        assert all(mystery == b'\0\0\0\0\0\0\0\0\0\0\0\0' for mystery in mysteries)
+        if not trusted:
+            assert all(mystery == b'\0\0\0\0\0\0\0\0\0\0\0\0' for mystery in mysteries)
 
         io.seek(finaldata0_offs)
         finaldata0s = [PCMesh.FinalData0.parse(io) for _ in range(finaldata0_count)]
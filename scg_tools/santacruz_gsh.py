@@ -4,9 +4,11 @@
 from os import path
 from argparse import ArgumentParser
 
+from scg_tools.cache import set_cache_directory
 from scg_tools.gsh import GCMesh
 from scg_tools.misc import open_helper
-from scg_tools.txg import parse_gcmaterials, decode_gcmaterials
+from scg_tools.txg import GCMaterialsReader, decode_gcmaterials
+from scg_tools import trace
 
 def help(progname: str):
     print(f"This command-line utility can convert the GC Mesh format (*.gsh) made by Santa Cruz games.  Results may vary.\n"
@@ -33,12 +35,22 @@ def main() -> int:
         dest="obj_path",
         help="Convert to Wavefront OBJ file",
         metavar="PATH")
+    parser.add_argument("--cache-dir",
+        action="store",
+        type=str,
+        dest="cache_dir",
+        help="Directory for caching decoded textures between runs. The default is the SCG_TOOLS_CACHE_DIR environment variable, if set.",
+        metavar="CACHE_DIR")
+    trace.add_arguments(parser)
     
     options = parser.parse_args()
+    trace.configure(options.quiet, options.trace_path)
 
     if not options.input:
         parser.print_help()
         return 1
+    if options.cache_dir:
+        set_cache_directory(options.cache_dir)
 
     print(options.input)
     with open(options.input, "rb") as f:
@@ -56,7 +68,7 @@ def main() -> int:
             gsh.dump_wavefront_obj(f, stemname)
         if options.gcmaterials_path:
             with open(options.gcmaterials_path, "rb") as f:
-                images = decode_gcmaterials(parse_gcmaterials(f))
+                images = decode_gcmaterials(GCMaterialsReader.open(f))
             for [n, image] in enumerate(images):
                 with open_helper(f"{directory}/{stemname}_{n}.png", "wb", True, True) as f:
                     image.save(f)
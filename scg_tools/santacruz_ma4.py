@@ -3,15 +3,20 @@
 
 from __future__ import annotations
 from argparse import ArgumentParser
+from os import getpid, replace
+from pathlib import Path
 from struct import unpack
 from typing import BinaryIO, TextIO
 import json
+import sys
 
 from PIL import Image
-from scg_tools.ma4 import CHKFMAP, Chunk, GEOM, GLGM, GCGM, CTEX, ACTI, Prop, PacketList, codepage, actor_id_translation
+from scg_tools.cache import set_cache_directory
+from scg_tools.ma4 import CHKFMAP, Chunk, FormatContext, GEOM, GLGM, GCGM, CTEX, ACTI, Prop, PacketList, codepage, actor_id_translation
 from scg_tools.misc import open_helper
 from scg_tools.tex import decode_psxtexfile, write_psxtexfile
-from scg_tools.txg import decode_gcmaterials, parse_gcmaterials
+from scg_tools.txg import GCMaterialsReader, decode_gcmaterials
+from scg_tools import trace
 
 def dump_props_wavefront_obj(props: list[Prop], images: list[Image.Image], directory: str) -> None:
     print("prop count: {:d}".format(len(props)))
@@ -68,7 +73,7 @@ def dump_ctex_psxtexfile(chkfmap: CHKFMAP, io: BinaryIO) -> None:
 #
 
 def remove_bad_actors(chkfmap: CHKFMAP) -> None:
-    acti_chunk: ACTI = chkfmap.at(b'MAP_').at(b'ACTI')
+    acti_chunk: ACTI = chkfmap.at(b'MAP_').at(b'ACTI', True)
 
     def good_actor(packet_list: PacketList) -> bool:
         id = unpack("<i", packet_list.at(4))[0]
@@ -87,7 +92,7 @@ def chunk_dump_json(chkfmap: CHKFMAP, tid1: bytes, tid2: bytes, io: TextIO):
 #
 
 def chunk_load_json(chkfmap: CHKFMAP, tid1: bytes, tid2: bytes, io: TextIO):
-    chunk: Chunk = chkfmap.at(tid1).at(tid2)
+    chunk: Chunk = chkfmap.at(tid1).at(tid2, True)
     chunk.json_load(json.load(io))
 #
 
@@ -108,6 +113,18 @@ def main() -> int:
         action="store_true",
         dest="old_format_write",
         help="Specify that the CHKFMAP file needs to be written with the old vertex attribute format. This is important for Pickles World 2 Levels 1-4.")
+    parser.add_argument("--detect-format",
+        action="store_true",
+        dest="detect_format",
+        help="Detect the vertex attribute format of each prop from its header instead of relying on --old-format-parse.")
+    parser.add_argument("--validate",
+        action="store_true",
+        dest="validate",
+        help="Report every problem found in the CHKFMAP file, then exit. The exit status is 1 if there were any.")
+    parser.add_argument("--trusted",
+        action="store_true",
+        dest="trusted",
+        help="Skip sanity checks while parsing. Only use this for files that have passed --validate.")
     parser.add_argument("--dump-props-obj",
         action="store",
         type=str,
@@ -130,6 +147,18 @@ def main() -> int:
         action="store_true",
         dest="remove_bad_actors",
         help="Remove actors which cause a game crash. This is important for Pickles World 2 Levels 1-2.")
+    parser.add_argument("-j", "--jobs",
+        action="store",
+        type=int,
+        dest="jobs",
+        help="Parse every chunk up front, with the prop lists of GEOM, GLGM, and GCGM spread over N worker processes. Zero means the number of processors. This pays off when most chunks will be needed anyway, e.g. when converting the vertex format.",
+        metavar="N")
+    parser.add_argument("--cache-dir",
+        action="store",
+        type=str,
+        dest="cache_dir",
+        help="Directory for caching decoded textures between runs. The default is the SCG_TOOLS_CACHE_DIR environment variable, if set.",
+        metavar="CACHE_DIR")
     
     parser.add_argument("--dump-catr-json",
         action="store",
@@ -197,28 +226,44 @@ def main() -> int:
         action="store",
         type=str,
         dest="output",
-        help="Output filepath to write the CHKFMAP file (*.ma4) back out to.",
+        help="Output filepath to write the CHKFMAP file (*.ma4) back out to. \"-\" writes it to stdout.",
         metavar="OUTPUT")
+    parser.add_argument("--in-place",
+        action="store_true",
+        dest="in_place",
+        help="Write the changes back into the input file. If no chunk changed size, only the changed bytes are written, otherwise the whole file is rewritten.")
+    trace.add_arguments(parser)
     options = parser.parse_args()
+    trace.configure(options.quiet, options.trace_path)
 
-    ifile_path = options.input
+    if options.output == "-":
+        # The map is the only thing that may go to stdout, so everything printed along the way goes to stderr.
+        stdout = sys.stdout.buffer
+        sys.stdout = sys.stderr
 
-    # Beware!  Global state!
-    if options.old_format_parse:
-        Prop.old_format_parse = True
-    if options.old_format_write:
-        Prop.old_format_write = True
+    ifile_path = options.input
+    if options.cache_dir:
+        set_cache_directory(options.cache_dir)
 
-    with open(ifile_path, "rb") as f:
-        chkfmap = CHKFMAP(); chkfmap.parse(f)
+    context = FormatContext(None if options.detect_format else options.old_format_parse, options.old_format_write, options.trusted)
+    chkfmap = CHKFMAP()
+    if options.validate:
+        anomalies = list[str]()
+        chkfmap.parse(ifile_path, context, anomalies)
+        anomalies.extend(chkfmap.validate())
+        for anomaly in anomalies:
+            print(anomaly)
+        return 1 if len(anomalies) != 0 else 0
+    chkfmap.parse(ifile_path, context)
+    if options.jobs is not None:
+        chkfmap.parse_all(options.jobs if options.jobs > 0 else None)
     
     if options.props_path:
         if options.gcmaterials_path:
             with open(options.gcmaterials_path, "rb") as f:
-                images = decode_gcmaterials(parse_gcmaterials(f))
+                images = decode_gcmaterials(GCMaterialsReader.open(f))
         else:
-            ctex_chunk: CTEX = chkfmap.at(b'CELS').at(b'CTEX')
-            images = decode_psxtexfile(ctex_chunk.textures)
+            images = decode_psxtexfile(chkfmap.at(b'CELS').at(b'CTEX').textures)
         # Other prop dump functions seem completely redundant, so we'll just dump the ones used in-game
         dump_gcgm_props_wavefront_obj(chkfmap, images, options.props_path)
         
@@ -261,9 +306,26 @@ def main() -> int:
         with open(options.vars_json_load_path, "r") as f:
             chunk_load_json(chkfmap, b'MAP_', b'VARS', f)
     
-    if options.output:
-        with open_helper(options.output, "wb", True, True) as f:
+    if options.in_place:
+        written = chkfmap.patch()
+        if written is not None:
+            print("Patched {:d} bytes in place.".format(written))
+        else:
+            print("Chunk sizes changed, rewriting the whole file.")
+            options.output = ifile_path
+
+    if options.output == "-":
+        chkfmap.write(stdout)
+        stdout.flush()
+    elif options.output:
+        # Unparsed chunks are still views into the memory-mapped input, which may well be the output file too.
+        # Writing beside it first leaves the mapping intact, and it is released before renaming over the input.
+        ofile_path = Path(options.output)
+        temp_path = ofile_path.with_name(ofile_path.name + ".{:d}.tmp".format(getpid()))
+        with open_helper(temp_path, "wb", True, True) as f:
             chkfmap.write(f)
+        chkfmap.close()
+        replace(temp_path, ofile_path)
 
     return 0
 #
@@ -6,23 +6,35 @@ from os import path
 
 from scg_tools.msh import PCMesh
 from scg_tools.misc import open_helper
+from scg_tools import trace
 
 def help(progname: str):
-    print(f"Usage: {progname} <*.msh filepath> [wavefront obj filepath]")
+    print(f"Usage: {progname} [--validate] [--trusted] [--quiet] [--trace FILE] <*.msh filepath> [wavefront obj filepath]")
+    print("  --validate  Report every problem found in the PC Mesh file, then exit. The exit status is 1 if there were any.")
+    print("  --trusted   Skip sanity checks while reading. Only use this for files that have passed --validate.")
 #
 
 def main() -> int:
-    if len(argv) < 2:
+    args = trace.configure_from_argv(argv[1:])
+    validate = "--validate" in args; trusted = "--trusted" in args
+    args = [arg for arg in args if arg not in ("--validate", "--trusted")]
+    if len(args) < 1:
         help(path.basename(argv[0]))
         return 1
-    print(argv[1])
-    with open(argv[1], "rb") as f:
-        msh = PCMesh.parse(f)
+    print(args[0])
+    if validate:
+        with open(args[0], "rb") as f:
+            anomalies = PCMesh.validate(f)
+        for anomaly in anomalies:
+            print(anomaly)
+        return 1 if len(anomalies) != 0 else 0
+    with open(args[0], "rb") as f:
+        msh = PCMesh.parse(f, trusted)
     print("Skinnings:")
     for skinning in msh.skinnings:
         print("{:4} {:4} {:2} {:2} {:2} {:4x}".format(skinning.vtx_begin, skinning.vtx_count, skinning.joint_idx_a, skinning.joint_idx_b, skinning.rank, skinning.weight_fxdpnt))
-    if len(argv) > 2:
-        with open_helper(argv[2], "w", True, True) as f:
+    if len(args) > 1:
+        with open_helper(args[1], "w", True, True) as f:
             msh.dump_wavefront_obj(f)
     return 0
 #
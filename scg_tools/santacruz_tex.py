@@ -2,31 +2,157 @@
 # SPDX-License-Identifier: MIT
 
 from __future__ import annotations
-from sys import argv
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
 from os import makedirs, path
+from pathlib import Path
+from time import perf_counter
 
-from scg_tools.tex import parse_psxtexfile, decode_psxtexfile_solo
+from scg_tools.cache import decode_cache, set_cache_directory
+from scg_tools.misc import find_psxtexfiles, map_file
+from scg_tools.tex import PSXTexFileReader, decode_psxtexfile_solo, validate_psxtexfile
+from scg_tools import trace
 
-def help(progname: str):
-    print("This command-line utility is able to extract the PSXtexfile image format (*.tex) made by Santa Cruz games\n"
-          "Usage: {:s} <PSXtexfile filepath> [output basepath]".format(progname))
+def extract_texture(texture: tuple, outfile_path: str, paletted: bool) -> None:
+    [mode, unk1, unk2, width, height, data, palette] = texture
+    image = decode_psxtexfile_solo(mode, data, palette, width, height, paletted)
+    with open(outfile_path, "wb") as outfile:
+        image.save(outfile, "png")
+#
+
+# Each errand is a run of textures from one file, so the file is mapped and its headers scanned once per run.
+def extract_textures(infile_path: str, ns: range, basepath: str, paletted: bool) -> None:
+    with open(infile_path, "rb") as f, PSXTexFileReader.open(f) as textures:
+        for n in ns:
+            extract_texture(textures[n], "{:s}{:d}.png".format(basepath, n), paletted)
+#
+
+# Plain inputs are named by their basename alone, so two of them can share an output basepath with each other or
+# with a file found by --recursive.  Such a batch is refused before anything is written rather than have one
+# input's textures overwrite the other's.  The same input given twice is only extracted once.
+def find_collisions(inputs: list[tuple[Path, Path]]) -> tuple[list[tuple[Path, Path]], list[str]]:
+    claimed = dict[str, Path]()
+    unique = list[tuple[Path, Path]]()
+    collisions = list[str]()
+    for [infile, relpath] in inputs:
+        key = relpath.as_posix().casefold()
+        if key not in claimed:
+            claimed[key] = infile
+            unique.append((infile, relpath))
+        elif claimed[key].resolve() != infile.resolve():
+            collisions.append("{:s} and {:s} would both be extracted to {:s}".format(str(claimed[key]), str(infile), relpath.as_posix()))
+    return unique, collisions
+#
+
+def extract_batch(inputs: list[tuple[Path, Path]], outdir: str, paletted: bool, jobs: int | None) -> int:
+    [inputs, collisions] = find_collisions(inputs)
+    for collision in collisions:
+        print("Error: {:s}".format(collision))
+    if len(collisions) != 0:
+        return 1
+    time_begin = perf_counter()
+    errands = list[tuple[str, range, str, bool]]()
+    texture_count = total_bytes = 0
+    for [infile, relpath] in inputs:
+        with open(infile, "rb") as f, PSXTexFileReader.open(f) as textures:
+            texture_count += len(textures)
+            total_bytes += len(textures.buffer)
+            basepath = Path(outdir, relpath)
+            makedirs(basepath.parent, exist_ok=True)
+            print("{:s}: {:d} textures".format(str(infile), len(textures)))
+            for start in range(0, len(textures), 16):
+                errands.append((str(infile), range(start, min(start + 16, len(textures))), str(basepath), paletted))
+    if len(errands) != 0:
+        with ProcessPoolExecutor(jobs, initializer = set_cache_directory, initargs = (decode_cache.directory,)) as executor:
+            for _ in executor.map(extract_textures, *zip(*errands)):
+                pass
+    elapsed = perf_counter() - time_begin
+    print("{:d} textures from {:d} files in {:.2f}s ({:.1f} textures/s, {:.2f} MB/s)".format(
+        texture_count, len(inputs), elapsed, texture_count / elapsed, total_bytes / elapsed / 1000000))
+    return 0
 #
 
 def main():
-    if len(argv) < 2:
-        help(path.basename(argv[0]))
+    parser = ArgumentParser(description = "This command-line utility is able to extract the PSXtexfile image format (*.tex) made by Santa Cruz games",
+                            epilog = "Without --output or --recursive, the usage is \"<PSXtexfile filepath> [output basepath]\". "
+                                     "With either of them, every positional argument is an input filepath and the output mirrors the input layout.")
+    parser.add_argument("inputs",
+        action="store",
+        nargs="*",
+        help="Input filepath of the PSXtexfile (*.tex).",
+        metavar="PSXTEXFILE_PATH")
+    parser.add_argument("-p", "--paletted",
+        action="store_true",
+        dest="paletted",
+        help="Save textures in modes 0 and 1 as paletted images instead of expanding them to RGB.")
+    parser.add_argument("-r", "--recursive",
+        action="append",
+        type=str,
+        dest="recursive",
+        help="Extract every PSXtexfile (*.tex) found under a directory. This option can be given more than once.",
+        metavar="DIR",
+        default=[])
+    parser.add_argument("-o", "--output",
+        action="store",
+        type=str,
+        dest="output",
+        help="Output directory for batch extraction. The default is the current directory.",
+        metavar="OUTPUT")
+    parser.add_argument("-j", "--jobs",
+        action="store",
+        type=int,
+        dest="jobs",
+        help="Number of worker processes for batch extraction. The default is the number of processors.",
+        metavar="N")
+    parser.add_argument("--validate",
+        action="store_true",
+        dest="validate",
+        help="Report every problem found in the inputs instead of extracting them. The exit status is 1 if there were any.")
+    parser.add_argument("--cache-dir",
+        action="store",
+        type=str,
+        dest="cache_dir",
+        help="Directory for caching decoded textures between runs. The default is the SCG_TOOLS_CACHE_DIR environment variable, if set.",
+        metavar="CACHE_DIR")
+    trace.add_arguments(parser)
+    options = parser.parse_args()
+    trace.configure(options.quiet, options.trace_path)
+    if options.cache_dir:
+        set_cache_directory(options.cache_dir)
+
+    if options.validate:
+        result = 0
+        for infile_path in options.inputs + [str(file) for directory in options.recursive for [file, _] in find_psxtexfiles(directory)]:
+            with open(infile_path, "rb") as f:
+                anomalies = validate_psxtexfile(map_file(f))
+            for anomaly in anomalies:
+                print("{:s}: {:s}".format(infile_path, anomaly))
+            if len(anomalies) != 0:
+                result = 1
+        return result
+
+    if options.output or options.recursive:
+        inputs = list[tuple[Path, Path]]()
+        for directory in options.recursive:
+            inputs.extend(find_psxtexfiles(directory))
+        for infile_path in options.inputs:
+            inputs.append((Path(infile_path), Path(path.basename(infile_path))))
+        return extract_batch(inputs, options.output if options.output else ".", options.paletted, options.jobs)
+
+    if len(options.inputs) not in (1, 2):
+        parser.print_help()
         return 1
-    infile_path = argv[1]
-    basepath = argv[2] if len(argv) > 2 else infile_path
+    infile_path: str = options.inputs[0]
+    basepath: str = options.inputs[1] if len(options.inputs) > 1 else infile_path
 
     print(infile_path)
     with open (infile_path, "rb") as f:
-        textures = parse_psxtexfile(f)
+        textures = PSXTexFileReader.open(f)
         makedirs(path.dirname(basepath) if '/' in basepath or '\\' in basepath else ".", exist_ok=True)
         print("idx  mode  unk1  unk2  width height")
         for [n, [mode, unk1, unk2, width, height, data, palette]] in enumerate(textures):
             print("{:3} {:5} {:5} {:5} {:6} {:6}".format(n, mode, unk1, unk2, width, height))
-            image = decode_psxtexfile_solo(mode, data, palette, width, height)
+            image = decode_psxtexfile_solo(mode, data, palette, width, height, options.paletted)
             outfile_path = "{:s}{:d}.png".format(basepath, n)
             with open(outfile_path, "wb") as outfile:
                 image.save(outfile, "png")
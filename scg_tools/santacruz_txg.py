@@ -3,13 +3,18 @@
 
 from __future__ import annotations
 from argparse import ArgumentParser
-from os import path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count, getpid, path, remove, replace
 from sys import argv
+from typing import Iterator
 
 from more_itertools import chunked
 from PIL import Image
-from scg_tools.misc import open_helper
-from scg_tools.txg import GCMaterial, parse_gcmaterials, write_gcmaterials
+from scg_tools.cache import set_cache_directory
+from scg_tools.misc import map_file, open_helper
+from scg_tools.txg import GCMaterial, GCMaterialsReader, cmpr_qualities, validate_gcmaterials, write_gcmaterials
+from scg_tools import trace
 
 def command_decode(args: list[str]) -> int:
     parser = ArgumentParser(usage = "decode [options]... <index-1> <output-filepath-1> <index-2> <output-filepath-2> ... <index-N> <output-filepath-N>")
@@ -24,7 +29,7 @@ def command_decode(args: list[str]) -> int:
         action="store",
         type=str,
         dest="output",
-        help="Output filepath for decoded texture(s). This must contain the wildcard character if the GCMaterials file contains multiple textures.",
+        help="Output filepath for decoded texture(s). This must contain the wildcard character if the GCMaterials file contains multiple textures. CMPR textures written to \".dds\" are exported as BC1 (DXT1) without decoding.",
         metavar="OUTPUT")
     parser.add_argument("-w", "--wildcard",
         action="store",
@@ -33,7 +38,25 @@ def command_decode(args: list[str]) -> int:
         help="Wildcard character (or sequence) used by the output option. The default is \"*\".",
         metavar="WILDCARD",
         default='*')    
+    parser.add_argument("--validate",
+        action="store_true",
+        dest="validate",
+        help="Report every problem found in the GCMaterials file, then exit. The exit status is 1 if there were any.")
+    parser.add_argument("--trusted",
+        action="store_true",
+        dest="trusted",
+        help="Skip sanity checks while reading. Only use this for files that have passed --validate.")
+    parser.add_argument("--cache-dir",
+        action="store",
+        type=str,
+        dest="cache_dir",
+        help="Directory for caching decoded textures between runs. The default is the SCG_TOOLS_CACHE_DIR environment variable, if set.",
+        metavar="CACHE_DIR")
+    trace.add_arguments(parser)
     options, rest = parser.parse_known_args(args)
+    trace.configure(options.quiet, options.trace_path)
+    if options.cache_dir:
+        set_cache_directory(options.cache_dir)
     
     errands = list[tuple[int, str]]()
     for batch in chunked(rest, 2, True):  # TODO: Python 3.12 replace with batched
@@ -41,7 +64,14 @@ def command_decode(args: list[str]) -> int:
     ifile_path: str = options.input
     print(ifile_path)
     with open(ifile_path, "rb") as f:
-        gcmaterials = parse_gcmaterials(f)
+        buffer = map_file(f)
+    # Validation works from the bytes alone, so a file too broken to read still gets a full report.
+    if options.validate:
+        anomalies = validate_gcmaterials(buffer)
+        for anomaly in anomalies:
+            print(anomaly)
+        return 1 if len(anomalies) != 0 else 0
+    gcmaterials = GCMaterialsReader(buffer, options.trusted)
     if len(gcmaterials) == 0:
         return 1
     if options.output:
@@ -61,14 +91,43 @@ def command_decode(args: list[str]) -> int:
         gcmaterial = gcmaterials[n]
         print("{:3} {:5} {:5} {:5} {:5} {:6} {:6} {:s}".format(n, gcmaterial.mode, gcmaterial.xfad, gcmaterial.blend, gcmaterial.pad, gcmaterial.width, gcmaterial.height, ofile_path))
         with open_helper(ofile_path, "wb", make_dirs = True, overwrite = True) as f:
-            gcmaterial.decode().save(f)
+            if gcmaterial.mode == 0 and ofile_path.casefold().endswith(".dds"):
+                gcmaterial.export_dds(f)  # CMPR is already BC1, so skip decoding entirely
+            else:
+                gcmaterial.decode().save(f)
     return 0
 #
 
+def encode_gcmaterial(mode: int, ifile_path: str, cmpr_quality: str) -> GCMaterial:
+    if mode == 0 and ifile_path.casefold().endswith(".dds"):
+        with open(ifile_path, "rb") as f:
+            return GCMaterial.import_dds(f)
+    with Image.open(ifile_path) as image:
+        return GCMaterial.encode(image, mode, cmpr_quality)
+#
+
+# Yields in input order.  Only a couple of textures per worker are in flight, which keeps memory bounded.
+def encode_gcmaterials(inputs: list[tuple[int, str]], cmpr_quality: str, jobs: int) -> Iterator[GCMaterial]:
+    if jobs == 1:
+        for [mode, ifile_path] in inputs:
+            yield encode_gcmaterial(mode, ifile_path, cmpr_quality)
+        return
+    workers = jobs if jobs > 0 else cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for [mode, ifile_path] in inputs:
+            pending.append(executor.submit(encode_gcmaterial, mode, ifile_path, cmpr_quality))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while len(pending) != 0:
+            yield pending.popleft().result()
+#
+
 def command_encode(args: list[str]) -> int:
     parser = ArgumentParser(usage = "encode [options]... [mode-1] [input-filepath-1] <mode-2> <input-filepath-2> ... <mode-N> <input-filepath-N>\n"
                                     "\n"
-                                    "Texture modes inputs are 0 or \"CMPR\", and 1 or \"RGBA32\".")
+                                    "Texture modes inputs are 0 or \"CMPR\", and 1 or \"RGBA32\".\n"
+                                    "CMPR inputs ending in \".dds\" must be BC1 (DXT1) and are imported without re-encoding.")
     parser.add_argument("-o", "--output",
         action="store",
         type=str,
@@ -76,7 +135,23 @@ def command_encode(args: list[str]) -> int:
         help="Output filepath for the GCMaterials file (*.txg). This option is required.",
         metavar="OUTPUT",
         required=True)
+    parser.add_argument("-q", "--cmpr-quality",
+        action="store",
+        type=str,
+        dest="cmpr_quality",
+        help="Encoder tier for CMPR textures. \"fast\" uses bounding box endpoints, \"quality\" fits and refines endpoints along the principal axis. The default is \"quality\".",
+        choices=cmpr_qualities,
+        default="quality")
+    parser.add_argument("-j", "--jobs",
+        action="store",
+        type=int,
+        dest="jobs",
+        help="Number of worker processes used to encode textures. The default is 1. Zero means the number of processors.",
+        metavar="N",
+        default=1)
+    trace.add_arguments(parser)
     options, rest = parser.parse_known_args(args)
+    trace.configure(options.quiet, options.trace_path)
 
     inputs = list[tuple[int, str]]()
     for [mode, ifile_path] in chunked(rest, 2, True):  # TODO: Python 3.12 replace with batched
@@ -87,19 +162,22 @@ def command_encode(args: list[str]) -> int:
                 mode = 1
             case _:
                 mode = int(mode, 0)
-        inputs.append((0, ifile_path))
+        inputs.append((mode, ifile_path))
     if len(inputs) == 0:
         parser.print_help()
         return 1
     ofile_path: str = options.output
     
-    gcmaterials = list[GCMaterial]()
-    for [mode, ifile_path] in inputs:
-        with Image.open(ifile_path) as image:
-            gcmaterials.append(GCMaterial.encode(image, mode))
-    
-    with open_helper(ofile_path, "wb", make_dirs = True, overwrite = True) as f:
-        write_gcmaterials(f, gcmaterials)
+    # Written under a temporary name first so that a failed encode never truncates an existing GCMaterials file.
+    temp_path = ofile_path + ".{:d}.tmp".format(getpid())
+    try:
+        with open_helper(temp_path, "wb", make_dirs = True, overwrite = True) as f:
+            write_gcmaterials(f, encode_gcmaterials(inputs, options.cmpr_quality, options.jobs), len(inputs))
+    except BaseException:
+        if path.exists(temp_path):
+            remove(temp_path)
+        raise
+    replace(temp_path, ofile_path)
     return 0
 #
 
@@ -2,58 +2,87 @@
 # SPDX-License-Identifier: MIT
 
 from __future__ import annotations
-from struct import unpack, pack
+from mmap import mmap
+from struct import unpack, unpack_from, pack
 from typing import BinaryIO
 
+import numpy as np
 from PIL import Image
-from scg_tools.misc import read_exact
+from scg_tools.cache import cached_decode
+from scg_tools.misc import read_exact, map_file
 
 class PSXTexFileError(Exception):
     pass
 #
 
-def bgr555_le_decode(data: bytes) -> list[tuple[int]]:
-    colors = list[tuple[int]]()
-    for i in range(0, len(data), 2):
-        bits = unpack("<H", data[i:i+2])[0]
-        colors.append(pack("BBB", ((bits & 31) * 255 // 31), (bits >> 5 & 31) * 255 // 31, (bits >> 10 & 31) * 255 // 31))
-        assert bits >> 15 == 0, "Non-zero most-significant bit in BGR555 data. Is it alpha?"
-    return colors
+# Every possible BGR555 value expanded to 8-bit RGB, so decoding is a single gather instead of per-pixel math.
+def make_bgr555_lut() -> np.ndarray:
+    bits = np.arange(0x8000, dtype=np.uint32)
+    lut = np.empty((0x8000, 3), dtype=np.uint8)
+    lut[:, 0] = (bits       & 31) * 255 // 31
+    lut[:, 1] = (bits >>  5 & 31) * 255 // 31
+    lut[:, 2] = (bits >> 10 & 31) * 255 // 31
+    return lut
 #
 
-def decode_mode0(data: bytes, palette: bytes, width: int, height: int) -> Image.Image:
+bgr555_lut = make_bgr555_lut()
+
+def bgr555_le_decode(data: bytes) -> np.ndarray:
+    bits = np.frombuffer(data, dtype="<u2")
+    assert not (bits >> 15).any(), "Non-zero most-significant bit in BGR555 data. Is it alpha?"
+    return bgr555_lut[bits & 0x7FFF]
+#
+
+def decode_mode0(data: bytes, palette: bytes, width: int, height: int, paletted: bool = False) -> Image.Image:
     # Only the first 32 bytes of the palette are initialized.
     clut = bgr555_le_decode(palette[:32])
-    image = bytearray()
-    for i in data:
-        image.extend(clut[i      & 15])
-        image.extend(clut[i >> 4 & 15])
-    return Image.frombytes("RGB", (width, height), image)
+    packed = np.frombuffer(data, dtype=np.uint8)
+    indexes = np.empty(len(packed) * 2, dtype=np.uint8)
+    indexes[0::2] = packed      & 15
+    indexes[1::2] = packed >> 4 & 15
+    if paletted:
+        image = Image.frombytes("P", (width, height), indexes.tobytes())
+        image.putpalette(clut.tobytes(), "RGB")
+        return image
+    return Image.frombytes("RGB", (width, height), clut[indexes].tobytes())
 #
 
-def decode_mode1(data: bytes, palette: bytes, width: int, height: int) -> Image.Image:
+def decode_mode1(data: bytes, palette: bytes, width: int, height: int, paletted: bool = False) -> Image.Image:
     clut = bgr555_le_decode(palette)
-    image = bytearray()
-    for i in data:
-        image.extend(clut[i])
-    return Image.frombytes("RGB", (width, height), image)
+    if paletted:
+        image = Image.frombytes("P", (width, height), bytes(data))
+        image.putpalette(clut.tobytes(), "RGB")
+        return image
+    indexes = np.frombuffer(data, dtype=np.uint8)
+    return Image.frombytes("RGB", (width, height), clut[indexes].tobytes())
 #
 
 def decode_mode2(data: bytes, width: int, height: int) -> Image.Image:
-    image = b''.join(bgr555_le_decode(data))
-    return Image.frombytes("RGB", (width, height), image)
+    return Image.frombytes("RGB", (width, height), bgr555_le_decode(data).tobytes())
 #
 
 def decode_mode3(data: bytes, width: int, height: int) -> Image.Image:
     return Image.frombytes("RGBA", (width, height), data)
 #
 
-def decode_psxtexfile_solo(mode: int, data: bytes, palette: bytes, width: int, height: int) -> Image.Image:
+def decode_psxtexfile_solo(mode: int, data: bytes, palette: bytes, width: int, height: int, paletted: bool = False) -> Image.Image:
+    # Only paletted modes depend on the palette (and the paletted option).
+    match mode:
+        case 0:
+            format = "psxtexfile-p" if paletted else "psxtexfile"; palette_used = palette[:32]
+        case 1:
+            format = "psxtexfile-p" if paletted else "psxtexfile"; palette_used = palette
+        case _:
+            format = "psxtexfile"; palette_used = None
+    return cached_decode(format, mode, width, height, data, palette_used, lambda : decode_psxtexfile_uncached(mode, data, palette, width, height, paletted))
+#
+
+def decode_psxtexfile_uncached(mode: int, data: bytes, palette: bytes, width: int, height: int, paletted: bool = False) -> Image.Image:
     match mode:
         case 0:
-            return decode_mode0(data, palette, width, height)
+            return decode_mode0(data, palette, width, height, paletted)
         case 1:
-            return decode_mode1(data, palette, width, height)
+            return decode_mode1(data, palette, width, height, paletted)
         case 2:
             return decode_mode2(data, width, height)
         case 3:
@@ -62,13 +91,143 @@ def decode_psxtexfile_solo(mode: int, data: bytes, palette: bytes, width: int, h
             raise PSXTexFileError("Unknown texture format: {:d}.".format(mode))
 #
 
-def decode_psxtexfile(psxtexfile: list[int, bytes, bytes, int, int]) -> list[Image.Image]:
+def decode_psxtexfile(psxtexfile: list[int, bytes, bytes, int, int], paletted: bool = False) -> list[Image.Image]:
     images = list[Image.Image]()
     for [mode, unk1, unk2, width, height, data, palette] in psxtexfile:
-        images.append(decode_psxtexfile_solo(mode, data, palette, width, height))
+        images.append(decode_psxtexfile_solo(mode, data, palette, width, height, paletted))
     return images
 #
 
+# Straight to an RGBA array without going through Pillow.  With color_key, pure blue becomes transparent, which
+# is what TEX2TXG has always done.  Full color 8-bit RGBA textures already have alpha and are left alone.
+def decode_psxtexfile_rgba(mode: int, data: bytes, palette: bytes, width: int, height: int, color_key: bool = False) -> np.ndarray:
+    match mode:
+        case 0 | 1:
+            clut = bgr555_le_decode(palette[:32] if mode == 0 else palette)
+            rgba = np.empty((len(clut), 4), dtype=np.uint8)
+            rgba[:, :3] = clut
+            rgba[:, 3] = 255
+            if color_key:
+                rgba[(clut == (0, 0, 255)).all(axis=1), 3] = 0  # Masking the palette masks every pixel using it
+            packed = np.frombuffer(data, dtype=np.uint8)
+            if mode == 0:
+                indexes = np.empty(len(packed) * 2, dtype=np.uint8)
+                indexes[0::2] = packed      & 15
+                indexes[1::2] = packed >> 4 & 15
+            else:
+                indexes = packed
+            pixels = rgba[indexes]
+        case 2:
+            bits = np.frombuffer(data, dtype="<u2")
+            pixels = np.empty((len(bits), 4), dtype=np.uint8)
+            pixels[:, :3] = bgr555_le_decode(data)
+            pixels[:, 3] = 255
+            if color_key:
+                pixels[bits == 0x7C00, 3] = 0  # BGR555 pure blue
+        case 3:
+            pixels = np.frombuffer(data, dtype=np.uint8)
+        case _:
+            raise PSXTexFileError("Unknown texture format: {:d}.".format(mode))
+    return pixels.reshape(height, width, 4)
+#
+
+# Rounds to the nearest 5-bit value, so re-encoding a decoded texture is lossless.
+def bgr555_le_encode(rgb: np.ndarray) -> np.ndarray:
+    rgb = (rgb.astype(np.uint32) * 31 + 127) // 255
+    return (rgb[..., 0] | rgb[..., 1] << 5 | rgb[..., 2] << 10).astype("<u2")
+#
+
+def median_cut(colors: np.ndarray, counts: np.ndarray, size: int) -> np.ndarray:
+    # colors are unique 5-bit RGB triples, counts are how many pixels use them.
+    boxes = [np.arange(len(colors))]
+    extents = [np.ptp(colors, axis=0)]
+    while len(boxes) < size:
+        # Split whichever box spans the widest range of a single channel.
+        best = max(range(len(boxes)), key = lambda n : extents[n].max())
+        if extents[best].max() == 0:
+            break
+        box = boxes.pop(best); channel = extents.pop(best).argmax()
+        box = box[np.argsort(colors[box, channel], kind="stable")]
+        cumulative = np.cumsum(counts[box])
+        split = int(np.searchsorted(cumulative, cumulative[-1] / 2)) + 1
+        split = min(max(split, 1), len(box) - 1)
+        for half in (box[:split], box[split:]):
+            boxes.append(half); extents.append(np.ptp(colors[half], axis=0))
+    palette = np.empty((len(boxes), 3), dtype=np.uint32)
+    for [n, box] in enumerate(boxes):
+        weights = counts[box]
+        palette[n] = np.rint((colors[box] * weights[:, None]).sum(axis=0) / weights.sum())
+    return palette
+#
+
+def nearest_color(colors: np.ndarray, palette: np.ndarray) -> np.ndarray:
+    # |c - p|^2 = |c|^2 - 2c.p + |p|^2, and |c|^2 doesn't affect which p is nearest.  Small integers are exact in float32.
+    colors = colors.astype(np.float32); palette = palette.astype(np.float32)
+    distances = (palette ** 2).sum(axis=1) - 2 * (colors @ palette.T)
+    return distances.argmin(axis=1).astype(np.uint8)
+#
+
+def quantize_bgr555(image: Image.Image, size: int) -> tuple[np.ndarray, np.ndarray]:
+    if image.mode == "P":
+        # Paletted images that already fit (e.g. from decode_psxtexfile_solo) keep their indexes as-is.
+        indexes = np.asarray(image).reshape(-1)
+        clut = np.asarray(image.getpalette("RGB"), dtype=np.uint8).reshape(-1, 3)
+        if indexes.max(initial = 0) < min(size, len(clut)):
+            return (indexes.astype(np.uint8), bgr555_le_encode(clut[:size]))
+    codes = bgr555_le_encode(np.asarray(image.convert("RGB")).reshape(-1, 3))
+    [unique_codes, inverse, counts] = np.unique(codes, return_inverse = True, return_counts = True)
+    if len(unique_codes) <= size:
+        return (inverse.astype(np.uint8), unique_codes)
+    unique_colors = np.stack((unique_codes & 31, unique_codes >> 5 & 31, unique_codes >> 10 & 31), axis=1)
+    palette = median_cut(unique_colors, counts, size)
+    indexes = nearest_color(unique_colors, palette)[inverse]
+    return (indexes, (palette[:, 0] | palette[:, 1] << 5 | palette[:, 2] << 10).astype("<u2"))
+#
+
+def encode_psxtexfile_solo(image: Image.Image, mode: int) -> tuple:
+    width, height = image.size
+    palette = np.zeros(256, dtype="<u2")
+    match mode:
+        case 0:
+            if width * height % 2 != 0:
+                raise PSXTexFileError("Texture format 0 requires an even number of pixels.")
+            [indexes, clut] = quantize_bgr555(image, 16)
+            palette[:len(clut)] = clut
+            data = (indexes[0::2] | indexes[1::2] << 4).tobytes()
+        case 1:
+            [indexes, clut] = quantize_bgr555(image, 256)
+            palette[:len(clut)] = clut
+            data = indexes.tobytes()
+        case 2:
+            data = bgr555_le_encode(np.asarray(image.convert("RGB"))).tobytes()
+        case 3:
+            data = image.convert("RGBA").tobytes()
+        case _:
+            raise PSXTexFileError("Unknown texture format: {:d}.".format(mode))
+    return (mode, 0, 0, width, height, data, palette.tobytes())
+#
+
+def encode_psxtexfile(images: list[Image.Image], mode: int) -> list[tuple]:
+    textures = list[tuple]()
+    for image in images:
+        textures.append(encode_psxtexfile_solo(image, mode))
+    return textures
+#
+
+
+def psxtexfile_data_size(mode: int, width: int, height: int) -> int:
+    match mode:
+        case 0:  # 4-bit paletted little-endian BGR555 (1/2 byte per pixel)
+            return width * height // 2
+        case 1:  # 8-bit paletted little-endian BGR555 (1 byte per pixel)
+            return width * height
+        case 2:  # Full color little-endian BGR555 (2 bytes per pixel)
+            return width * height * 2
+        case 3:  # Full color 8-bit RGB (4 bytes per pixel)
+            return width * height * 4
+        case _:
+            raise PSXTexFileError("Unknown texture format: {:d}.".format(mode))
+#
 
 def parse_psxtexfile_solo(io: BinaryIO):
     # (In the MSVC Debug Runtime, uninitialized data contains bytes of 0xCC)
@@ -78,17 +237,8 @@ def parse_psxtexfile_solo(io: BinaryIO):
     # unk2 can either be 0xFFFF (implying it is signed) or uninitialized.
     [mode, unk1, unk2, width, height] = unpack("<bbhHH", read_exact(io, 8))
     palette = read_exact(io, 512)  # Still exists even if it's not used.
-    match mode:
-        case 0:  # 4-bit paletted little-endian BGR555 (1/2 byte per pixel)
-            return (mode, unk1, unk2, width, height, read_exact(io, width * height // 2), palette)
-        case 1:  # 8-bit paletted little-endian BGR555 (1 byte per pixel)
-            return (mode, unk1, unk2, width, height, read_exact(io, width * height), palette)
-        case 2:  # Full color little-endian BGR555 (2 bytes per pixel)
-            return (mode, unk1, unk2, width, height, read_exact(io, width * height * 2), palette)
-        case 3:  # Full color 8-bit RGB (4 bytes per pixel)
-            return (mode, unk1, unk2, width, height, read_exact(io, width * height * 4), palette)
-        case _:
-            raise PSXTexFileError("Unknown texture format: {:d}.".format(mode))
+    data = read_exact(io, psxtexfile_data_size(mode, width, height))
+    return (mode, unk1, unk2, width, height, data, palette)
 #
 
 def parse_psxtexfile(io: BinaryIO):
@@ -100,6 +250,98 @@ def parse_psxtexfile(io: BinaryIO):
     return textures
 #
 
+# Random access to the textures of a PSXtexfile without reading all of them.  Only the 8-byte headers are
+# visited up front; data and palettes are handed out as memoryview slices of the underlying buffer.
+class PSXTexFileReader(object):
+    def __init__(self, buffer):
+        self.buffer = memoryview(buffer)
+        self.offsets = list[int]()
+        offset = 0
+        while offset + 8 <= len(self.buffer):
+            [mode, unk1, unk2, width, height] = unpack_from("<bbhHH", self.buffer, offset)
+            size = 8 + 512 + psxtexfile_data_size(mode, width, height)
+            if offset + size > len(self.buffer):
+                break  # Truncated texture, which parse_psxtexfile would also stop at.
+            self.offsets.append(offset)
+            offset += size
+    #
+
+    @staticmethod
+    def open(io: BinaryIO) -> PSXTexFileReader:
+        return PSXTexFileReader(map_file(io))
+    #
+
+    def __enter__(self) -> PSXTexFileReader:
+        return self
+    #
+
+    def __exit__(self, *exc_info):
+        self.close()
+    #
+
+    # Releases the buffer, and unmaps it if it is a mapping like the one open() makes.  Textures taken from the
+    # reader hold views into the buffer, so they must be let go of first, or BufferError is raised.
+    def close(self):
+        obj = self.buffer.obj
+        self.buffer.release()
+        if isinstance(obj, mmap):
+            obj.close()
+    #
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+    #
+
+    def __getitem__(self, n: int) -> tuple:
+        offset = self.offsets[n]
+        [mode, unk1, unk2, width, height] = unpack_from("<bbhHH", self.buffer, offset)
+        palette = self.buffer[offset + 8:offset + 520]
+        data = self.buffer[offset + 520:offset + 520 + psxtexfile_data_size(mode, width, height)]
+        return (mode, unk1, unk2, width, height, data, palette)
+    #
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+    #
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+    #
+#
+
+# Reports everything wrong with a PSXtexfile at once, rather than stopping at the first problem like the parsers do.
+def validate_psxtexfile(buffer) -> list[str]:
+    buffer = memoryview(buffer)
+    anomalies = list[str]()
+    offset = 0; n = 0
+    while offset + 8 <= len(buffer):
+        [mode, unk1, unk2, width, height] = unpack_from("<bbhHH", buffer, offset)
+        if mode not in range(4):
+            anomalies.append("Texture {:d} at {:08x}: unknown texture format {:d}".format(n, offset, mode))
+            return anomalies  # Without knowing the size of this texture, the next one can't be found
+        size = 8 + 512 + psxtexfile_data_size(mode, width, height)
+        if offset + size > len(buffer):
+            anomalies.append("Texture {:d} at {:08x}: truncated, {:d} of {:d} bytes present".format(n, offset, len(buffer) - offset, size))
+            return anomalies
+        match mode:
+            case 0:
+                bgr555 = buffer[offset + 8:offset + 40]  # Only the first 32 bytes of the palette are initialized.
+            case 1:
+                bgr555 = buffer[offset + 8:offset + 520]
+            case 2:
+                bgr555 = buffer[offset + 520:offset + size]
+            case _:
+                bgr555 = b''
+        alpha_count = np.count_nonzero(np.frombuffer(bgr555, dtype="<u2") >> 15)
+        if alpha_count != 0:
+            anomalies.append("Texture {:d} at {:08x}: {:d} BGR555 values with a non-zero most-significant bit".format(n, offset, alpha_count))
+        offset += size; n += 1
+    if offset != len(buffer):
+        anomalies.append("{:d} trailing bytes at {:08x}".format(len(buffer) - offset, offset))
+    return anomalies
+#
+
 def write_psxtexfile_solo(io: BinaryIO, mode: int, unk1: int, unk2: int, width: int, height: int, data: bytes, palette: bytes):
     io.write(pack("<bbhHH", mode, unk1, unk2, width, height))
     io.write(palette)
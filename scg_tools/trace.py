@@ -0,0 +1,103 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from argparse import ArgumentParser
+import json
+import logging
+
+# Parse events go through the "scg_tools" logger.  Each record carries an event name and a dict of fields.  Once a
+# tool calls configure(), records with a message are echoed to the console the way the tools always printed them,
+# and every record can be written to a trace file as one JSON object per line.  Until then, importing the package
+# leaves logging alone, and records reach whatever handlers the application set up.
+logger = logging.getLogger("scg_tools")
+logger.addHandler(logging.NullHandler())
+
+# Hot paths check this before formatting anything, so tracing costs one attribute lookup when nobody is listening.
+enabled = False
+# The arguments of the last configure(), for handing on to worker processes (see configure_worker).
+settings: tuple[bool | None, str | None] = (None, None)
+
+class ConsoleHandler(logging.Handler):
+    # print() looks up sys.stdout on every call, so this keeps working when a tool redirects it after startup.
+    def emit(self, record: logging.LogRecord):
+        if record.msg is not None:
+            print(record.msg)
+    #
+#
+
+class JSONLinesFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({"time": record.created, "level": record.levelname, "event": record.event, **record.fields}, default=str)
+    #
+#
+
+def event(name: str, message: str | None = None, level: int = logging.INFO, /, **fields):
+    logger.log(level, message, extra={"event": name, "fields": fields})
+#
+
+def warning(name: str, message: str, /, **fields):
+    event(name, message, logging.WARNING, **fields)
+#
+
+# quiet silences everything but warnings on the console.  trace_path, if given, receives every event.  It is
+# truncated first unless append is set.
+def configure(quiet: bool = False, trace_path: str | None = None, append: bool = False):
+    global enabled, settings
+    for handler in list(logger.handlers):
+        logger.removeHandler(handler)
+        handler.close()
+    console = ConsoleHandler(logging.WARNING if quiet else logging.INFO)
+    logger.addHandler(console)
+    if trace_path is not None:
+        if not append:
+            open(trace_path, "w").close()
+        # Always appending keeps this process from writing over events that worker processes appended meanwhile.
+        trace = logging.FileHandler(trace_path, "a", encoding="utf-8")
+        trace.setFormatter(JSONLinesFormatter())
+        logger.addHandler(trace)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    enabled = not quiet or trace_path is not None
+    settings = (quiet, trace_path)
+#
+
+# For the initializer of a process pool, with settings as the initargs.  Workers that are spawned rather than
+# forked start out with the defaults, so without this they would ignore --quiet and lose their --trace events.
+def configure_worker(quiet: bool | None, trace_path: str | None):
+    if quiet is None:
+        return  # Tracing was never configured, so workers leave logging alone too.
+    configure(quiet, trace_path, True)
+#
+
+def add_arguments(parser: ArgumentParser):
+    parser.add_argument("--quiet",
+        action="store_true",
+        dest="quiet",
+        help="Do not print parse progress. Warnings are still printed.")
+    parser.add_argument("--trace",
+        action="store",
+        type=str,
+        dest="trace_path",
+        help="Write parse events, with offsets, sizes, counts, and timings, to a file as JSON lines.",
+        metavar="FILE")
+#
+
+# For the tools that read sys.argv by hand.  Returns the arguments left over.
+def configure_from_argv(args: list[str]) -> list[str]:
+    quiet = False; trace_path = None
+    rest = list[str]()
+    i = 0
+    while i < len(args):
+        if args[i] == "--quiet":
+            quiet = True
+        elif args[i] == "--trace" and i + 1 < len(args):
+            trace_path = args[i + 1]; i += 1
+        elif args[i].startswith("--trace="):
+            trace_path = args[i][8:]
+        else:
+            rest.append(args[i])
+        i += 1
+    configure(quiet, trace_path)
+    return rest
+#
@@ -2,20 +2,201 @@
 # SPDX-License-Identifier: MIT
 
 from __future__ import annotations
-from io import BytesIO
-from struct import unpack, pack
-from typing import BinaryIO
+from struct import unpack, unpack_from, pack
+from typing import BinaryIO, Iterable
 
-from gclib.texture_utils import decode_image, encode_image
-from gclib.gx_enums import ImageFormat
-from gclib.fs_helpers import read_all_bytes
+import numpy as np
 from PIL import Image
-from scg_tools.misc import read_exact, peek_exact, align_up
+from scg_tools.cache import cached_decode
+from scg_tools.dds import parse_dds_bc1, write_dds_bc1
+from scg_tools.misc import read_exact, map_file, align_up
+from scg_tools import trace
 
 # Assert: Maxtextures reached  File: V:/pickles/GAME/gc_pickles/texturemanager.cpp Line 116
 # If you ever reach this, you are doing something horribly wrong
 Maxtextures = 0x800
 
+class GCMaterialsError(Exception):
+    pass
+#
+
+def rgb565_decode(bits: np.ndarray) -> np.ndarray:
+    rgb = np.empty(bits.shape + (3,), dtype=np.uint16)
+    rgb[..., 0] = (bits >> 11 & 31) * 255 // 31
+    rgb[..., 1] = (bits >>  5 & 63) * 255 // 63
+    rgb[..., 2] = (bits       & 31) * 255 // 31
+    return rgb
+#
+
+def cmpr_palette(color0: np.ndarray, color1: np.ndarray) -> np.ndarray:
+    # The integer math mirrors gclib's get_interpolated_cmpr_colors so that decoded output is identical.
+    rgb0 = rgb565_decode(color0); rgb1 = rgb565_decode(color1)
+    four_color = (color0 > color1)[..., None]
+    palette = np.empty(color0.shape + (4, 4), dtype=np.uint8)
+    palette[..., 0, :3] = rgb0
+    palette[..., 1, :3] = rgb1
+    palette[..., 2, :3] = np.where(four_color, (2 * rgb0 + rgb1) // 3, rgb0 // 2 + rgb1 // 2)
+    palette[..., 3, :3] = np.where(four_color, (rgb0 + 2 * rgb1) // 3, 0)
+    palette[..., :3, 3] = 255
+    palette[..., 3, 3] = np.where(four_color[..., 0], 255, 0)
+    return palette
+#
+
+# CMPR is 8x8 tiles of 2x2 sub-blocks, each sub-block being a big-endian S3TC (DXT1) block.  Everything is decoded at once.
+def decode_cmpr(data: bytes, width: int, height: int) -> np.ndarray:
+    tiles_wide = align_up(width, 8) // 8; tiles_tall = align_up(height, 8) // 8
+    blocks = np.frombuffer(data, dtype=np.uint8, count=tiles_wide * tiles_tall * 32).reshape(tiles_tall, tiles_wide, 2, 2, 8)
+    color0 = blocks[..., 0].astype(np.uint16) << 8 | blocks[..., 1]
+    color1 = blocks[..., 2].astype(np.uint16) << 8 | blocks[..., 3]
+    palette = cmpr_palette(color0, color1).reshape(-1, 4, 4)
+    # Each byte is one row of a sub-block, with the leftmost pixel in the most-significant bits.
+    indexes = blocks[..., 4:8, None] >> np.array([6, 4, 2, 0], dtype=np.uint8) & 3
+    pixels = palette[np.arange(len(palette))[:, None], indexes.reshape(len(palette), 16)]
+    pixels = pixels.reshape(tiles_tall, tiles_wide, 2, 2, 4, 4, 4).transpose(0, 2, 4, 1, 3, 5, 6)
+    return pixels.reshape(tiles_tall * 8, tiles_wide * 8, 4)[:height, :width]
+#
+
+cmpr_qualities = ("fast", "quality")
+
+def rgb565_encode(rgb: np.ndarray) -> np.ndarray:
+    rgb = np.clip(np.rint(rgb), 0, 255).astype(np.uint16)
+    return ((rgb[..., 0] * 31 + 127) // 255) << 11 | ((rgb[..., 1] * 63 + 127) // 255) << 5 | (rgb[..., 2] * 31 + 127) // 255
+#
+
+def cmpr_endpoints_fast(colors: np.ndarray, opaque: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Opposite corners of the bounding box of the opaque pixels.
+    lo = np.where(opaque[..., None], colors, np.inf).min(axis=1)
+    hi = np.where(opaque[..., None], colors, -np.inf).max(axis=1)
+    return (hi, lo)
+#
+
+def cmpr_endpoints_quality(colors: np.ndarray, opaque: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Fit a line through the opaque pixels along their principal axis, then refine the endpoints with least squares.
+    weights = opaque.astype(np.float64)[..., None]
+    count = np.maximum(weights.sum(axis=1), 1)
+    mean = (colors * weights).sum(axis=1) / count
+    centered = (colors - mean[:, None, :]) * weights
+    covariance = centered.transpose(0, 2, 1) @ centered
+    axis = np.ones_like(mean)
+    for _ in range(8):  # Power iteration
+        axis = (covariance @ axis[..., None])[..., 0]
+        axis /= np.maximum(np.linalg.norm(axis, axis=1, keepdims=True), 1e-12)
+    projection = (centered * axis[:, None, :]).sum(axis=2)  # Transparent pixels project to zero, which is harmless.
+    endpoint0 = mean + axis * projection.max(axis=1)[:, None]
+    endpoint1 = mean + axis * projection.min(axis=1)[:, None]
+
+    # Blocks with transparency only get one interpolated color (halfway), the rest get two (thirds).
+    three_color = (~opaque).any(axis=1)
+    for _ in range(2):
+        fractions = np.where(three_color[:, None], np.array([1, 0, 1/2, 0]), np.array([1, 0, 2/3, 1/3]))
+        candidates = endpoint0[:, None, :] * fractions[..., None] + endpoint1[:, None, :] * (1 - fractions[..., None])
+        distances = ((colors[:, :, None, :] - candidates[:, None, :, :]) ** 2).sum(axis=3)
+        distances[..., 3] = np.where(three_color[:, None], np.inf, distances[..., 3])
+        a = np.take_along_axis(fractions, distances.argmin(axis=2), axis=1) * opaque
+        b = (1 - a) * opaque
+        aa = (a * a).sum(axis=1); bb = (b * b).sum(axis=1); ab = (a * b).sum(axis=1)
+        ax = (a[..., None] * colors).sum(axis=1); bx = (b[..., None] * colors).sum(axis=1)
+        determinant = aa * bb - ab * ab
+        solvable = np.abs(determinant) > 1e-6
+        determinant = np.where(solvable, determinant, 1)[:, None]
+        endpoint0 = np.where(solvable[:, None], (ax * bb[:, None] - bx * ab[:, None]) / determinant, endpoint0)
+        endpoint1 = np.where(solvable[:, None], (bx * aa[:, None] - ax * ab[:, None]) / determinant, endpoint1)
+    return (endpoint0, endpoint1)
+#
+
+def encode_cmpr(pixels: np.ndarray, quality: str = "quality") -> bytes:
+    height, width = pixels.shape[:2]
+    pixels = np.pad(pixels, ((0, align_up(height, 8) - height), (0, align_up(width, 8) - width), (0, 0)), mode="edge")
+    tiles_tall = pixels.shape[0] // 8; tiles_wide = pixels.shape[1] // 8
+    # Gather each 4x4 sub-block in the order they're stored: tile row, tile column, sub-block row, sub-block column.
+    blocks = pixels.reshape(tiles_tall, 2, 4, tiles_wide, 2, 4, 4).transpose(0, 3, 1, 4, 2, 5, 6).reshape(-1, 16, 4)
+    colors = blocks[..., :3].astype(np.float64)
+    opaque = blocks[..., 3] >= 128  # Punch-through alpha
+    match quality:
+        case "fast":
+            [endpoint0, endpoint1] = cmpr_endpoints_fast(colors, opaque)
+        case "quality":
+            [endpoint0, endpoint1] = cmpr_endpoints_quality(colors, opaque)
+        case _:
+            raise GCMaterialsError("Unknown CMPR quality: {:s}.".format(quality))
+    fully_transparent = ~opaque.any(axis=1)
+    color0 = np.where(fully_transparent, 0, rgb565_encode(np.where(fully_transparent[:, None], 0, endpoint0)))
+    color1 = np.where(fully_transparent, 0, rgb565_encode(np.where(fully_transparent[:, None], 0, endpoint1)))
+
+    # color0 > color1 selects four colors, otherwise three colors plus transparent.
+    swap = np.where(opaque.all(axis=1), color0 < color1, color0 > color1)
+    [color0, color1] = [np.where(swap, color1, color0), np.where(swap, color0, color1)]
+    palette = cmpr_palette(color0, color1).astype(np.int32)
+    distances = ((blocks[:, :, None, :3].astype(np.int32) - palette[:, None, :, :3]) ** 2).sum(axis=3)
+    distances[..., 3] = np.where((color0 > color1)[:, None], distances[..., 3], np.iinfo(np.int32).max)
+    indexes = np.where(opaque, distances.argmin(axis=2), 3).astype(np.uint8)
+
+    encoded = np.empty((len(blocks), 8), dtype=np.uint8)
+    encoded[:, 0] = color0 >> 8; encoded[:, 1] = color0 & 0xFF
+    encoded[:, 2] = color1 >> 8; encoded[:, 3] = color1 & 0xFF
+    rows = indexes.reshape(-1, 4, 4)
+    encoded[:, 4:8] = rows[..., 0] << 6 | rows[..., 1] << 4 | rows[..., 2] << 2 | rows[..., 3]
+    return encoded.tobytes()
+#
+
+# Root-mean-square error of CMPR data against the pixels it was encoded from.  The color of pixels that are
+# transparent in both is meaningless, so only their alpha counts.
+def cmpr_error(pixels: np.ndarray, data: bytes) -> float:
+    height, width = pixels.shape[:2]
+    decoded = decode_cmpr(data, width, height).astype(np.int32)
+    difference = decoded - pixels.astype(np.int32)
+    difference[(decoded[..., 3] == 0) & (pixels[..., 3] == 0), :3] = 0
+    return float(np.sqrt(np.mean(difference.astype(np.float64) ** 2)))
+#
+
+# CMPR sub-blocks are BC1 blocks with big-endian endpoints and the 2-bit indexes of each row in the opposite order.
+# Converting between them only byte-swaps, bit-swaps, and moves blocks between the 8x8 tiles and plain row-major order.
+def make_index_reverse_lut() -> np.ndarray:
+    bits = np.arange(256, dtype=np.uint8)
+    return (bits & 3) << 6 | (bits >> 2 & 3) << 4 | (bits >> 4 & 3) << 2 | bits >> 6
+#
+
+index_reverse_lut = make_index_reverse_lut()
+
+def swap_cmpr_bc1_blocks(blocks: np.ndarray) -> np.ndarray:
+    swapped = np.empty_like(blocks)
+    swapped[..., 0] = blocks[..., 1]; swapped[..., 1] = blocks[..., 0]
+    swapped[..., 2] = blocks[..., 3]; swapped[..., 3] = blocks[..., 2]
+    swapped[..., 4:8] = index_reverse_lut[blocks[..., 4:8]]
+    return swapped
+#
+
+def cmpr_to_bc1(data: bytes, width: int, height: int) -> bytes:
+    tiles_wide = align_up(width, 8) // 8; tiles_tall = align_up(height, 8) // 8
+    blocks = np.frombuffer(data, dtype=np.uint8, count=tiles_wide * tiles_tall * 32).reshape(tiles_tall, tiles_wide, 2, 2, 8)
+    blocks = blocks.transpose(0, 2, 1, 3, 4).reshape(tiles_tall * 2, tiles_wide * 2, 8)
+    return swap_cmpr_bc1_blocks(blocks[:align_up(height, 4) // 4, :align_up(width, 4) // 4]).tobytes()
+#
+
+def bc1_to_cmpr(data: bytes, width: int, height: int) -> bytes:
+    blocks_wide = align_up(width, 4) // 4; blocks_tall = align_up(height, 4) // 4
+    blocks = np.frombuffer(data, dtype=np.uint8, count=blocks_wide * blocks_tall * 8).reshape(blocks_tall, blocks_wide, 8)
+    blocks = np.pad(blocks, ((0, blocks_tall % 2), (0, blocks_wide % 2), (0, 0)), mode="edge")
+    tiles_tall = blocks.shape[0] // 2; tiles_wide = blocks.shape[1] // 2
+    return swap_cmpr_bc1_blocks(blocks.reshape(tiles_tall, 2, tiles_wide, 2, 8).transpose(0, 2, 1, 3, 4)).tobytes()
+#
+
+# RGBA32 is 4x4 tiles, where each tile holds the AR pairs of its 16 pixels followed by the GB pairs.
+def decode_rgba32(data: bytes, width: int, height: int) -> np.ndarray:
+    tiles_wide = align_up(width, 4) // 4; tiles_tall = align_up(height, 4) // 4
+    tiles = np.frombuffer(data, dtype=np.uint8, count=tiles_wide * tiles_tall * 64).reshape(tiles_tall, tiles_wide, 2, 4, 4, 2)
+    pixels = tiles.transpose(0, 3, 1, 4, 2, 5).reshape(tiles_tall * 4, tiles_wide * 4, 4)  # ARGB
+    return pixels[:height, :width, [1, 2, 3, 0]]
+#
+
+def encode_rgba32(pixels: np.ndarray) -> bytes:
+    height, width = pixels.shape[:2]
+    pixels = np.pad(pixels, ((0, align_up(height, 4) - height), (0, align_up(width, 4) - width), (0, 0)), mode="edge")
+    tiles_tall = pixels.shape[0] // 4; tiles_wide = pixels.shape[1] // 4
+    tiles = pixels[..., [3, 0, 1, 2]].reshape(tiles_tall, 4, tiles_wide, 4, 2, 2).transpose(0, 2, 4, 1, 3, 5)
+    return tiles.tobytes()
+#
+
 class GCMaterial(object):
     def __init__(self, mode: int, xfad: int, blend: int, pad: int, width: int, height: int, data: bytes):
         # These header field names are guessed from the contents of "/files/models/TEX2TXG_log.txt".
@@ -29,54 +210,177 @@ class GCMaterial(object):
     #
 
     def decode(self) -> Image.Image:
-        return decode_image(BytesIO(self.data), None, ImageFormat.RGBA32 if self.mode else ImageFormat.CMPR, None, None, self.width, self.height)
+        return cached_decode("gcmaterial", self.mode, self.width, self.height, self.data, None, self.decode_uncached)
+    #
+
+    def decode_uncached(self) -> Image.Image:
+        if self.mode:
+            return Image.frombytes("RGBA", (self.width, self.height), decode_rgba32(self.data, self.width, self.height).tobytes())
+        return Image.frombytes("RGBA", (self.width, self.height), decode_cmpr(self.data, self.width, self.height).tobytes())
+    #
+
+    @staticmethod
+    def encode(image: Image.Image, mode: int, quality: str = "quality"):
+        return GCMaterial.encode_rgba(np.asarray(image.convert("RGBA")), mode, quality)
     #
 
     @staticmethod
-    def encode(image: Image.Image, mode: int):
-        width, height = image.size
-        data = read_all_bytes(encode_image(image, ImageFormat.RGBA32 if mode else ImageFormat.CMPR, None, 0)[0])
+    def encode_rgba(pixels: np.ndarray, mode: int, quality: str = "quality"):
+        height, width = pixels.shape[:2]
+        data = encode_rgba32(pixels) if mode else encode_cmpr(pixels, quality)
         return GCMaterial(mode, 0, 0, 0, width, height, data)
     #
+
+    def export_dds(self, io: BinaryIO):
+        if self.mode:
+            raise GCMaterialsError("Only CMPR textures can be exported without decoding.")
+        write_dds_bc1(io, self.width, self.height, cmpr_to_bc1(self.data, self.width, self.height))
+    #
+
+    @staticmethod
+    def import_dds(io: BinaryIO):
+        [width, height, data] = parse_dds_bc1(io)
+        return GCMaterial(0, 0, 0, 0, width, height, bc1_to_cmpr(data, width, height))
+    #
+#
+
+def check_gcmaterial_size(mode: int, width: int, height: int, data: bytes):
+    # (In the MSVC Debug Runtime, uninitialized data contains bytes of 0xCC)
+    # Sometimes, the texture mode was left uninitialized by TEX2TXG.  Thankfully, it is always RGBA32 in
+    # these cases.  If it were not, it is also possible to guess the mode from the bytes-per-pixel ratio.
+    # Still, I cannot place confidence in this code without at least putting in a sanity check, so I've
+    # chosen to write this pedantic code even though Pickles is not nearly as cautious.
+    expected_size = width * height * 4 if mode else width * height // 2  # RGBA32 vs CMPR bpp
+    assert expected_size == len(data)
 #
 
-def parse_gcmaterials(io: BinaryIO) -> list[GCMaterial]:
+# With trusted, texture sizes are not checked against their modes (see validate_gcmaterials).
+def parse_gcmaterials(io: BinaryIO, trusted: bool = False) -> list[GCMaterial]:
     headers = list[list[int, int, int, int, int, int, int]]()
-    while unpack(">i", peek_exact(io, 4))[0] != 0:
-        headers.append(unpack(">IBBBBHH", read_exact(io, 12)))
+    while (offset := unpack(">i", read_exact(io, 4))[0]) != 0:
+        headers.append((offset, *unpack(">BBBBHH", read_exact(io, 8))))
     gcmaterials = list[GCMaterial]()
     for [n, [offset, mode, xfad, blend, pad, width, height]] in enumerate(headers):
         io.seek(offset << 4)
-        # (In the MSVC Debug Runtime, uninitialized data contains bytes of 0xCC)
-        # Sometimes, the texture mode was left uninitialized by TEX2TXG.  Thankfully, it is always RGBA32 in
-        # these cases.  If it were not, it is also possible to guess the mode from the bytes-per-pixel ratio.
-        # Still, I cannot place confidence in this code without at least putting in a sanity check, so I've
-        # chosen to write this pedantic code even though Pickles is not nearly as cautious.
         data = io.read() if n == len(headers) - 1 else read_exact(io, headers[n+1][0] - offset << 4)
-        expected_size = width * height * 4 if mode else width * height // 2  # RGBA32 vs CMPR bpp
-        assert expected_size == len(data)
+        if not trusted:
+            check_gcmaterial_size(mode, width, height, data)
         gcmaterials.append(GCMaterial(mode, xfad, blend, pad, width, height, data))
     if len(gcmaterials) > Maxtextures:
-        print("Warning: Maxtextures reached.  Pickles texturemanager will fail.")
+        trace.warning("maxtextures", "Warning: Maxtextures reached.  Pickles texturemanager will fail.", count=len(gcmaterials))
     return gcmaterials
 #
 
+# Random access to the textures of a GCMaterials file.  Only the header table is parsed up front, and each
+# GCMaterial is made on demand with its data being a memoryview slice of the underlying buffer.
+class GCMaterialsReader(object):
+    def __init__(self, buffer, trusted: bool = False):
+        self.buffer = memoryview(buffer)
+        self.trusted = trusted
+        self.headers = list[tuple[int, int, int, int, int, int, int]]()
+        offset = 0
+        while True:
+            if offset + 4 > len(self.buffer):
+                raise EOFError()
+            if unpack_from(">i", self.buffer, offset)[0] == 0:
+                break
+            if offset + 12 > len(self.buffer):
+                raise EOFError()
+            self.headers.append(unpack_from(">IBBBBHH", self.buffer, offset))
+            offset += 12
+        if len(self.headers) > Maxtextures:
+            trace.warning("maxtextures", "Warning: Maxtextures reached.  Pickles texturemanager will fail.", count=len(self.headers))
+    #
+
+    @staticmethod
+    def open(io: BinaryIO, trusted: bool = False) -> GCMaterialsReader:
+        return GCMaterialsReader(map_file(io), trusted)
+    #
+
+    def __len__(self) -> int:
+        return len(self.headers)
+    #
+
+    def __getitem__(self, n: int) -> GCMaterial:
+        n = range(len(self.headers))[n]  # Negative indexes and bounds checking
+        [offset, mode, xfad, blend, pad, width, height] = self.headers[n]
+        end = len(self.buffer) if n == len(self.headers) - 1 else self.headers[n+1][0] << 4
+        data = self.buffer[offset << 4:end]
+        if not self.trusted:
+            check_gcmaterial_size(mode, width, height, data)
+        return GCMaterial(mode, xfad, blend, pad, width, height, data)
+    #
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield self[n]
+    #
+#
+
+# Reports everything wrong with a GCMaterials file at once, rather than stopping at the first problem like the parsers do.
+def validate_gcmaterials(buffer) -> list[str]:
+    buffer = memoryview(buffer)
+    anomalies = list[str]()
+    headers = list[tuple[int, int, int, int, int, int, int]]()
+    offset = 0
+    while True:
+        if offset + 4 > len(buffer):
+            anomalies.append("Header table is not terminated")
+            break
+        if unpack_from(">i", buffer, offset)[0] == 0:
+            break
+        if offset + 12 > len(buffer):
+            anomalies.append("Header table is truncated")
+            break
+        headers.append(unpack_from(">IBBBBHH", buffer, offset))
+        offset += 12
+    if len(headers) > Maxtextures:
+        anomalies.append("{:d} textures is more than Maxtextures ({:d})".format(len(headers), Maxtextures))
+    if len(headers) == 0:
+        return anomalies
+    table = np.array(headers, dtype=np.int64)
+    begins = table[:, 0] << 4
+    ends = np.append(begins[1:], len(buffer))
+    modes = table[:, 1]; widths = table[:, 5]; heights = table[:, 6]
+    for n in np.flatnonzero(begins < offset + 4):
+        anomalies.append("Texture {:d}: data at {:08x} overlaps the header table".format(n, begins[n]))
+    for n in np.flatnonzero(ends < begins):
+        anomalies.append("Texture {:d}: data at {:08x} is out of order or past the end of the file".format(n, begins[n]))
+    for n in np.flatnonzero(modes > 1):
+        anomalies.append("Texture {:d}: unknown texture mode {:d}".format(n, modes[n]))
+    expected_sizes = np.where(modes != 0, widths * heights * 4, widths * heights // 2)  # RGBA32 vs CMPR bpp, as in check_gcmaterial_size
+    for n in np.flatnonzero(expected_sizes != ends - begins):
+        anomalies.append("Texture {:d}: {:d} bytes of data, but {:d}x{:d} {:s} takes {:d}".format(n, ends[n] - begins[n], widths[n], heights[n], "RGBA32" if modes[n] else "CMPR", expected_sizes[n]))
+    return anomalies
+#
+
 def decode_gcmaterials(gcmaterials: list[GCMaterial]) -> list[Image.Image]:
     images = list[Image.Image]()
     for gcmaterial in gcmaterials:
         images.append(gcmaterial.decode())
     return images 
 
-def write_gcmaterials(io: BinaryIO, gcmaterials: list[GCMaterial]):
-    io.seek(align_up(len(gcmaterials) * 12 + 4, 32))
-    offsets = list[int]()
+# gcmaterials can be any iterable (e.g. a generator of textures still being encoded) as long as count is given.
+# Only the header fields are kept after each texture is written, so its data can be freed right away.
+def write_gcmaterials(io: BinaryIO, gcmaterials: Iterable[GCMaterial], count: int | None = None):
+    if count is None:
+        count = len(gcmaterials)
+    elif hasattr(gcmaterials, "__len__") and len(gcmaterials) != count:
+        raise GCMaterialsError("Expected {:d} textures, but got {:d}.".format(count, len(gcmaterials)))
+    io.seek(align_up(count * 12 + 4, 32))
+    headers = list[tuple[int, int, int, int, int, int, int]]()
     for gcmaterial in gcmaterials:
-        offsets.append(io.tell() >> 4)
+        # The header table was sized for count textures, so any more are refused before their data is written.
+        if len(headers) == count:
+            raise GCMaterialsError("Expected {:d} textures, but got more.".format(count))
+        headers.append((io.tell() >> 4, gcmaterial.mode, gcmaterial.xfad, gcmaterial.blend, gcmaterial.pad, gcmaterial.width, gcmaterial.height))
         io.write(gcmaterial.data)
+    if len(headers) != count:
+        raise GCMaterialsError("Expected {:d} textures, but got {:d}.".format(count, len(headers)))
     io.seek(0)
-    for [offset, gcmaterial] in zip(offsets, gcmaterials):
-        io.write(pack(">IBBBBHH", offset, gcmaterial.mode, gcmaterial.xfad, gcmaterial.blend, gcmaterial.pad, gcmaterial.width, gcmaterial.height))
+    for header in headers:
+        io.write(pack(">IBBBBHH", *header))
     io.write(pack(">I", 0))
-    if len(gcmaterials) > Maxtextures:
-        print("Warning: Maxtextures reached.  Pickles texturemanager will fail.")
+    if len(headers) > Maxtextures:
+        trace.warning("maxtextures", "Warning: Maxtextures reached.  Pickles texturemanager will fail.", count=len(headers))
 #
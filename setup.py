@@ -5,10 +5,12 @@ def main():
     import scg_tools as app
 
     setup(
-        name         = app.__project__,
-        version      = app.__version__,
-        entry_points = app.__entry_points__,
-        packages     = ["scg_tools"]
+        name             = app.__project__,
+        version          = app.__version__,
+        entry_points     = app.__entry_points__,
+        packages         = ["scg_tools"],
+        # Distribution names of the modules in app.__requires__
+        install_requires = ["Pillow", "more-itertools", "numpy"]
     )
 #
 
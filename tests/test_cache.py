@@ -0,0 +1,89 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+
+import numpy as np
+from PIL import Image
+from scg_tools.cache import DecodeCache
+import scg_tools.cache
+
+def make_image(mode: str, value: int) -> Image.Image:
+    image = Image.new(mode, (4, 2), value)
+    if mode == "P":
+        image.putpalette(bytes(range(48)), "RGB")
+    return image
+#
+
+def assert_same_image(a: Image.Image, b: Image.Image):
+    assert (a.mode, a.size, a.tobytes()) == (b.mode, b.size, b.tobytes())
+    if a.mode == "P":
+        assert a.getpalette("RGB") == b.getpalette("RGB")
+#
+
+def test_key_covers_every_input():
+    key = DecodeCache.make_key("psxtexfile", 1, 4, 2, b'data', b'palette')
+    assert key == DecodeCache.make_key("psxtexfile", 1, 4, 2, b'data', b'palette')
+    assert key != DecodeCache.make_key("psxtexfile-p", 1, 4, 2, b'data', b'palette')
+    assert key != DecodeCache.make_key("psxtexfile", 0, 4, 2, b'data', b'palette')
+    assert key != DecodeCache.make_key("psxtexfile", 1, 2, 4, b'data', b'palette')
+    assert key != DecodeCache.make_key("psxtexfile", 1, 4, 2, b'atad', b'palette')
+    assert key != DecodeCache.make_key("psxtexfile", 1, 4, 2, b'data', b'etteclap')
+    assert key != DecodeCache.make_key("psxtexfile", 1, 4, 2, b'data', None)
+#
+
+def test_memory_round_trip():
+    cache = DecodeCache()
+    for mode in ("RGB", "RGBA", "P"):
+        key = mode.encode()
+        assert cache.get(key) is None
+        image = make_image(mode, 7)
+        cache.put(key, image)
+        assert_same_image(cache.get(key), image)
+#
+
+def test_least_recently_used_is_evicted():
+    # Each 4x2 RGB image takes 24 bytes, so three of them fit.
+    cache = DecodeCache(memory_budget = 72)
+    for key in (b'a', b'b', b'c'):
+        cache.put(key, make_image("RGB", 1))
+    cache.get(b'a')
+    cache.put(b'd', make_image("RGB", 1))
+    assert list(cache.entries) == [b'c', b'a', b'd']
+    assert cache.memory_used == 72
+    cache.put(b'big', Image.new("RGB", (16, 16)))  # Larger than the whole budget, so it is never kept
+    assert b'big' not in cache.entries
+#
+
+def test_directory_is_shared(tmp_path):
+    image = make_image("P", 3)
+    DecodeCache(directory = str(tmp_path)).put(b'key', image)
+    assert [path.name for path in tmp_path.iterdir()] == [b'key'.hex()]
+    # A fresh cache, e.g. in another process or a later run, finds it on disk.
+    cache = DecodeCache(directory = str(tmp_path))
+    assert_same_image(cache.get(b'key'), image)
+    assert b'key' in cache.entries
+    assert DecodeCache(directory = str(tmp_path)).get(b'other') is None
+#
+
+def test_cached_decode_decodes_once(monkeypatch):
+    monkeypatch.setattr(scg_tools.cache, "decode_cache", DecodeCache())
+    calls = list[int]()
+    def decode() -> Image.Image:
+        calls.append(1)
+        return Image.fromarray(np.zeros((2, 4, 3), dtype=np.uint8), "RGB")
+    first = scg_tools.cache.cached_decode("gcmaterial", 0, 4, 2, b'data', None, decode)
+    second = scg_tools.cache.cached_decode("gcmaterial", 0, 4, 2, b'data', None, decode)
+    assert len(calls) == 1
+    assert_same_image(first, second)
+#
+
+def test_corrupt_entries_are_dropped(tmp_path):
+    DecodeCache(directory = str(tmp_path)).put(b'key', make_image("P", 3))
+    path = tmp_path / b'key'.hex()
+    raw = path.read_bytes()
+    for corrupt in (raw[:10], raw[:-1], raw + b'\0', raw[:16], b'XYZ\0' + raw[4:]):
+        path.write_bytes(corrupt)
+        assert DecodeCache(directory = str(tmp_path)).get(b'key') is None
+        assert not path.exists()
+#
@@ -0,0 +1,414 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from io import BytesIO, RawIOBase
+from mmap import mmap
+from multiprocessing import get_context
+from pathlib import Path
+from struct import pack
+import json
+import random
+
+import numpy as np
+from PIL import Image
+import pytest
+from scg_tools.ma4 import CHKFMAP, CHKFMAPError, FormatContext, Header, Packet, PacketList, Prop, PropList, diff_ranges, prop_list_anomalies, \
+                          GRUV, MAP_, CELS, HEAD, DATA, NAME, PATH, VARS, ACTI, GEOM, GLGM, GCGM, CTEX, CATR, CANM
+from scg_tools.tex import encode_psxtexfile
+import scg_tools.ma4
+from scg_tools import trace
+
+@pytest.fixture(autouse=True)
+def quiet():
+    trace.configure(True)
+    yield
+    trace.configure()
+#
+
+def make_props(rng: random.Random, count: int) -> PropList:
+    props = PropList(); props.unkflt = 1.5
+    for n in range(count):
+        vertexes = [tuple(rng.randrange(-30000, 30000) for _ in range(8)) + tuple(rng.randrange(256) for _ in range(4)) for _ in range(12)]
+        meshes = [Prop.Mesh(rng.randrange(20), [tuple(rng.randrange(12) for _ in range(rng.randrange(3, 10))) for _ in range(rng.randrange(1, 4))]) for _ in range(rng.randrange(1, 3))]
+        props.append(Prop(vertexes, meshes, b"prop_%d" % n))
+    return props
+#
+
+def make_packet_list(rng: random.Random, name: bytes) -> PacketList:
+    packet_list = PacketList([Packet(1, 0, name + bytes(4 - len(name) % 4), False)])
+    for _ in range(rng.randrange(1, 4)):
+        packet_list.append(Packet(3, 0, pack("<I", rng.randrange(100)), False))
+    return packet_list
+#
+
+def make_actor(rng: random.Random, id: int) -> PacketList:
+    return PacketList([Packet(0, 0, pack("<i", rng.randrange(5)), False), Packet(2, 0, pack("<iii", 1, 2, 3), True),
+                       Packet(3, 0, b"msg\0", False), Packet(4, 0, pack("<i", id), False)])
+#
+
+# Builds every kind of chunk from scratch and writes the map out, as an original file to parse in the tests below.
+def make_chkfmap(path: Path, seed: int, old_format: bool = False) -> bytes:
+    rng = random.Random(seed)
+    chkfmap = CHKFMAP()
+    def add(header: Header, tid: bytes, chunk):
+        subheader = Header.SubHeader(tid, b'CID0', b'VER1', 0, 0); subheader.chunk = chunk
+        header.subheaders.append(subheader)
+    gruv = GRUV(chkfmap); gruv.data_count = 4 * 4 * 2
+    map_ = MAP_(chkfmap); cels = CELS(chkfmap)
+    for [tid, chunk] in ((b'GRUV', gruv), (b'MAP_', map_), (b'CELS', cels)):
+        add(chkfmap, tid, chunk)
+    head = HEAD(chkfmap); head.x, head.y, head.z = 4, 4, 2
+    data = DATA(chkfmap); data.data = tuple(rng.randrange(2000) for _ in range(32))
+    name = NAME(chkfmap); name.names = [b"name%d" % n for n in range(4)]
+    path_ = PATH(chkfmap); path_.packet_lists = [make_packet_list(rng, b"path%d" % n) for n in range(3)]
+    vars_ = VARS(chkfmap); vars_.packet_list = PacketList([Packet(7, 0, b"\1\2\3\4", False)])
+    acti = ACTI(chkfmap); acti.actors = [make_actor(rng, rng.choice([1, 7, 4100, 8200, 0xF000])) for _ in range(10)]
+    for [tid, chunk] in ((b'HEAD', head), (b'DATA', data), (b'NAME', name), (b'PATH', path_), (b'VARS', vars_), (b'ACTI', acti)):
+        add(map_, tid, chunk)
+    geom = GEOM(chkfmap); geom.unkflt = 2.0
+    geom.props_0 = make_props(rng, 3); geom.props_1 = make_props(rng, 2); geom.props_2_raw = bytes(rng.randrange(256) for _ in range(64)); geom.props_3 = make_props(rng, 2)
+    glgm = GLGM(chkfmap); glgm.props = make_props(rng, 3)
+    gcgm = GCGM(chkfmap); gcgm.props = make_props(rng, 3)
+    ctex = CTEX(chkfmap); ctex.textures = encode_psxtexfile([Image.new("RGB", (8, 8), (seed, 2, 3))], 1)
+    catr = CATR(chkfmap); catr.packet_lists = [make_packet_list(rng, b"catr") for _ in range(2)]
+    canm = CANM(chkfmap); canm.packet_lists = [make_packet_list(rng, b"anim%d" % n) for n in range(3)]
+    for [tid, chunk] in ((b'GEOM', geom), (b'GLGM', glgm), (b'GCGM', gcgm), (b'CTEX', ctex), (b'CATR', catr), (b'CANM', canm)):
+        add(cels, tid, chunk)
+    with open(path, "wb") as f:
+        chkfmap.write(f, FormatContext(False, old_format))
+    return path.read_bytes()
+#
+
+@pytest.fixture
+def new_map(tmp_path: Path) -> tuple[Path, bytes]:
+    path = tmp_path / "new.ma4"
+    return (path, make_chkfmap(path, 1))
+#
+
+@pytest.fixture
+def old_map(tmp_path: Path) -> tuple[Path, bytes]:
+    path = tmp_path / "old.ma4"
+    return (path, make_chkfmap(path, 2, True))
+#
+
+leaf_tids = ((b'MAP_', (b'HEAD', b'DATA', b'NAME', b'PATH', b'VARS', b'ACTI')), (b'CELS', (b'GEOM', b'GLGM', b'GCGM', b'CTEX', b'CATR', b'CANM')))
+
+def write(chkfmap: CHKFMAP, context: FormatContext | None = None) -> bytes:
+    io = BytesIO(); chkfmap.write(io, context)
+    return io.getvalue()
+#
+
+def parse(original: bytes, context: FormatContext | None = None) -> CHKFMAP:
+    chkfmap = CHKFMAP(); chkfmap.parse(BytesIO(original), context)
+    return chkfmap
+#
+
+@pytest.mark.parametrize("map_name, old_format", [("new_map", False), ("old_map", True), ("old_map", None)])
+def test_write_is_byte_identical(map_name: str, old_format: bool | None, request):
+    [path, original] = request.getfixturevalue(map_name)
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path, FormatContext(old_format, old_format))
+        assert write(chkfmap) == original  # Every chunk copied verbatim
+        # Re-encoding every chunk has to reproduce the original bytes too.
+        for [tid1, tid2s] in leaf_tids:
+            for tid2 in tid2s:
+                assert chkfmap.at(tid1).at(tid2, True).dirty
+        assert write(chkfmap) == original
+#
+
+def test_chunks_are_parsed_on_first_access(new_map: tuple[Path, bytes]):
+    chkfmap = parse(new_map[1])
+    map_ = chkfmap.at(b'MAP_')
+    assert all(subheader.chunk is None for subheader in map_.subheaders)
+    acti = map_.at(b'ACTI')
+    assert [subheader.tid for subheader in map_.subheaders if subheader.chunk is not None] == [b'ACTI']
+    assert map_.at(b'ACTI') is acti
+    assert len(acti.actors) == 10
+    # DATA looks up GRUV for its size, which parses GRUV too.
+    assert len(map_.at(b'DATA').data) == 32
+    assert chkfmap.subheaders[0].chunk is not None
+#
+
+def test_parse_sources(new_map: tuple[Path, bytes]):
+    [path, original] = new_map
+    for source in (path, str(path), original, BytesIO(original)):
+        with CHKFMAP() as chkfmap:
+            chkfmap.parse(source)
+            assert write(chkfmap) == original
+    # Files are mapped, and chunks are views into the mapping rather than copies.
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path)
+        assert isinstance(chkfmap.mapping, mmap)
+        assert chkfmap.at(b'MAP_').subheaders[0].raw.obj is chkfmap.mapping
+#
+
+def test_parse_embedded_map(new_map: tuple[Path, bytes], tmp_path: Path):
+    original = new_map[1]
+    path = tmp_path / "embedded.bin"
+    path.write_bytes(b'prefix' * 5 + original + b'suffix')
+    with open(path, "rb") as f:
+        f.seek(30)
+        with CHKFMAP() as chkfmap:
+            chkfmap.parse(f)
+            assert write(chkfmap) == original
+            chkfmap.parse_all(2)
+            assert write(chkfmap) == original
+    stream = BytesIO(b'prefix' * 5 + original); stream.seek(30)
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(stream)
+        assert write(chkfmap) == original
+#
+
+def test_close_releases_the_file(new_map: tuple[Path, bytes]):
+    chkfmap = CHKFMAP(); chkfmap.parse(new_map[0])
+    source = chkfmap.source; mapping = chkfmap.mapping
+    chkfmap.close()
+    assert source.closed and mapping.closed
+    assert chkfmap.subheaders == []
+    # A stream handed in by the caller stays open.
+    with open(new_map[0], "rb") as f:
+        with CHKFMAP() as chkfmap:
+            chkfmap.parse(f)
+        assert not f.closed
+#
+
+def test_format_detection(old_map: tuple[Path, bytes], new_map: tuple[Path, bytes]):
+    for [[path, original], old_format] in ((old_map, True), (new_map, False)):
+        with CHKFMAP() as chkfmap:
+            chkfmap.parse(path, FormatContext(None, None))
+            chkfmap.parse_all(1)
+            # The props are views into the mapping, so they are not kept past the end of the with block.
+            assert all(prop.old_format == old_format for prop in chkfmap.at(b'CELS').at(b'GLGM').props)
+            assert chkfmap.at(b'CELS').at(b'GCGM').props[0].vertexes.dtype["x"] == (np.dtype(">f4") if old_format else np.dtype(">i2"))
+            assert write(chkfmap) == original
+#
+
+def test_format_detection_tolerates_empty_and_padded_props():
+    assert Prop.detect_old_format(0, 40, 40) is None
+    assert Prop.detect_old_format(12, 40, 40 + 12 * 20 + 8) is False  # Padded up to an alignment
+    assert Prop.detect_old_format(12, 40, 40 + 12 * 36 + 4) is True
+    with pytest.raises(CHKFMAPError):
+        Prop.detect_old_format(12, 40, 40 + 12 * 28)
+    # A prop without vertexes takes the format of the others in its list.
+    props = make_props(random.Random(3), 3)
+    props.insert(1, Prop([], [], b"empty"))
+    io = BytesIO(); props.write(">", io, FormatContext(False, True))
+    assert prop_list_anomalies(">", io.getbuffer(), FormatContext(None, None), "GLGM") == []
+    io.seek(0)
+    parsed = PropList.parse(">", io, FormatContext(None, None))
+    assert [prop.old_format for prop in parsed] == [True] * 4
+    assert len(parsed[1].vertexes) == 0
+    again = BytesIO(); parsed.write(">", again, FormatContext(None, None))
+    assert again.getvalue() == io.getvalue()
+#
+
+def test_validate_reports_wrong_format(old_map: tuple[Path, bytes]):
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(old_map[0], FormatContext(False, False))
+        assert any("expected vertex attribute format" in anomaly for anomaly in chkfmap.validate())
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(old_map[0], FormatContext(True, True))
+        assert chkfmap.validate() == []
+#
+
+def test_format_conversion_round_trip(new_map: tuple[Path, bytes], tmp_path: Path):
+    [path, original] = new_map
+    converted_path = tmp_path / "converted.ma4"
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path, FormatContext(False, True))
+        converted_path.write_bytes(write(chkfmap))
+    converted = converted_path.read_bytes()
+    assert converted != original
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(converted_path, FormatContext(None, False))
+        assert write(chkfmap) == original
+    # The context a map was parsed with is also what it is written with.
+    assert write(parse(converted, FormatContext(True, True))) == converted
+#
+
+def test_prop_vertexes_are_structured():
+    vertexes = [tuple(range(12)), tuple(range(12, 24))]
+    prop = Prop(vertexes, [], b'a')
+    assert prop.vertexes.dtype.names[:3] == ("u", "v", "x")
+    assert prop.vertexes["x"].tolist() == [2, 14]
+    assert prop.vertexes.tolist() == vertexes
+    assert Prop(vertexes, [], b'a') == prop
+#
+
+def test_prop_vertexes_are_copied_for_editing(new_map: tuple[Path, bytes], tmp_path: Path):
+    chkfmap = CHKFMAP(); chkfmap.parse(new_map[0])
+    assert not chkfmap.at(b'CELS').at(b'GLGM').props[0].vertexes.flags.writeable  # Still a view of the file
+    glgm = chkfmap.at(b'CELS').at(b'GLGM', True)
+    gcgm = chkfmap.at(b'CELS').at(b'GCGM', True)
+    geom = chkfmap.at(b'CELS').at(b'GEOM', True)
+    glgm.props[0].vertexes["x"][0] = 1234
+    gcgm.props[0].vertexes["x"][0] = 1234
+    geom.props_3[0].vertexes["x"][0] = 1234
+    path = tmp_path / "edited.ma4"
+    path.write_bytes(write(chkfmap))
+    chkfmap.close()  # The edited chunks hold copies, so nothing keeps the mapping alive
+    assert glgm.props[0].vertexes["x"][0] == 1234
+    with CHKFMAP() as edited:
+        edited.parse(path)
+        assert edited.at(b'CELS').at(b'GLGM').props[0].vertexes["x"][0] == 1234
+        assert edited.at(b'CELS').at(b'GCGM').props[0].vertexes["x"][0] == 1234
+        assert edited.at(b'CELS').at(b'GEOM').props_3[0].vertexes["x"][0] == 1234
+#
+
+def test_prop_equality_compares_format():
+    vertexes = [tuple(range(12))]
+    assert Prop(vertexes, [], b'a') == Prop(vertexes, [], b'a')
+    assert Prop(vertexes, [], b'a') != Prop(vertexes, [], b'a', True)
+#
+
+def test_in_place_edit_is_written(new_map: tuple[Path, bytes], tmp_path: Path):
+    [path, original] = new_map
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path)
+        assert not chkfmap.at(b'MAP_').at(b'HEAD').dirty
+        chkfmap.at(b'MAP_').at(b'HEAD', True).z = 3
+        chkfmap.at(b'MAP_').at(b'ACTI', True).actors[0][0].data = pack("<i", 99)  # An edit made in place
+        assert [tid for tid in leaf_tids[0][1] if chkfmap.at(b'MAP_').at(tid, False).dirty] == [b'HEAD', b'ACTI']
+        # Clean chunks are copied from file to file.
+        with open(tmp_path / "edited.ma4", "wb") as f:
+            chkfmap.write(f)
+        edited = (tmp_path / "edited.ma4").read_bytes()
+        assert edited == write(chkfmap)
+    assert len(edited) == len(original) and edited != original
+    chkfmap = parse(edited)
+    assert chkfmap.at(b'MAP_').at(b'HEAD').z == 3
+    assert chkfmap.at(b'MAP_').at(b'ACTI').actors[0][0].data == pack("<i", 99)
+#
+
+@pytest.mark.parametrize("tid1, tid2", [(b'MAP_', b'PATH'), (b'MAP_', b'VARS'), (b'MAP_', b'ACTI'), (b'CELS', b'CATR'), (b'CELS', b'CANM')])
+def test_json_round_trip(new_map: tuple[Path, bytes], tid1: bytes, tid2: bytes):
+    [path, original] = new_map
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path)
+        chunk = chkfmap.at(tid1).at(tid2, True)
+        chunk.json_load(json.loads(json.dumps(chunk.json_dump())))
+        assert chunk == parse(original).at(tid1).at(tid2)
+        assert write(chkfmap) == original
+#
+
+def test_read_only_lookups_stay_clean(new_map: tuple[Path, bytes]):
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(new_map[0])
+        assert not chkfmap.at(b'MAP_').at(b'ACTI').dirty
+        assert not chkfmap.at(b'MAP_').at(b'DATA').dirty  # Looks up GRUV for its size
+        assert not chkfmap.at(b'GRUV').dirty
+        assert chkfmap.patches() == []
+#
+
+def test_diff_ranges():
+    old = bytes(200)
+    assert diff_ranges(old, old) == []
+    new = bytearray(old); new[10] = 1; new[12] = 1; new[150] = 1
+    assert diff_ranges(old, new) == [(10, 13), (150, 151)]
+    assert diff_ranges(old, new, 200) == [(10, 151)]
+    assert diff_ranges(old, new, 1) == [(10, 11), (12, 13), (150, 151)]
+#
+
+def test_patch_writes_only_changes(new_map: tuple[Path, bytes]):
+    [path, original] = new_map
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path)
+        chkfmap.at(b'MAP_').at(b'HEAD', True).z = 3
+        expected = write(chkfmap)
+        assert chkfmap.patch() == 1
+        assert not chkfmap.at(b'MAP_').at(b'HEAD').dirty
+    assert path.read_bytes() == expected != original
+#
+
+def test_patch_refuses_size_changes(new_map: tuple[Path, bytes]):
+    [path, original] = new_map
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path)
+        chkfmap.at(b'MAP_').at(b'ACTI', True).actors.pop()
+        assert chkfmap.patch() is None
+    assert path.read_bytes() == original
+#
+
+class Pipe(RawIOBase):
+    def __init__(self):
+        self.buffer = bytearray()
+    #
+
+    def writable(self) -> bool:
+        return True
+    #
+
+    def write(self, data) -> int:
+        self.buffer += data
+        return len(data)
+    #
+#
+
+def test_write_streams_without_seeking(new_map: tuple[Path, bytes], tmp_path: Path):
+    [path, original] = new_map
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path)
+        pipe = Pipe(); chkfmap.write(pipe)
+        assert bytes(pipe.buffer) == original
+        chkfmap.at(b'MAP_').at(b'ACTI', True).actors.pop()
+        pipe = Pipe(); chkfmap.write(pipe)
+        with open(tmp_path / "out.ma4", "wb") as f:
+            chkfmap.write(f)  # Clean chunks are copied from file to file here
+    assert bytes(pipe.buffer) == (tmp_path / "out.ma4").read_bytes()
+    assert len(pipe.buffer) < len(original)
+#
+
+@pytest.mark.parametrize("map_name, old_format, jobs", [("new_map", False, 1), ("new_map", False, 2), ("old_map", True, 2)])
+def test_parse_all(map_name: str, old_format: bool, jobs: int, request):
+    [path, original] = request.getfixturevalue(map_name)
+    context = FormatContext(old_format, old_format)
+    reference = parse(original, context)
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(path, context)
+        chkfmap.parse_all(jobs)
+        assert list(chkfmap.unparsed()) == []
+        for [tid1, tid2s] in leaf_tids:
+            for tid2 in tid2s:
+                assert not chkfmap.at(tid1).at(tid2).dirty
+                assert chkfmap.at(tid1).at(tid2) == reference.at(tid1).at(tid2)
+        assert write(chkfmap) == original
+#
+
+@pytest.mark.parametrize("start_method", ["fork", "spawn"])
+def test_parse_all_workers_trace(new_map: tuple[Path, bytes], tmp_path: Path, start_method: str, monkeypatch):
+    monkeypatch.setattr(scg_tools.ma4, "ProcessPoolExecutor", partial(ProcessPoolExecutor, mp_context = get_context(start_method)))
+    trace_path = tmp_path / "trace.jsonl"
+    trace.configure(True, str(trace_path))
+    with CHKFMAP() as chkfmap:
+        chkfmap.parse(new_map[0])
+        chkfmap.parse_all(2)
+    trace.configure(True)
+    events = [json.loads(line)["event"] for line in trace_path.read_text().splitlines()]
+    # GEOM has three prop lists, GLGM and GCGM one each, all of them parsed by the workers.
+    assert events.count("prop_list") == 5
+    assert events.count("chunk_parsed") == 13  # GRUV and the twelve chunks under MAP_ and CELS
+#
+
+def test_validate(new_map: tuple[Path, bytes], tmp_path: Path):
+    [path, original] = new_map
+    with CHKFMAP() as chkfmap:
+        anomalies = list[str]()
+        chkfmap.parse(path, None, anomalies)
+        assert anomalies + chkfmap.validate() == []
+    # With a list to report to, structure errors are collected instead of raised.
+    truncated = tmp_path / "truncated.ma4"
+    truncated.write_bytes(original[:len(original) - 200])
+    with CHKFMAP() as chkfmap:
+        anomalies = list[str]()
+        chkfmap.parse(truncated, None, anomalies)
+        assert any("runs past the end of the file" in anomaly for anomaly in anomalies)
+        chkfmap.validate()
+    anomalies = list[str]()
+    CHKFMAP().parse(b'CHKFMAQ_' + original[8:], None, anomalies)
+    assert anomalies[0] == "CHKFMAP: file magic is b'CHKFMAQ_' rather than b'CHKFMAP_'"
+    with pytest.raises(EOFError):
+        CHKFMAP().parse(original[:len(original) - 200])
+#
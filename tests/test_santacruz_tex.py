@@ -0,0 +1,31 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from pathlib import Path
+
+from PIL import Image
+from scg_tools.santacruz_tex import extract_batch
+from scg_tools.tex import encode_psxtexfile, write_psxtexfile
+
+def write_tex(path: Path, count: int):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        write_psxtexfile(f, encode_psxtexfile([Image.new("RGB", (8, 8), (n, 0, 0)) for n in range(count)], 2))
+#
+
+def test_batch_extraction(tmp_path: Path, capsys):
+    write_tex(tmp_path / "a.tex", 20)
+    assert extract_batch([(tmp_path / "a.tex", Path("a.tex")), (tmp_path / "a.tex", Path("a.tex"))], str(tmp_path / "out"), False, 1) == 0
+    assert sorted(path.name for path in (tmp_path / "out").iterdir()) == sorted("a.tex{:d}.png".format(n) for n in range(20))
+    assert capsys.readouterr().out.splitlines()[-1].startswith("20 textures from 1 files")
+#
+
+def test_batch_refuses_colliding_outputs(tmp_path: Path, capsys):
+    write_tex(tmp_path / "x" / "a.tex", 1)
+    write_tex(tmp_path / "y" / "a.tex", 1)
+    inputs = [(tmp_path / "x" / "a.tex", Path("a.tex")), (tmp_path / "y" / "a.tex", Path("a.tex"))]
+    assert extract_batch(inputs, str(tmp_path / "out"), False, 1) == 1
+    assert "would both be extracted to a.tex" in capsys.readouterr().out
+    assert not (tmp_path / "out").exists()
+#
@@ -0,0 +1,152 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from io import BytesIO
+from pathlib import Path
+from struct import unpack_from
+
+import numpy as np
+from PIL import Image
+import pytest
+from scg_tools.tex import PSXTexFileReader, bgr555_lut, bgr555_le_decode, bgr555_le_encode, decode_psxtexfile_rgba, \
+                          decode_psxtexfile_uncached, encode_psxtexfile, median_cut, parse_psxtexfile, quantize_bgr555, validate_psxtexfile, \
+                          write_psxtexfile
+
+def random_image(rng: np.random.Generator, width: int, height: int, colors: int) -> Image.Image:
+    # Colors that survive a trip through BGR555, so encoding them is lossless.
+    palette = bgr555_lut[rng.integers(0, 0x8000, colors)]
+    return Image.fromarray(palette[rng.integers(0, colors, (height, width))], "RGB")
+#
+
+# Plain per-pixel decoder, written the way the original one was, for checking the vectorized one against.
+def reference_decode(mode: int, data: bytes, palette: bytes, width: int, height: int) -> Image.Image:
+    def rgb(bits: int) -> tuple[int, int, int]:
+        return ((bits & 31) * 255 // 31, (bits >> 5 & 31) * 255 // 31, (bits >> 10 & 31) * 255 // 31)
+    clut = [rgb(unpack_from("<H", palette, 2 * n)[0]) for n in range(256)]
+    match mode:
+        case 0:
+            pixels = [clut[byte >> shift & 15] for byte in data for shift in (0, 4)]
+        case 1:
+            pixels = [clut[byte] for byte in data]
+        case 2:
+            pixels = [rgb(unpack_from("<H", data, 2 * n)[0]) for n in range(len(data) // 2)]
+        case 3:
+            return Image.frombytes("RGBA", (width, height), data)
+    return Image.frombytes("RGB", (width, height), bytes(channel for pixel in pixels for channel in pixel))
+#
+
+def test_bgr555_lut_matches_per_pixel_math():
+    for bits in range(0x8000):
+        r, g, b = bits & 31, bits >> 5 & 31, bits >> 10 & 31
+        assert tuple(bgr555_lut[bits]) == (r * 255 // 31, g * 255 // 31, b * 255 // 31)
+#
+
+def test_bgr555_decode():
+    data = np.array([0x001F, 0x03E0, 0x7C00, 0x7FFF, 0x0000], dtype="<u2").tobytes()
+    assert bgr555_le_decode(data).tolist() == [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 255], [0, 0, 0]]
+    with pytest.raises(AssertionError):
+        bgr555_le_decode(np.array([0x8000], dtype="<u2").tobytes())
+#
+
+@pytest.mark.parametrize("mode, bits_per_pixel", [(0, 4), (1, 8), (2, 16), (3, 32)])
+def test_decode_matches_reference(mode: int, bits_per_pixel: int):
+    rng = np.random.default_rng(mode)
+    palette = rng.integers(0, 0x8000, 256, dtype="<u2").tobytes()
+    if mode == 2:
+        data = rng.integers(0, 0x8000, 16 * 8, dtype="<u2").tobytes()
+    else:
+        data = rng.integers(0, 256, 16 * 8 * bits_per_pixel // 8, dtype=np.uint8).tobytes()
+    decoded = decode_psxtexfile_uncached(mode, data, palette, 16, 8)
+    expected = reference_decode(mode, data, palette, 16, 8)
+    assert (decoded.mode, decoded.size, decoded.tobytes()) == (expected.mode, expected.size, expected.tobytes())
+#
+
+def test_bgr555_encode_inverts_decode():
+    assert np.array_equal(bgr555_le_encode(bgr555_lut), np.arange(0x8000))
+#
+
+def test_median_cut():
+    rng = np.random.default_rng(0)
+    colors = np.unique(rng.integers(0, 32, (500, 3)), axis=0)
+    counts = rng.integers(1, 100, len(colors))
+    palette = median_cut(colors, counts, 16)
+    assert palette.shape == (16, 3)
+    assert (palette <= 31).all()
+    assert np.array_equal(palette, median_cut(colors, counts, 16))
+    # Fewer distinct colors than palette entries stops splitting early.
+    assert len(median_cut(np.array([[1, 2, 3], [1, 2, 3]]), np.array([1, 1]), 16)) == 1
+#
+
+def test_quantize_keeps_colors_that_fit():
+    image = random_image(np.random.default_rng(1), 8, 8, 12)
+    [indexes, clut] = quantize_bgr555(image, 16)
+    assert len(clut) <= 16
+    assert np.array_equal(bgr555_lut[clut[indexes]].reshape(8, 8, 3), np.asarray(image))
+#
+
+def test_quantize_reduces_colors():
+    image = random_image(np.random.default_rng(2), 32, 32, 200)
+    [indexes, clut] = quantize_bgr555(image, 16)
+    assert len(clut) <= 16
+    assert indexes.max() < len(clut)
+#
+
+@pytest.mark.parametrize("mode, colors", [(0, 16), (1, 256), (2, 1000), (3, 1000)])
+def test_encode_decode_round_trip(mode: int, colors: int):
+    image = random_image(np.random.default_rng(mode), 16, 8, colors)
+    [texture] = encode_psxtexfile([image], mode)
+    [mode, unk1, unk2, width, height, data, palette] = texture
+    decoded = decode_psxtexfile_uncached(mode, data, palette, width, height)
+    assert np.array_equal(np.asarray(decoded.convert("RGB")), np.asarray(image))
+    assert encode_psxtexfile([decoded], mode)[0] == texture
+#
+
+@pytest.mark.parametrize("mode", [0, 1])
+def test_paletted_decode(mode: int):
+    [texture] = encode_psxtexfile([random_image(np.random.default_rng(4), 8, 8, 16)], mode)
+    [mode, unk1, unk2, width, height, data, palette] = texture
+    paletted = decode_psxtexfile_uncached(mode, data, palette, width, height, True)
+    assert paletted.mode == "P"
+    assert np.array_equal(np.asarray(paletted.convert("RGB")), np.asarray(decode_psxtexfile_uncached(mode, data, palette, width, height)))
+#
+
+@pytest.mark.parametrize("mode", [0, 1, 2, 3])
+def test_rgba_decode_matches_color_keyed_image(mode: int):
+    image = random_image(np.random.default_rng(5), 16, 8, 16)
+    image.putpixel((3, 2), (0, 0, 255))
+    [[mode, unk1, unk2, width, height, data, palette]] = encode_psxtexfile([image], mode)
+    # What TEX2TXG used to do per pixel: decode to an image, then make pure blue transparent.
+    expected = np.asarray(decode_psxtexfile_uncached(mode, data, palette, width, height).convert("RGBA")).copy()
+    if mode != 3:
+        expected[(expected == (0, 0, 255, 255)).all(axis=2), 3] = 0
+    assert np.array_equal(decode_psxtexfile_rgba(mode, data, palette, width, height, color_key = True), expected)
+    assert expected[2, 3, 3] == (255 if mode == 3 else 0)
+#
+
+def make_psxtexfile() -> bytes:
+    rng = np.random.default_rng(3)
+    # Encoded rather than random, so that every texture is also valid.
+    textures = [encode_psxtexfile([random_image(rng, 8, 4, 16)], mode)[0] for mode in range(4)]
+    io = BytesIO(); write_psxtexfile(io, textures)
+    return io.getvalue()
+#
+
+def test_reader_matches_parser():
+    buffer = make_psxtexfile()
+    reader = PSXTexFileReader(buffer)
+    textures = parse_psxtexfile(BytesIO(buffer))
+    assert len(reader) == len(textures) == 4
+    assert [tuple(bytes(field) if isinstance(field, memoryview) else field for field in texture) for texture in reader] == textures
+    assert reader[-1][0] == 3
+    assert validate_psxtexfile(buffer) == []
+#
+
+def test_reader_stops_at_truncated_texture(tmp_path: Path):
+    buffer = make_psxtexfile()
+    (tmp_path / "truncated.tex").write_bytes(buffer[:-1])
+    with open(tmp_path / "truncated.tex", "rb") as f:
+        reader = PSXTexFileReader.open(f)
+        assert len(reader) == len(parse_psxtexfile(BytesIO(buffer[:-1]))) == 3
+    assert len(validate_psxtexfile(buffer[:-1])) == 1
+#
@@ -0,0 +1,100 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from pathlib import Path
+import json
+
+import numpy as np
+from PIL import Image
+from scg_tools.TEX2TXG import convert_texture, convert_tree, select_gcmaterial_mode
+from scg_tools.tex import encode_psxtexfile, write_psxtexfile
+from scg_tools.txg import GCMaterialsReader
+
+def make_textures(seed: int, count: int) -> list[tuple]:
+    rng = np.random.default_rng(seed)
+    textures = list[tuple]()
+    for n in range(count):
+        image = Image.fromarray(rng.integers(0, 256, (8, 8, 3), dtype=np.uint8), "RGB")
+        [mode, unk1, unk2, width, height, data, palette] = encode_psxtexfile([image], 2)[0]
+        textures.append((mode, n % 2, n, width, height, data, palette))  # unk1 picks CMPR or RGBA32
+    return textures
+#
+
+def write_tex(path: Path, textures: list[tuple]):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "wb") as f:
+        write_psxtexfile(f, textures)
+#
+
+def read_txg(path: Path) -> list[tuple]:
+    with open(path, "rb") as f:
+        return [(gcmaterial.mode, gcmaterial.width, gcmaterial.height, bytes(gcmaterial.data)) for gcmaterial in GCMaterialsReader.open(f)]
+#
+
+def run(src: Path, dst: Path, capsys, cmpr_quality: str = "fast") -> str:
+    assert convert_tree(str(src), str(dst), dst / "TEX2TXG_manifest.json", cmpr_quality, None, 1) == 0
+    return capsys.readouterr().out.splitlines()[-1]
+#
+
+def test_tree_conversion_is_incremental(tmp_path: Path, capsys):
+    src = tmp_path / "src"; dst = tmp_path / "dst"
+    write_tex(src / "a.tex", make_textures(0, 3))
+    write_tex(src / "sub" / "b.tex", make_textures(1, 2))
+    (src / "notes.txt").write_text("not a PSXtexfile")
+
+    assert run(src, dst, capsys).startswith("2 files (2 converted, 0 up to date, 0 removed), 5 textures encoded, 0 reused")
+    assert sorted(path.relative_to(dst).as_posix() for path in dst.rglob("*") if path.is_file()) == ["TEX2TXG_manifest.json", "a.txg", "sub/b.txg"]
+    expected = [(gcmaterial.mode, gcmaterial.width, gcmaterial.height, gcmaterial.data)
+                for gcmaterial in (convert_texture(mode, unk1, width, height, data, palette, "fast") for [mode, unk1, unk2, width, height, data, palette] in make_textures(0, 3))]
+    assert read_txg(dst / "a.txg") == expected
+    manifest = json.loads((dst / "TEX2TXG_manifest.json").read_text())
+    assert sorted(manifest["files"]) == ["a.tex", "sub/b.tex"]
+    assert len(manifest["files"]["a.tex"]["textures"]) == 3
+
+    # Nothing changed, so nothing is done.
+    assert run(src, dst, capsys).startswith("2 files (0 converted, 2 up to date, 0 removed), 0 textures encoded, 0 reused")
+
+    # Only the texture that was added gets encoded; the rest are taken from the previous output.
+    write_tex(src / "a.tex", make_textures(0, 3) + make_textures(2, 1))
+    assert run(src, dst, capsys).startswith("2 files (1 converted, 1 up to date, 0 removed), 1 textures encoded, 3 reused")
+    assert read_txg(dst / "a.txg")[:3] == expected
+
+    # Output that no longer matches the manifest is not trusted.
+    with open(dst / "sub" / "b.txg", "r+b") as f:
+        f.seek(-1, 2); f.write(b'\xff')
+    assert run(src, dst, capsys).startswith("2 files (1 converted, 1 up to date, 0 removed), 2 textures encoded, 0 reused")
+
+    # Different options redo everything.
+    assert run(src, dst, capsys, "quality").startswith("2 files (2 converted, 0 up to date, 0 removed), 6 textures encoded, 0 reused")
+#
+
+def test_auto_format_selection():
+    flat = np.zeros((8, 8, 4), dtype=np.uint8); flat[..., 2:] = 255
+    assert select_gcmaterial_mode(flat, 6.0)[0] == 0
+    translucent = flat.copy(); translucent[0, 0, 3] = 128
+    assert select_gcmaterial_mode(translucent, 6.0) == (1, None)  # Only punch-through alpha fits CMPR
+    assert select_gcmaterial_mode(flat[:4], 6.0) == (1, None)  # Not whole 8x8 tiles
+    noise = np.random.default_rng(0).integers(0, 256, (8, 8, 4), dtype=np.uint8); noise[..., 3] = 255
+    assert select_gcmaterial_mode(noise, 6.0) == (1, None)
+    # An opaque flat texture becomes CMPR even though unk1 asks for RGBA32, but only when selection is on.
+    [[mode, unk1, unk2, width, height, data, palette]] = encode_psxtexfile([Image.new("RGB", (8, 8), (255, 0, 0))], 2)
+    assert convert_texture(mode, 1, width, height, data, palette, "fast", 6.0).mode == 0
+    assert convert_texture(mode, 1, width, height, data, palette, "fast").mode == 1
+#
+
+def test_removed_inputs_leave_the_manifest(tmp_path: Path, capsys):
+    src = tmp_path / "src"; dst = tmp_path / "dst"
+    write_tex(src / "a.tex", make_textures(0, 1))
+    write_tex(src / "b.tex", make_textures(1, 1))
+    write_tex(src / "c.tex", make_textures(2, 1))
+    run(src, dst, capsys)
+    (src / "b.tex").unlink()
+    (src / "c.tex").unlink()
+    with open(dst / "c.txg", "ab") as f:
+        f.write(b'edited')
+    assert run(src, dst, capsys).startswith("1 files (0 converted, 1 up to date, 1 removed)")
+    assert list(json.loads((dst / "TEX2TXG_manifest.json").read_text())["files"]) == ["a.tex"]
+    # The untouched output goes with its input; the edited one is left for the user.
+    assert sorted(path.name for path in dst.iterdir()) == ["TEX2TXG_manifest.json", "a.txg", "c.txg"]
+#
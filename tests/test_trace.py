@@ -0,0 +1,52 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from pathlib import Path
+import json
+import subprocess
+import sys
+
+import pytest
+from scg_tools import trace
+
+@pytest.fixture(autouse=True)
+def reset():
+    yield
+    trace.configure()
+#
+
+def test_console_and_trace_file(tmp_path: Path, capsys):
+    trace_path = tmp_path / "trace.jsonl"
+    trace.configure(False, str(trace_path))
+    trace.event("chunk", "loading chunk", tid="HEAD", size=12)
+    trace.event("chunk_parsed", tid="HEAD")
+    trace.warning("odd", "something odd", count=2)
+    assert capsys.readouterr().out.splitlines() == ["loading chunk", "something odd"]
+    trace.configure()
+    records = [json.loads(line) for line in trace_path.read_text().splitlines()]
+    assert [(record["event"], record["level"]) for record in records] == [("chunk", "INFO"), ("chunk_parsed", "INFO"), ("odd", "WARNING")]
+    assert (records[0]["tid"], records[0]["size"], records[2]["count"]) == ("HEAD", 12, 2)
+#
+
+def test_quiet_keeps_warnings(capsys):
+    trace.configure(True)
+    assert not trace.enabled
+    trace.event("chunk", "loading chunk")
+    trace.warning("odd", "something odd")
+    assert capsys.readouterr().out.splitlines() == ["something odd"]
+#
+
+def test_configure_from_argv(tmp_path: Path):
+    trace_path = tmp_path / "trace.jsonl"
+    assert trace.configure_from_argv(["a", "--quiet", "--trace", str(trace_path), "b"]) == ["a", "b"]
+    assert trace.enabled and trace_path.exists()
+    assert trace.configure_from_argv(["--trace={:s}".format(str(trace_path)), "c"]) == ["c"]
+#
+
+def test_import_leaves_logging_alone():
+    # A fresh interpreter, since this one has been configured by other tests.
+    script = "from scg_tools import trace; print(trace.enabled, [type(handler).__name__ for handler in trace.logger.handlers], trace.logger.propagate)"
+    output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True).stdout
+    assert output.split("\n")[0] == "False ['NullHandler'] True"
+#
@@ -0,0 +1,194 @@
+# Copyright 2023 Bradley G (Minty Meeo)
+# SPDX-License-Identifier: MIT
+
+from __future__ import annotations
+from io import BytesIO
+from pathlib import Path
+from struct import unpack_from
+
+import numpy as np
+import pytest
+from PIL import Image
+from scg_tools.misc import align_up
+from scg_tools.santacruz_txg import command_encode
+from scg_tools.txg import GCMaterial, GCMaterialsError, GCMaterialsReader, bc1_to_cmpr, cmpr_error, cmpr_qualities, cmpr_to_bc1, decode_cmpr, decode_rgba32, \
+                          encode_cmpr, encode_rgba32, parse_gcmaterials, validate_gcmaterials, \
+                          write_gcmaterials
+
+# Plain per-pixel decoders, written the way gclib does it, for checking the vectorized ones against.
+def reference_palette(color0: int, color1: int) -> list[tuple[int, int, int, int]]:
+    def rgb(color: int) -> tuple[int, int, int]:
+        return ((color >> 11 & 31) * 255 // 31, (color >> 5 & 63) * 255 // 63, (color & 31) * 255 // 31)
+    rgb0 = rgb(color0); rgb1 = rgb(color1)
+    if color0 > color1:
+        return [(*rgb0, 255), (*rgb1, 255), (*[(2 * a + b) // 3 for [a, b] in zip(rgb0, rgb1)], 255), (*[(a + 2 * b) // 3 for [a, b] in zip(rgb0, rgb1)], 255)]
+    return [(*rgb0, 255), (*rgb1, 255), (*[a // 2 + b // 2 for [a, b] in zip(rgb0, rgb1)], 255), (0, 0, 0, 0)]
+#
+
+def reference_decode_cmpr(data: bytes, width: int, height: int) -> np.ndarray:
+    pixels = np.zeros((align_up(height, 8), align_up(width, 8), 4), dtype=np.uint8)
+    offset = 0
+    for tile_y in range(0, pixels.shape[0], 8):
+        for tile_x in range(0, pixels.shape[1], 8):
+            for [block_y, block_x] in ((0, 0), (0, 4), (4, 0), (4, 4)):
+                [color0, color1] = unpack_from(">HH", data, offset)
+                palette = reference_palette(color0, color1)
+                for row in range(4):
+                    bits = data[offset + 4 + row]
+                    for column in range(4):
+                        pixels[tile_y + block_y + row, tile_x + block_x + column] = palette[bits >> 6 - 2 * column & 3]
+                offset += 8
+    return pixels[:height, :width]
+#
+
+def reference_decode_bc1(data: bytes, width: int, height: int) -> np.ndarray:
+    pixels = np.zeros((align_up(height, 4), align_up(width, 4), 4), dtype=np.uint8)
+    offset = 0
+    for block_y in range(0, pixels.shape[0], 4):
+        for block_x in range(0, pixels.shape[1], 4):
+            [color0, color1] = unpack_from("<HH", data, offset)
+            palette = reference_palette(color0, color1)
+            for row in range(4):
+                bits = data[offset + 4 + row]
+                for column in range(4):
+                    pixels[block_y + row, block_x + column] = palette[bits >> 2 * column & 3]
+            offset += 8
+    return pixels[:height, :width]
+#
+
+def reference_decode_rgba32(data: bytes, width: int, height: int) -> np.ndarray:
+    pixels = np.zeros((align_up(height, 4), align_up(width, 4), 4), dtype=np.uint8)
+    offset = 0
+    for tile_y in range(0, pixels.shape[0], 4):
+        for tile_x in range(0, pixels.shape[1], 4):
+            for n in range(16):
+                [a, r] = data[offset + 2 * n:offset + 2 * n + 2]
+                [g, b] = data[offset + 32 + 2 * n:offset + 32 + 2 * n + 2]
+                pixels[tile_y + n // 4, tile_x + n % 4] = (r, g, b, a)
+            offset += 64
+    return pixels[:height, :width]
+#
+
+def cmpr_size(width: int, height: int) -> int:
+    return align_up(width, 8) * align_up(height, 8) // 2
+#
+
+sizes = [(8, 8), (16, 8), (24, 16), (12, 4), (4, 12), (1, 1)]
+
+@pytest.mark.parametrize("width, height", sizes)
+def test_decode_cmpr_matches_reference(width: int, height: int):
+    data = np.random.default_rng(width * height).integers(0, 256, cmpr_size(width, height), dtype=np.uint8).tobytes()
+    assert np.array_equal(decode_cmpr(data, width, height), reference_decode_cmpr(data, width, height))
+#
+
+@pytest.mark.parametrize("width, height", sizes)
+def test_decode_rgba32_matches_reference(width: int, height: int):
+    data = np.random.default_rng(width * height).integers(0, 256, align_up(width, 4) * align_up(height, 4) * 4, dtype=np.uint8).tobytes()
+    assert np.array_equal(decode_rgba32(data, width, height), reference_decode_rgba32(data, width, height))
+#
+
+@pytest.mark.parametrize("width, height", [(8, 8), (16, 12), (12, 4)])
+def test_rgba32_round_trip(width: int, height: int):
+    pixels = np.random.default_rng(5).integers(0, 256, (height, width, 4), dtype=np.uint8)
+    data = encode_rgba32(pixels)
+    assert len(data) == width * height * 4
+    assert np.array_equal(decode_rgba32(data, width, height), pixels)
+#
+
+@pytest.mark.parametrize("quality", cmpr_qualities)
+def test_encode_cmpr_two_colors_is_lossless(quality: str):
+    # Colors that RGB565 represents exactly, two per sub-block, come back unchanged.  The fast tier uses corners of
+    # the bounding box, so one color of each pair is made the brighter one in every channel.
+    rng = np.random.default_rng(6)
+    endpoints = np.array([[(color >> 11 & 31) * 255 // 31, (color >> 5 & 63) * 255 // 63, (color & 31) * 255 // 31] for color in rng.integers(0, 0x10000, 8)], dtype=np.uint8)
+    [endpoints[0::2], endpoints[1::2]] = [np.maximum(endpoints[0::2], endpoints[1::2]), np.minimum(endpoints[0::2], endpoints[1::2])]
+    pixels = np.empty((8, 8, 4), dtype=np.uint8)
+    pixels[..., 3] = 255
+    for [n, [y, x]] in enumerate(((0, 0), (0, 4), (4, 0), (4, 4))):
+        pixels[y:y + 4, x:x + 4, :3] = endpoints[2 * n + rng.integers(0, 2, (4, 4))]
+    data = encode_cmpr(pixels, quality)
+    assert len(data) == 32
+    assert np.array_equal(decode_cmpr(data, 8, 8), pixels)
+    assert cmpr_error(pixels, data) == 0
+#
+
+@pytest.mark.parametrize("quality", cmpr_qualities)
+def test_encode_cmpr_punch_through_alpha(quality: str):
+    pixels = np.full((8, 8, 4), 200, dtype=np.uint8)
+    pixels[::2, :, 3] = 0
+    decoded = decode_cmpr(encode_cmpr(pixels, quality), 8, 8)
+    assert np.array_equal(decoded[..., 3], np.where(pixels[..., 3] >= 128, 255, 0))
+#
+
+def test_encode_cmpr_quality_beats_fast():
+    y, x = np.mgrid[0:32, 0:32]
+    pixels = np.stack((x * 8, y * 8, (x + y) * 4, np.full_like(x, 255)), axis=2).astype(np.uint8)
+    errors = {quality: cmpr_error(pixels, encode_cmpr(pixels, quality)) for quality in cmpr_qualities}
+    assert errors["quality"] <= errors["fast"] < 8
+#
+
+@pytest.mark.parametrize("width, height", sizes)
+def test_cmpr_to_bc1_decodes_the_same(width: int, height: int):
+    data = np.random.default_rng(7).integers(0, 256, cmpr_size(width, height), dtype=np.uint8).tobytes()
+    bc1 = cmpr_to_bc1(data, width, height)
+    assert len(bc1) == align_up(width, 4) * align_up(height, 4) // 2
+    assert np.array_equal(reference_decode_bc1(bc1, width, height), decode_cmpr(data, width, height))
+    assert cmpr_to_bc1(bc1_to_cmpr(bc1, width, height), width, height) == bc1
+    if width % 8 == 0 and height % 8 == 0:
+        assert bc1_to_cmpr(bc1, width, height) == data
+#
+
+def test_dds_round_trip():
+    data = np.random.default_rng(8).integers(0, 256, cmpr_size(16, 8), dtype=np.uint8).tobytes()
+    io = BytesIO()
+    GCMaterial(0, 0, 0, 0, 16, 8, data).export_dds(io)
+    io.seek(0)
+    gcmaterial = GCMaterial.import_dds(io)
+    assert (gcmaterial.mode, gcmaterial.width, gcmaterial.height, gcmaterial.data) == (0, 16, 8, data)
+#
+
+def test_gcmaterials_round_trip():
+    rng = np.random.default_rng(9)
+    gcmaterials = [GCMaterial.encode_rgba(rng.integers(0, 256, (8, 16, 4), dtype=np.uint8), mode) for mode in (0, 1, 0)]
+    io = BytesIO(); write_gcmaterials(io, gcmaterials)
+    buffer = io.getvalue()
+    assert validate_gcmaterials(buffer) == []
+    parsed = parse_gcmaterials(BytesIO(buffer))
+    reader = GCMaterialsReader(buffer)
+    assert len(parsed) == len(reader) == 3
+    for [expected, a, b] in zip(gcmaterials, parsed, reader):
+        assert (a.mode, a.width, a.height, a.data) == (b.mode, b.width, b.height, bytes(b.data)) == (expected.mode, expected.width, expected.height, expected.data)
+    assert reader[-1].mode == 0
+#
+
+def test_validate_gcmaterials_reports_truncation():
+    gcmaterials = [GCMaterial.encode_rgba(np.zeros((8, 8, 4), dtype=np.uint8), 1)]
+    io = BytesIO(); write_gcmaterials(io, gcmaterials)
+    assert len(validate_gcmaterials(io.getvalue()[:-1])) == 1
+    assert validate_gcmaterials(io.getvalue()[:6]) == ["Header table is truncated"]
+    with pytest.raises(EOFError):
+        GCMaterialsReader(io.getvalue()[:6])
+#
+
+def test_write_gcmaterials_checks_the_count():
+    gcmaterials = [GCMaterial.encode_rgba(np.zeros((8, 8, 4), dtype=np.uint8), 1)] * 2
+    for [source, count] in ((gcmaterials, 3), (iter(gcmaterials), 1), (iter(gcmaterials), 3)):
+        io = BytesIO()
+        with pytest.raises(GCMaterialsError):
+            write_gcmaterials(io, source, count)
+    io = BytesIO()
+    with pytest.raises(GCMaterialsError):
+        write_gcmaterials(io, gcmaterials, 3)
+    assert io.getvalue() == b''  # A known length is checked before anything is written
+#
+
+def test_failed_encode_keeps_the_old_output(tmp_path: Path):
+    Image.new("RGBA", (8, 8)).save(tmp_path / "a.png")
+    output = tmp_path / "out.txg"
+    assert command_encode(["-o", str(output), "1", str(tmp_path / "a.png")]) == 0
+    before = output.read_bytes()
+    with pytest.raises(FileNotFoundError):
+        command_encode(["-o", str(output), "1", str(tmp_path / "a.png"), "1", str(tmp_path / "missing.png")])
+    assert output.read_bytes() == before
+    assert [path.name for path in tmp_path.iterdir() if path.suffix == ".tmp"] == []
+#